@@ -11,7 +11,7 @@ def usage():
 NetConf Commander - CLI version %s - tool for sending file requests to netconf device and getting responses back
 
 By design it doesn't allocate any big structures in memory so it is suitable to handle huge requests and responses.
-Requests are parsed and sent to netconf device line-by-line. Responses are processed line-by-line and stored to files.
+Requests are sent to netconf device in large chunks. Responses are processed chunk-by-chunk and stored to files.
 It requires 'sshpass' utility (see the note bellow for details how to get sshpass).
 
 NetConf Commander - CLI version supports:
@@ -40,13 +40,64 @@ usage: nc.py [ -time] -connect user:password@host[:port][ -hrf][ -hello][ -hello
                           existing file is overwritten without any warnings, exisitng token '${i}' is replaced by loop counter
     -nors             ... do not store responses (feeds responses to /dev/null)
     -file request.xml ... send reqest from file 'request.xml', can be used multiple times to send sequence of various requests
-                          token '${TIMESTAMP}' is replaced by current unix timestamp (recommended for message-id attribute)
+                          token '${TIMESTAMP}' is replaced by unix timestamp taken once per run (the same in all requests,
+                          '${MSGID}' is unique per request), '${i}' by loop counter formatted as in -rs prefix ('001'),
+                          request files are parsed once and rendered again only when value of some token changes
+                          (requests larger than -chunk size are streamed from file and never compiled), response status
+                          (OK, ERROR: tag, DATA or first tag name) is detected while response is stored from the first
+                          element of rpc-reply without parsing it again
+    -subscribe s[,sec]... send create-subscription for stream s (or request file s with own create-subscription) and
+                          receive notifications for sec seconds (default till session ends or ctrl-c), notifications
+                          are written to rs prefix + 'notifications-<time>-<n>.xml' files (only counted with -nors),
+                          event rate, throughput and backlog (received data not processed yet) are printed periodically
+    -rotate size[,sec]... start new notifications file after size bytes (k, M, G suffix) or sec seconds (0 = no limit)
+    -report sec       ... seconds between notification rate reports (default 1)
+    -scenario file    ... run steps from scenario file compiled once before start - step per line with the same operations
+                          as parameters (connect, hello, hellofile, file, rs, nors, var, get, sleep, commit, close, loop n),
+                          leading '-' is optional, 'loop n' ... 'end' blocks can be nested, '#' starts comment line,
+                          request files are preloaded (not checked for changes), tokens '${i}' (innermost loop counter),
+                          '${i1}' '${i2}' .. (counter of loop at nesting level) and in response prefix also '${n}'
+                          (executions of step), request steps in loops which took most time are printed at the end
+    -inventory file   ... run all following parameters against each device from file (line format 'user:pass@host[:port][ name]')
+                          in parallel, responses use per device prefix ('${DEVICE}' in -rs prefix or device name appended)
+    -workers n        ... max number of devices processed in parallel by -inventory (default 16)
+    -sessions n       ... open n sessions to device from following -connect and run all following parameters in all of them
+                          in parallel, responses use per session prefix like -inventory (session names s001 .. sNNN)
+    -rate r           ... open-loop mode - send -file requests at r rpc/s without waiting for responses (like -pipeline),
+                          rq/rs times and latency are measured from the intended send time so queueing is not hidden
+    -ramp step,n      ... with -rate increase rate by step after each n requests, each step reports achieved rate
+                          and latency percentiles (finds where device saturates)
+    -stats file       ... export latency percentiles and rates per operation (loop, session, device, fleet) to file
+                          at the end, format is csv for '.csv' extension otherwise json
+    -pipeline n       ... keep up to n requests from -file in flight, responses are matched to requests by message-id
+                          (token '${MSGID}' is replaced by unique number of request in session, use it for message-id)
+    -transport name   ... 'ssh' (default) runs sshpass + ssh client process per session, 'paramiko' uses in-process ssh channel
+                          (requires paramiko module, no sshpass, connection is ready right after ssh handshake),
+                          must precede -connect, -inventory and -sessions
+    -trace file[,file]... per rpc phase times - send, ttfb (time to first response byte), transfer, store (storing or
+                          parsing), json line per rpc for file with other than '.prom' extension and prometheus
+                          textfile with phase totals and latency percentiles for '.prom' file
+    -archive          ... append responses to single archive (rs prefix + 'archive.seg') with index ('archive.idx', line per
+                          response: iteration, request, timestamp, offset, length, response name) instead of file
+                          per response (token '${i}' is dropped from prefix), suitable for long loops
+    -store            ... store responses to content-addressed store (rs prefix + 'store' directory), rpc-reply start tag
+                          goes to manifest ('manifest.jsonl', line per response) and the rest is stored once per unique
+                          content as gzip file named by its sha1 ('objects/'), for long polling of unchanged data
+    -extract a[:i[:f]]... print index of archive or store a (path without extension or store directory) or responses
+                          of iteration i (* for all) optionally only for request file f
+    -restore a[:i[:f]]... rebuild original response files (all or selected like -extract) from archive or store a
+    -chunk size       ... max chunk size in bytes for sending requests (default 1048576, 0 = whole request as single chunk)
     -sleep seconds    ... sleep seconds before continuing (can be also float number like 1.25)
     -commit           ... perform built-in COMMIT-CHANGES operation
     -close            ... perform built-in CLOSE-SESSION  operation
     -var name=value   ... set NAME to value used for token replacement in request templates (default TIMESTAMP value is unix time())
-    -get name         ... prints text value of the first xml tag with name, requires response file (also memory hungry for big responses)
-    -debug f1,f2      ... activate debug mode for method f1, or comma separated list of names (* act as a wildcard to match all)
+    -get name,path    ... prints text value of the first xml tag with name, requires response file, comma separated list
+                          of names or simple paths ('/rpc-reply/data/a/b' from root, 'a/b' or '//a/b' anywhere, '*' any tag)
+                          response is parsed incrementally in constant memory and only till all values are found
+    -debug f1,f2      ... activate debug mode for method f1, or comma separated list of names (* act as a wildcard, 'recv_*'
+                          or '*' to match all), messages are formatted only for active methods
+    -dbgring n        ... keep last n debug records of all methods in memory (cheap, suitable for long soak tests)
+                          and print them to stderr when an error occurs
     -help             ... shows this help
     -examples         ... usage examples
 
@@ -62,9 +113,15 @@ Here are short versions for frequently used parameters, each line represents equ
   '-o' '-hellofile' '-hellorq'
   '-s' '-sleep'
   '-v' '-dbg' '-debug'
+  '-dbgring' '-ring'
   '-hrf' '-hformat'
   '-var' '-set'
   '-get' '-tag'
+  '-p' '-pipeline'
+  '-i' '-inventory' '-devices'
+  '-w' '-workers'
+  '-scenario' '-script'
+  '-subscribe' '-notifications'
 
 UUT CONFIG: To congifure netconf to listen on standard tcp port 830 use following statements in the config menu:
   ssh server netconf port 830
@@ -75,6 +132,10 @@ Use either system installed one or the one included in the package compiled on a
 There is also version 1.00 available here: /auto/catch/Published/tools/sshpass/bin/sshpass,
 so just copy it to the directory where nc.py is located or setup your PATH variable.
 To verify sshpass setup use the command 'sshpass -V' to print copyright and version information.
+With '-transport paramiko' neither sshpass nor ssh client are needed.
+
+TESTING: ncserver.py is a local stand-in netconf server (ssh subsystem via paramiko or -stdio), see 'ncserver.py -help'.
+test_nc.py runs nc.py against it ('python test_nc.py').
 
 """ % __version__
 
@@ -96,85 +157,1491 @@ $ nc.py -con root:toor@localhost:8830
    CONNECT:                 root:toor@localhost:8830 ... OK
 
 
-2 - perform HELLO handshake (shows session id) and show timestamps:
+2 - perform HELLO handshake (shows session id) and show timestamps:
+
+$ nc.py -time -con root:toor@localhost:8830 -hello
+[2014-10-22 00:11:56]    CONNECT:                 root:toor@localhost:8830 ... OK
+[2014-10-22 00:11:56]      HELLO:                          session_id=3832 sent:    657 [Bytes], recv:  18042 [Bytes], rq.time:    0.0 [ms], rs.time:  456.2 [ms]
+
+
+3 - perform get-config operation, response will be stored in 'rs-get-config.xml' file:
+
+$ nc.py -con root:toor@localhost:8830 -hello -file get-config.xml
+   CONNECT:                 root:toor@localhost:8830 ... OK
+     HELLO:                         session_id=29632 sent:    657 [Bytes], recv:  18043 [Bytes], rq.time:    0.0 [ms], rs.time:  432.0 [ms]
+      FILE:      get-config.xml -> rs-get-config.xml sent:    254 [Bytes], recv:   2956 [Bytes], rq.time:    0.1 [ms], rs.time:  642.0 [ms]
+
+
+4 - repeat 3 times get-config operation, do not store responses:
+
+$ nc.py -con root:toor@localhost:8830 -hello -nors -loop 3 -file rq/get-config.xml
+   CONNECT:                 root:toor@localhost:8830 ... OK
+     HELLO:                         session_id=32077 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    54.5 ms
+      LOOP:                              REPEAT 3 x  ... START
+   1. FILE:           rq/get-config.xml -> /dev/null sent:     252 Bytes, recv:    2954 Bytes, rq:     9.2 ms, rs:   712.1 ms
+   2. FILE:           rq/get-config.xml -> /dev/null sent:     252 Bytes, recv:    2954 Bytes, rq:     0.4 ms, rs:   712.1 ms
+   3. FILE:           rq/get-config.xml -> /dev/null sent:     252 Bytes, recv:    2954 Bytes, rq:     0.4 ms, rs:   710.8 ms
+      LOOP:                    === SUMMARY.STATS === sent:     756 Bytes, recv:    8862 Bytes, rq:    10.0 ms, rs:  2134.9 ms
+
+
+5 - repeat 3 times get-config, read requests from subdir rq and store responses to subdir rs with loop counter as prefix:
+
+$ nc.py -time -con root:toor@localhost:8830 -hello -rs 'rs/${i}-' -loop 3 -file rq/get-config.xml
+[2014-10-24 23:58:39]    CONNECT:                 root:toor@localhost:8830 ... OK
+[2014-10-24 23:58:39]      HELLO:                         session_id=13541 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    52.8 ms
+[2014-10-24 23:58:39]       LOOP:                              REPEAT 3 x  ... START
+[2014-10-24 23:58:40]    1. FILE: rq/get-config.xml -> rs/001-get-config.xml sent:     252 Bytes, recv:    2954 Bytes, rq:     0.1 ms, rs:   738.4 ms
+[2014-10-24 23:58:40]    2. FILE: rq/get-config.xml -> rs/002-get-config.xml sent:     252 Bytes, recv:    2954 Bytes, rq:     0.1 ms, rs:   709.6 ms
+[2014-10-24 23:58:41]    3. FILE: rq/get-config.xml -> rs/003-get-config.xml sent:     252 Bytes, recv:    2954 Bytes, rq:     0.1 ms, rs:   709.2 ms
+[2014-10-24 23:58:41]       LOOP:                    === SUMMARY.STATS === sent:     756 Bytes, recv:    8862 Bytes, rq:     0.3 ms, rs:  2157.2 ms
+
+
+6 - lock candidate, wait 5.1 seconds then unlock candidate, do not store responses:
+
+$ nc.py -time -con root:toor@localhost:8830 -hello -nors -file rq/lock-candidate.xml -sleep 5.1 -file rq/unlock-candidate.xml
+[2014-10-24 23:59:42]    CONNECT:                 root:toor@localhost:8830 ... OK
+[2014-10-24 23:59:42]      HELLO:                         session_id=11243 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    55.8 ms
+[2014-10-24 23:59:42]       FILE:       rq/lock-candidate.xml -> /dev/null sent:     242 Bytes, recv:     153 Bytes, rq:    17.8 ms, rs:   100.8 ms
+[2014-10-24 23:59:42]      SLEEP:                             for 5.10 sec ... 5.10 s
+[2014-10-24 23:59:47]       FILE:     rq/unlock-candidate.xml -> /dev/null sent:     246 Bytes, recv:     153 Bytes, rq:     0.1 ms, rs:   100.8 ms
+
+
+7 - get hostname
+
+$ nc.py -time -con root:toor@localhost:8830 -hello -rq rq/host-name/get-hostname.xml -get host-name
+[2014-11-14 00:34:19] NC.CONNECT:                 root:toor@localhost:8830.......... OK
+[2014-11-14 00:34:26]      HELLO:                         session_id=11380 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    60.6 ms
+[2014-11-14 00:34:26]       FILE: rq/host-name/get-hostname.xml -> rs-get-hostname.xml sent:     385 Bytes, recv:     324 Bytes, rq:     0.1 ms, rs:   101.7 ms
+[2014-11-14 00:34:26]        TAG:                  host-name = host.domain ... GET
+
+
+8 - change hostname
+
+$ nc.py -time -con root:toor@localhost:8830 -hello -var HOSTNAME=host.domain -rq rq/host-name/set-hostname.xml -commit
+[2014-11-14 00:36:13] NC.CONNECT:                 root:toor@localhost:8830.......... OK
+[2014-11-14 00:36:20]      HELLO:                         session_id=11940 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    61.4 ms
+[2014-11-14 00:36:20]        VAR:                ${HOSTNAME} = host.domain ... SET
+[2014-11-14 00:36:20]       FILE: rq/host-name/set-hostname.xml -> rs-set-hostname.xml sent:     415 Bytes, recv:     217 Bytes, rq:     0.1 ms, rs:   101.5 ms
+[2014-11-14 00:36:20]     COMMIT:                                       OK sent:     415 Bytes, recv:     217 Bytes, rq:     0.1 ms, rs:   101.5 ms
+
+
+9 - get-config from all devices listed in devices.txt, 50 devices at once, responses stored to rs/<device name>-get-config.xml
+
+$ nc.py -time -workers 50 -rs 'rs/${DEVICE}-' -inventory devices.txt -hello -file rq/get-config.xml -close
+
+
+10 - load test - 20 parallel sessions each looping 100 x get-config, rpc/s per session and total are reported
+
+$ nc.py -nors -sessions 20 -con root:toor@localhost:8830 -hello -loop 100 -file rq/get-config.xml
+
+11 - find saturation - start at 10 rpc/s and add 10 rpc/s every 200 requests up to 100 rpc/s
+
+$ nc.py -nors -rate 10 -ramp 10,200 -con root:toor@localhost:8830 -hello -loop 2000 -file rq/get-config.xml
+
+12 - in-process ssh against local stand-in server (no sshpass, 200 sessions without 400 ssh processes)
+
+$ ./ncserver.py -port 8830 -data rs-get-config.xml &
+$ nc.py -transport paramiko -nors -sessions 200 -con root:toor@localhost:8830 -hello -loop 10 -file get-config.xml
+
+13 - scenario - 100 x (get-config and 5 x edit-config with commit), responses per iteration rs/001-1-edit-config.xml ..
+
+$ cat scenario.txt
+hello
+rs rs/${i1}-
+loop 100
+  file get-config.xml
+  loop 5
+    rs rs/${i1}-${i2}-
+    file edit-config.xml
+    commit
+  end
+  rs rs/${i1}-
+end
+close
+$ nc.py -time -con root:toor@localhost:8830 -scenario scenario.txt
+
+14 - receive notifications for a day, new file every 100 MB or hour, rates reported every 10 seconds
+
+$ nc.py -time -con root:toor@localhost:8830 -hello -rs notif/ -rotate 100M,3600 -report 10 -subscribe NETCONF,86400 -close
+
+""" % __version__
+
+
+import subprocess
+import sys
+import time
+import re
+import os
+import fcntl
+import io
+import select
+import errno
+import socket
+import warnings
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import datetime
+import fnmatch
+import mmap
+import hashlib
+import zlib
+import gzip
+import collections
+import multiprocessing
+import StringIO
+import array
+import json
+import csv
+import ctypes
+import ctypes.util
+import termios
+
+
+def monotonic_clock():
+    """
+    monotonic clock in seconds (not affected by system time changes) - clock_gettime() on linux and mac,
+    time.time() where not available
+    """
+    if hasattr(time, 'monotonic'): return time.monotonic
+    clock_id = {'linux': 1, 'darwin': 6}.get(sys.platform.rstrip('0123456789'))
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError, TypeError):
+        clock_id = None
+    if clock_id is None: return time.time
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    ts = timespec()
+
+    def monotonic():
+        if clock_gettime(clock_id, ctypes.byref(ts)) != 0: return time.time()
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = monotonic_clock()
+
+
+class Histogram:
+    """
+    Fixed memory log-linear latency histogram (microsecond resolution, < 1% relative error, up to ~1 hour)
+    """
+
+    # linear sub-buckets per power of two (first SUB values are exact)
+    SUB  = 128
+    HALF = 64
+    MAXV = 1 << 32
+
+    def __init__(self):
+        self.counts = array.array('L', [0]) * ((self.MAXV.bit_length() - 6) * self.HALF)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        return
+
+
+    def index(self, usec):
+        """
+        bucket index for value in microseconds
+        """
+        if usec < self.SUB: return usec
+        shift = usec.bit_length() - 7
+        return (shift + 1) * self.HALF + (usec >> shift) - self.HALF
+
+
+    def value(self, idx):
+        """
+        middle value of bucket in microseconds
+        """
+        if idx < self.SUB: return idx
+        shift = idx // self.HALF - 1
+        return (((idx % self.HALF) + self.HALF) << shift) + (1 << shift) // 2
+
+
+    def add(self, sec):
+        """
+        record latency in seconds
+        """
+        usec = min(max(int(sec * 1000000), 0), self.MAXV - 1)
+        self.counts[self.index(usec)] += 1
+        self.count += 1
+        self.total += sec
+        if self.min is None or sec < self.min: self.min = sec
+        if self.max is None or sec > self.max: self.max = sec
+        return
+
+
+    def merge(self, other):
+        """
+        add all values recorded by other histogram
+        """
+        for idx, cnt in enumerate(other.counts):
+            if cnt: self.counts[idx] += cnt
+        self.count += other.count
+        self.total += other.total
+        for val in (other.min, other.max):
+            if val is None: continue
+            if self.min is None or val < self.min: self.min = val
+            if self.max is None or val > self.max: self.max = val
+        return
+
+
+    def percentile(self, pct):
+        """
+        latency in seconds under which pct percent of values are
+        """
+        if not self.count: return None
+        if pct >= 100: return self.max
+        rank = max(1, int(self.count * pct / 100.0 + 0.999999))
+        seen = 0
+        for idx, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= rank:
+                return min(max(self.value(idx) / 1000000.0, self.min), self.max)
+        return self.max
+
+
+class XmlPick:
+    """
+    XMLParser target building pruned tree - root element and only subtrees matching wanted paths (with their
+    ancestors), everything else is dropped as it is parsed, so find() on result works as on the full tree
+    """
+
+    def __init__(self, wants=None):
+        """
+        :param wants: tag names or simple paths (see NetConf.compile_path), None keeps the full tree
+        """
+        self.wants = [NetConf.compile_path(expr) for expr in wants] if wants is not None else None
+        self.builder = ET.TreeBuilder()
+        # (tag, attrib) and local name of all open elements
+        self.stack = []
+        self.path = []
+        # open elements already passed to builder, depth of subtree being kept (0 - none)
+        self.built = 0
+        self.keep = 0
+        self.root = None
+        return
+
+
+    def start(self, tag, attrib):
+        self.stack.append((tag, attrib))
+        self.path.append(tag.rsplit('}', 1)[-1])
+        depth = len(self.stack)
+        if self.keep or self.wants is None or depth == 1:
+            pass
+        elif any(NetConf.match_path(self.path, anchored, steps) for anchored, steps in self.wants):
+            self.keep = depth
+        else:
+            return
+        # ancestors of kept element are created lazily
+        for tag, attrib in self.stack[self.built:]:
+            elem = self.builder.start(tag, attrib)
+            if self.root is None: self.root = elem
+        self.built = depth
+        return
+
+
+    def end(self, tag):
+        depth = len(self.stack)
+        if depth <= self.built:
+            self.builder.end(tag)
+            self.built = depth - 1
+        if depth == self.keep:
+            self.keep = 0
+        self.stack.pop()
+        self.path.pop()
+        return
+
+
+    def data(self, data):
+        if self.keep or self.wants is None:
+            self.builder.data(data)
+        return
+
+
+    def close(self):
+        self.builder.close()
+        return self.root
+
+
+class RpcStatus:
+    """
+    Streaming rpc-reply status detection - fed with response data as they are stored, only the beginning of reply
+    is inspected (first child of rpc-reply decides), rpc-error element is buffered till its end to get details,
+    nothing is kept once status is known
+    """
+
+    RPC_REPLY   = re.compile(r'<(?:\w+:)?rpc-reply\b[^>]*>')
+    FIRST_CHILD = re.compile(r'(?:\s|<!--.*?-->|<\?.*?\?>)*<(?:\w+:)?([\w.-]+)(?=[\s/>])', re.S)
+    ERROR_END   = re.compile(r'</(?:\w+:)?rpc-error\s*>')
+    ERROR_FIELD = dict((name, re.compile(r'<(?:\w+:)?error-%s>\s*([^<]*?)\s*</' % name))
+                       for name in ('tag', 'severity', 'type', 'message'))
+    # max bytes inspected
+    limit = 65536
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.start = None
+        self.status = None
+        return
+
+
+    def feed(self, data):
+        """
+        :param data: next part of response
+        :return: True when status is known (no more data needed)
+        """
+        if self.status is not None: return True
+        self.buf.extend(data)
+        if self.start is None:
+            match = self.RPC_REPLY.search(self.buf)
+            if match is None:
+                if len(self.buf) > self.limit: self.status = '?'
+                return self.status is not None
+            self.start = match.end()
+        match = self.FIRST_CHILD.match(self.buf, self.start)
+        if match is None:
+            # first child tag is not complete yet
+            if len(self.buf) > self.limit: self.status = '?'
+            return self.status is not None
+        # status is str, not part of bytearray buffer (it goes to trace records)
+        child = str(match.group(1))
+        if child == 'ok':
+            self.status = 'OK'
+        elif child != 'rpc-error':
+            self.status = child.upper()
+        elif self.ERROR_END.search(self.buf, self.start) is not None or len(self.buf) > self.limit:
+            self.status = self.error(self.buf[self.start:])
+        if self.status is not None: self.buf = None
+        return self.status is not None
+
+
+    def close(self):
+        """
+        end of response
+        :return: status - OK, DATA (or name of other first element), SEVERITY: error-tag for rpc-error, ? unknown
+        """
+        if self.status is None:
+            match = self.FIRST_CHILD.match(self.buf, self.start) if self.start is not None else None
+            self.status = self.error(self.buf[self.start:]) if match and match.group(1) == 'rpc-error' else '?'
+            self.buf = None
+        return self.status
+
+
+    def error(self, xml):
+        """
+        :param xml: rpc-error element (or its beginning)
+        :return: status in the same format as NetConf.rs_status()
+        """
+        fields = {}
+        for name, regex in self.ERROR_FIELD.iteritems():
+            match = regex.search(xml)
+            fields[name] = str(match.group(1)) if match else ''
+        return "%s: %s" % ((fields['severity'] or 'error').upper(), fields['tag'])
+
+
+class Archive:
+    """
+    Append-only response archive - responses are appended to segment file (<base>.seg) and located by index
+    (<base>.idx, tab separated line per response: iteration, request file, timestamp, offset, length, response name),
+    responses are read by memory-mapped random access
+    """
+
+    FIELDS = ('i', 'rq', 'time', 'offset', 'length', 'rs')
+
+    def __init__(self, base, append=False):
+        """
+        :param base: archive path without extension
+        :param append: open for appending responses, otherwise read only
+        """
+        self.base = base
+        self.seg = io.open(base + '.seg', 'ab') if append else None
+        self.idx = io.open(base + '.idx', 'ab', buffering=0) if append else None
+        self.mm = None
+        return
+
+
+    def entry(self, i, rq, rs):
+        """
+        start appending response
+        :param i: loop iteration
+        :param rq: request file name
+        :param rs: response name
+        :return: file-like writer, index record is appended when it is closed
+        """
+        return ArchiveEntry(self, i, rq, rs)
+
+
+    def entries(self):
+        """
+        iterate index records (dicts with FIELDS)
+        :return:
+        """
+        with open(self.base + '.idx', 'rb') as f:
+            for line in f:
+                rec = dict(zip(self.FIELDS, line.rstrip('\n').split('\t')))
+                rec['offset'], rec['length'] = int(rec['offset']), int(rec['length'])
+                yield rec
+
+
+    def read(self, rec):
+        """
+        response content without copying (buffer of memory mapped segment)
+        :param rec: index record
+        :return:
+        """
+        end = rec['offset'] + rec['length']
+        # empty response (or aborted entry) - empty segment can't be mapped
+        if rec['length'] == 0: return buffer('')
+        if self.mm is None or len(self.mm) < end:
+            # segment is mapped again when it grew since last mapping
+            if self.seg is not None: self.seg.flush()
+            if self.mm is not None: self.mm.close()
+            self.mm = None
+            with open(self.base + '.seg', 'rb') as f:
+                if os.fstat(f.fileno()).st_size < end:
+                    raise IOError('%s.seg is shorter than its index (%d < %d)' % (self.base, os.fstat(f.fileno()).st_size, end))
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return buffer(self.mm, rec['offset'], rec['length'])
+
+
+    def open(self, rec):
+        """
+        response as read-only file-like object (for incremental parsing)
+        :param rec: index record
+        :return:
+        """
+        return ArchiveReader(self.read(rec))
+
+
+    def close(self):
+        for f in (self.seg, self.idx, self.mm):
+            if f is not None: f.close()
+        self.seg = self.idx = self.mm = None
+        return
+
+
+class ArchiveEntry:
+    """
+    writer of one archived response
+    """
+
+    def __init__(self, archive, i, rq, rs):
+        self.archive = archive
+        self.rec = dict(i=i, rq=rq, rs=rs, time='%.6f' % time.time())
+        archive.seg.seek(0, os.SEEK_END)
+        self.rec['offset'] = archive.seg.tell()
+        return
+
+
+    def write(self, data):
+        return self.archive.seg.write(data)
+
+
+    def close(self):
+        """
+        finish response and append its index record
+        :return:
+        """
+        seg = self.archive.seg
+        # response must be readable (mmap) as soon as it is indexed
+        seg.flush()
+        self.rec['length'] = seg.tell() - self.rec['offset']
+        self.archive.idx.write('\t'.join(str(self.rec[key]) for key in Archive.FIELDS) + '\n')
+        return
+
+
+    def abort(self):
+        """
+        drop incomplete response - segment is truncated back and nothing is indexed (reads as empty response)
+        :return:
+        """
+        archive = self.archive
+        if archive.mm is not None and len(archive.mm) > self.rec['offset']:
+            archive.mm.close()
+            archive.mm = None
+        archive.seg.truncate(self.rec['offset'])
+        self.rec['length'] = 0
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class ArchiveReader:
+    """
+    read-only file-like object over buffer of archived response (read() copies only requested block)
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        return
+
+
+    def read(self, size=-1):
+        end = len(self.buf) if size is None or size < 0 else min(len(self.buf), self.pos + size)
+        data = self.buf[self.pos:end]
+        self.pos = end
+        return data
+
+
+    def close(self):
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        return False
+
+
+class ResponseStore:
+    """
+    Content-addressed response store - body of each response (everything after rpc-reply start tag, which differs
+    by message-id) is stored once as gzip blob named by its sha1 (<base>/objects/xx/<sha1>.gz), manifest
+    (<base>/manifest.jsonl) has json line per response: iteration, request file, timestamp, response name,
+    rpc-reply head, sha1 and size of body
+    """
+
+    FIELDS = ('i', 'rq', 'time', 'rs', 'sha1', 'size')
+
+    # bodies up to this size are kept in memory till their hash is known (duplicates cost no compression and writes)
+    mem_limit = 4 * 1048576
+    level = 6
+
+    def __init__(self, base, append=False):
+        """
+        :param base: store directory
+        :param append: open for storing responses, otherwise read only
+        """
+        self.base = base
+        self.known = set()
+        self.manifest = None
+        if append:
+            if not os.path.isdir(os.path.join(base, 'objects')): os.makedirs(os.path.join(base, 'objects'))
+            self.manifest = io.open(os.path.join(base, 'manifest.jsonl'), 'ab', buffering=0)
+        return
+
+
+    def blob(self, sha1):
+        return os.path.join(self.base, 'objects', sha1[:2], sha1 + '.gz')
+
+
+    def entry(self, i, rq, rs):
+        """
+        start storing response
+        :param i: loop iteration
+        :param rq: request file name
+        :param rs: response name
+        :return: file-like writer, manifest record is appended when it is closed
+        """
+        return StoreEntry(self, i, rq, rs)
+
+
+    def entries(self):
+        """
+        iterate manifest records
+        :return:
+        """
+        with open(os.path.join(self.base, 'manifest.jsonl'), 'rb') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+    def read(self, rec):
+        """
+        rebuild whole response
+        :param rec: manifest record
+        :return:
+        """
+        # aborted entry
+        if 'sha1' not in rec: return ''
+        with gzip.open(self.blob(rec['sha1']), 'rb') as f:
+            return rec['head'].encode('utf-8') + f.read()
+
+
+    def open(self, rec):
+        """
+        response as read-only file-like object, body is decompressed as it is read
+        :param rec: manifest record
+        :return:
+        """
+        if 'sha1' not in rec: return ArchiveReader('')
+        return StoreReader(rec['head'].encode('utf-8'), gzip.open(self.blob(rec['sha1']), 'rb'))
+
+
+    def close(self):
+        if self.manifest is not None: self.manifest.close()
+        self.manifest = None
+        return
+
+
+class StoreEntry:
+    """
+    writer of one stored response - splits rpc-reply head, hashes body and compresses it only when it is new
+    """
+
+    def __init__(self, store, i, rq, rs):
+        self.archive = store
+        self.rec = collections.OrderedDict([('i', i), ('rq', rq), ('time', round(time.time(), 6)), ('rs', rs)])
+        self.head = bytearray()
+        self.body = None
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        # compressor and temporary blob once body exceeds memory limit
+        self.zip = None
+        self.tmp = None
+        return
+
+
+    def write(self, data):
+        if self.body is not None or self.tmp is not None:
+            return self.add(data)
+        # buffer beginning of response till rpc-reply start tag is complete
+        self.head.extend(data)
+        match = NetConf.RPC_REPLY.search(self.head)
+        if match is None and len(self.head) < NetConf.rdbuf_size: return
+        self.split(match.end() if match is not None else 0)
+        return
+
+
+    def split(self, end):
+        """
+        head is stored in manifest, the rest is the beginning of body
+        :param end:
+        :return:
+        """
+        self.body = bytearray()
+        data, self.head = self.head[end:], self.head[:end]
+        self.add(data)
+        return
+
+
+    def add(self, data):
+        """
+        hash body data and keep it in memory or compress it to temporary blob
+        :param data:
+        :return:
+        """
+        self.sha1.update(data)
+        self.size += len(data)
+        if self.tmp is None:
+            self.body.extend(data)
+            if len(self.body) > self.archive.mem_limit: self.spill()
+        else:
+            self.tmp.write(self.zip.compress(memoryview(data).tobytes()))
+        return
+
+
+    def spill(self):
+        """
+        continue with streaming compression to temporary blob file
+        :return:
+        """
+        self.zip = zlib.compressobj(self.archive.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.tmp = open(os.path.join(self.archive.base, 'objects', 'tmp-%d-%d' % (os.getpid(), id(self))), 'wb')
+        self.tmp.write(self.zip.compress(str(self.body)))
+        self.body = None
+        return
+
+
+    def close(self):
+        """
+        store body unless it is already stored and append manifest record
+        :return:
+        """
+        # rpc-reply start tag not found - whole response is body
+        if self.body is None and self.tmp is None: self.split(0)
+        sha1 = self.sha1.hexdigest()
+        blob = self.archive.blob(sha1)
+        new = sha1 not in self.archive.known and not os.path.exists(blob)
+        if new and self.tmp is None: self.spill()
+        if self.tmp is not None:
+            self.tmp.write(self.zip.flush())
+            self.tmp.close()
+            if new:
+                if not os.path.isdir(os.path.dirname(blob)): os.makedirs(os.path.dirname(blob))
+                os.rename(self.tmp.name, blob)
+            else:
+                os.remove(self.tmp.name)
+        self.archive.known.add(sha1)
+        self.body = None
+        self.rec['head'] = str(self.head).decode('utf-8', 'replace')
+        self.rec['sha1'] = sha1
+        self.rec['size'] = self.size
+        self.archive.manifest.write(json.dumps(self.rec) + '\n')
+        return
+
+
+    def abort(self):
+        """
+        drop incomplete response - nothing is stored nor added to manifest
+        :return:
+        """
+        if self.tmp is not None:
+            self.tmp.close()
+            os.remove(self.tmp.name)
+            self.tmp = None
+        self.body = None
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class StoreReader:
+    """
+    read-only file-like object - rpc-reply head followed by decompressed body
+    """
+
+    def __init__(self, head, body):
+        self.head = head
+        self.body = body
+        return
+
+
+    def read(self, size=-1):
+        if self.head:
+            data = self.head if size is None or size < 0 else self.head[:size]
+            self.head = self.head[len(data):]
+            if size is None or size < 0: data += self.body.read()
+            return data
+        return self.body.read(size)
+
+
+    def close(self):
+        self.body.close()
+        return
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class RotatingFile:
+    """
+    Notification output - messages are appended to file which is replaced by a new one when size or age limit
+    is reached (only between messages), names are prefix + 'notifications-<start time>-<sequence>.xml'
+    """
+
+    def __init__(self, prefix, size=0, age=0):
+        """
+        :param prefix: response prefix
+        :param size: max file size in bytes (0 = no limit)
+        :param age: max seconds per file (0 = no limit)
+        """
+        self.prefix = prefix
+        self.size = size
+        self.age = age
+        self.seq = 0
+        self.f = None
+        self.name = None
+        self.written = 0
+        self.opened = None
+        self.files = 0
+        return
+
+
+    def open(self):
+        self.seq += 1
+        self.name = '%snotifications-%s-%04d.xml' % (self.prefix, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), self.seq)
+        if os.path.dirname(self.name) and not os.path.isdir(os.path.dirname(self.name)):
+            os.makedirs(os.path.dirname(self.name))
+        self.f = io.open(self.name, 'wb')
+        self.written = 0
+        self.opened = monotonic()
+        self.files += 1
+        NetConf.dbg("notifications to %s", self.name)
+        return
+
+
+    def write(self, data):
+        if self.f is None: self.open()
+        self.written += len(data)
+        self.f.write(data)
+        return
+
+
+    def end_message(self):
+        """
+        message separator, file is closed when limit is reached (next message opens new one)
+        :return:
+        """
+        if self.f is None: return
+        self.write("\n")
+        if (self.size and self.written >= self.size) or (self.age and monotonic() - self.opened >= self.age):
+            self.close()
+        return
+
+
+    def close(self):
+        if self.f is None: return
+        self.f.close()
+        self.f = None
+        return
+
+
+class SshProcess:
+    """
+    transport - ssh client process (sshpass + ssh -s netconf) connected by pipes
+    """
+
+    def __init__(self, nc):
+        self.nc = nc
+        self.proc = None
+        self.rio = None
+        self.stderr = None
+        return
+
+
+    def open(self):
+        """
+        start ssh process
+        :return: error description or None
+        """
+        nc = self.nc
+        args = [ nc.sshpass, '-p', nc.pswd,
+                'ssh',
+                '-o', 'PubkeyAuthentication=no',
+                '-o', 'StrictHostKeyChecking=no',
+                '-o'  'UserKnownHostsFile=/dev/null',
+                '-o', 'ConnectTimeout=%d' % nc.ssh_timeout,
+                '-p', nc.port,
+                '%s@%s' % (nc.user, nc.host),
+                '-s', nc.subsystem ]
+        try:
+            self.proc = subprocess.Popen(args,
+                               bufsize=1,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               shell=False,
+                               env={'PATH': '.:'+os.environ['PATH']} )
+
+            # http://eyalarubas.com/python-subproc-nonblock.html
+            flags = fcntl.fcntl(self.proc.stdout, fcntl.F_GETFL)
+            fcntl.fcntl(self.proc.stdout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            # requests are written non-blocking too, so replies can be read while ssh doesn't take more
+            flags = fcntl.fcntl(self.proc.stdin, fcntl.F_GETFL)
+            fcntl.fcntl(self.proc.stdin, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self.rio = io.FileIO(self.proc.stdout.fileno(), 'r', closefd=False)
+            self.stderr = self.proc.stderr
+
+        except (OSError, IOError) as e:
+            # file not found
+            desc = 'sshpass ' if e.errno == 2 else ''
+            return 'Connect to host %s failed - %s%s' % (nc.host, desc, e)
+
+        return nc.connection_error()
+
+
+    def fileno(self):
+        return self.proc.stdout.fileno()
+
+
+    def readinto(self, view):
+        """
+        :param view:
+        :return: bytes read, None if no data available, 0 at eof
+        """
+        return self.rio.readinto(view)
+
+
+    def write(self, data):
+        """
+        write all data with as few write syscalls as possible (partial writes are continued)
+        :param data:
+        :return: bytes written
+        """
+        view = memoryview(data)
+        cnt = 0
+        while cnt < len(view):
+            sent = self.write_some(view[cnt:])
+            if not sent: self.nc.wait_io([], [self.write_fd()], self.nc.rdln_timeout)
+            cnt += sent
+        return cnt
+
+
+    def write_some(self, view):
+        """
+        write as much data as pipe to ssh process takes now
+        :param view:
+        :return: bytes written, 0 if pipe is full
+        """
+        try:
+            return os.write(self.proc.stdin.fileno(), view)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR): return 0
+            raise
+
+
+    def write_fd(self):
+        """
+        :return: fd to wait for being writable
+        """
+        return self.proc.stdin.fileno()
+
+
+    def pending(self):
+        """
+        :return: bytes waiting in pipe from ssh process
+        """
+        buf = array.array('i', [0])
+        fcntl.ioctl(self.proc.stdout.fileno(), termios.FIONREAD, buf, True)
+        return buf[0]
+
+
+    def is_running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+
+    def status(self):
+        return 'ssh return code %s' % self.proc.poll()
+
+
+    def close(self):
+        if self.is_running(): self.proc.terminate()
+        return
+
+
+class ParamikoSsh:
+    """
+    transport - in-process ssh channel (paramiko), connection is ready as soon as netconf subsystem is opened
+    """
+
+    def __init__(self, nc):
+        self.nc = nc
+        self.client = None
+        self.chan = None
+        return
+
+
+    def open(self):
+        """
+        ssh handshake, authentication and netconf subsystem request
+        :return: error description or None
+        """
+        nc = self.nc
+        try:
+            # cryptography deprecation warnings are not interesting here
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                import paramiko
+        except ImportError:
+            return 'paramiko transport requires paramiko module (pip install paramiko)'
+        try:
+            self.client = paramiko.SSHClient()
+            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            self.client.connect(nc.host, int(nc.port), nc.user, nc.pswd, timeout=nc.ssh_timeout,
+                                allow_agent=False, look_for_keys=False)
+            self.chan = self.client.get_transport().open_session()
+            self.chan.invoke_subsystem(nc.subsystem)
+            self.chan.setblocking(0)
+        except paramiko.AuthenticationException as e:
+            return 'Invalid username or password - %s' % e
+        except socket.timeout as e:
+            return 'Connect to host %s failed - %s' % (nc.host, e)
+        except socket.error as e:
+            return 'Invalid host:port - %s' % e
+        except (paramiko.SSHException, EOFError) as e:
+            return 'Connect to host %s failed - %s' % (nc.host, e)
+        return
+
+
+    def fileno(self):
+        # readable when channel has data (paramiko event pipe)
+        return self.chan.fileno()
+
+
+    def readinto(self, view):
+        """
+        :param view:
+        :return: bytes read, None if no data available, 0 at eof
+        """
+        try:
+            data = self.chan.recv(len(view))
+        except socket.timeout:
+            return None
+        view[:len(data)] = data
+        return len(data)
+
+
+    def write(self, data):
+        """
+        :param data:
+        :return: bytes written
+        """
+        if not isinstance(data, str): data = memoryview(data).tobytes()
+        self.chan.setblocking(1)
+        try:
+            self.chan.sendall(data)
+        except socket.error as e:
+            raise IOError(e)
+        finally:
+            self.chan.setblocking(0)
+        return len(data)
+
+
+    def write_some(self, view):
+        """
+        send as much data as channel window takes now
+        :param view:
+        :return: bytes sent, 0 if channel can't take more
+        """
+        if not self.chan.send_ready(): return 0
+        try:
+            return self.chan.send(view.tobytes())
+        except socket.timeout:
+            return 0
+        except socket.error as e:
+            raise IOError(e)
+
+
+    def write_fd(self):
+        # channel has no fd signalling free window, write_some() is retried after short wait
+        return None
+
+
+    def is_running(self):
+        return self.chan is not None and not self.chan.closed and self.chan.get_transport().is_active()
+
+
+    def status(self):
+        return 'channel exit status %s' % (self.chan.recv_exit_status() if self.chan.exit_status_ready() else '-')
+
+
+    def pending(self):
+        """
+        :return: bytes received by paramiko and not read from channel yet
+        """
+        return len(self.chan.in_buffer)
+
+
+    def close(self):
+        if self.client is not None: self.client.close()
+        return
+
+
+class Scenario:
+    """
+    Scenario file compiled once into execution plan - step per line with the same operations as command line
+    (leading '-' is optional), 'loop n' ... 'end' blocks can be nested, lines starting with '#' are comments.
+    Request files are preloaded and steps are bound to their handlers at compile time, so nothing is parsed
+    or read from disk between rpcs.
+    """
+
+    # operation, aliases, value required
+    OPS = [
+        ('connect',   ['c', 'con', 'connect', 'url'],  True),
+        ('hello',     ['hello'],                       False),
+        ('hellofile', ['o', 'hellofile', 'hellorq'],   True),
+        ('file',      ['f', 'file', 'rq'],             True),
+        ('rs',        ['rs', 'response', 'prefix'],    True),
+        ('nors',      ['nors', 'noresponse'],          False),
+        ('var',       ['var', 'set'],                  True),
+        ('get',       ['get', 'tag'],                  True),
+        ('sleep',     ['s', 'sleep'],                  True),
+        ('commit',    ['commit'],                      False),
+        ('close',     ['close'],                       False),
+        ('loop',      ['l', 'loop', 'repeat'],         True),
+        ('end',       ['end'],                         False),
+    ]
+    ALIASES = dict((alias, (op, value)) for op, aliases, value in OPS for alias in aliases)
+    # operations which don't need responses of pipelined requests
+    NO_DRAIN = ['file', 'rs', 'nors', 'var']
+    # operations which need session
+    SESSION = ['hello', 'hellofile', 'file', 'get', 'commit', 'close']
+    # loop counters in response names - innermost loop, loop at nesting level (1 = outermost), step executions
+    COUNTER = re.compile(r'\$\{(i|i\d+|n)\}')
+    # compiled scenarios by file name, -scenario replayed by -loop runs the same plan again
+    compiled = {}
+
+    def __init__(self, fname):
+        """
+        :param fname: scenario file
+        :raise ValueError: invalid step (message with file and line)
+        :raise IOError: scenario or request file can't be read
+        """
+        self.fname = fname
+        self.steps = []
+        # request templates by file name, shared by steps sending the same file
+        self.templates = {}
+        # some step needs session opened before scenario
+        self.needs_session = False
+        self.compile()
+        return
+
+
+    @classmethod
+    def load(cls, fname):
+        """
+        scenario compiled on first use
+        :param fname: scenario file
+        :return: Scenario
+        """
+        scenario = cls.compiled.get(fname)
+        if scenario is None: scenario = cls.compiled[fname] = cls(fname)
+        return scenario
+
+
+    def all_steps(self):
+        """
+        steps of all nesting levels
+        """
+        blocks = [self.steps]
+        while blocks:
+            for step in blocks.pop():
+                if step['op'] == 'loop': blocks.append(step['body'])
+                yield step
+
+
+    def compile(self):
+        """
+        parse scenario into nested list of steps
+        :return:
+        """
+        blocks = [self.steps]
+        connected = False
+        with open(self.fname) as f:
+            for lineno, line in enumerate(f, 1):
+                fields = line.strip().split(None, 1)
+                if not fields or fields[0].startswith('#'): continue
+                where = '%s:%d' % (self.fname, lineno)
+                if fields[0].lstrip('-') not in self.ALIASES:
+                    raise ValueError('%s - unknown operation [%s]' % (where, fields[0]))
+                op, needs_value = self.ALIASES[fields[0].lstrip('-')]
+                value = fields[1] if len(fields) > 1 else None
+                if needs_value and value is None:
+                    raise ValueError('%s - %s requires value' % (where, op))
+                if not needs_value and value is not None:
+                    raise ValueError('%s - unexpected value [%s] of %s' % (where, value, op))
+                if op == 'end':
+                    if len(blocks) == 1: raise ValueError('%s - end without loop' % where)
+                    blocks.pop()
+                    continue
+                step = dict(op=op, value=value, line=lineno, count=0, drain=op not in self.NO_DRAIN,
+                            run=getattr(self, 'run_' + op))
+                try:
+                    self.prepare(step)
+                except (ValueError, OSError, IOError) as e:
+                    raise ValueError('%s - invalid %s [%s] - %s' % (where, op, value, e))
+                if op == 'connect': connected = True
+                if op in self.SESSION and not connected: self.needs_session = True
+                blocks[-1].append(step)
+                if op == 'loop': blocks.append(step['body'])
+        if len(blocks) > 1:
+            raise ValueError('%s - %d loop(s) without end' % (self.fname, len(blocks) - 1))
+        NetConf.dbg("compiled %s steps(%d)", self.fname, len(self.steps))
+        return
+
+
+    def prepare(self, step):
+        """
+        validate value of step and preload what it needs
+        :param step:
+        :return:
+        """
+        op, value = step['op'], step['value']
+        if op == 'loop':
+            step['repeat'] = int(value)
+            if step['repeat'] < 1: raise ValueError('count must be positive')
+            step['body'] = []
+        elif op == 'sleep':
+            step['sec'] = float(value)
+        elif op == 'var':
+            if '=' not in value: raise ValueError('name=value expected')
+            name, val = value.split('=', 1)
+            step['var'] = ('${%s}' % name, val)
+        elif op == 'get':
+            step['tags'] = value.split(',')
+        elif op == 'connect':
+            if '@' not in value: raise ValueError('user:password@host[:port] expected')
+        elif op == 'hellofile':
+            os.stat(value)
+        elif op == 'file':
+            if value not in self.templates: self.templates[value] = NetConf.load_request(value)
+            step['tpl'] = self.templates[value]
+            step['name'] = os.path.basename(value)
+            # latency of step itself (all FILE steps are merged in loop and session statistics)
+            step['hist'] = StepTime()
+        return
+
+
+    def run(self, nc=None, rs_prefix='rs-', tstamp=False, hformat=False):
+        """
+        execute plan
+        :param nc: session opened before scenario
+        :param rs_prefix:
+        :param tstamp:
+        :param hformat:
+        :return: (session, merged statistics of outermost loops or None)
+        """
+        if self.needs_session and nc is None:
+            print >>sys.stderr, 'CLI - scenario %s needs session, add connect step or use -connect before -scenario' % self.fname
+            sys.exit(-1)
+        self.nc = nc
+        self.prefix = rs_prefix
+        self.tstamp = tstamp
+        self.hformat = hformat
+        # stack of [counter, statistics] of running loops
+        self.loops = []
+        # loop counter tokens of this run (not shared through NetConf.VARS)
+        self.tokens = {}
+        self.loopstat = None
+        self.rsfname = None
+        # step counters are per run
+        for step in self.all_steps():
+            step['count'] = 0
+            if 'hist' in step: step['hist'] = StepTime()
+        # prints when there is no session yet
+        self.out = NetConf()
+        self.execute(self.steps)
+        if self.loopstat is not None: self.print_steps()
+        return self.nc, self.loopstat
+
+
+    def execute(self, steps):
+        """
+        run steps in order
+        :param steps:
+        :return:
+        """
+        for step in steps:
+            step['count'] += 1
+            if step['drain'] and self.nc is not None and self.nc.inflight:
+                self.nc.drain_pipeline(0, self.hformat, self.tstamp)
+            step['run'](step)
+        return
+
+
+    def counter(self, match):
+        """
+        value of loop or step counter token in response name, loop counters are the ones requests see
+        """
+        if match.group(1) == 'n': return NetConf.COUNT % self.step['count']
+        return self.tokens.get(match.group(0), NetConf.COUNT % 1)
+
+
+    def run_loop(self, step):
+        out = self.nc or self.out
+        out.print_line(None, self.tstamp, 'LOOP', 'REPEAT %d x ' % step['repeat'], 'START')
+        loop = [0, NetConf.new_stats()]
+        self.loops.append(loop)
+        # requests and response names see ${i} of innermost loop and ${i<level>} of every loop
+        token = '${i%d}' % len(self.loops)
+        body = step['body']
+        for i in xrange(1, step['repeat']+1):
+            loop[0] = i
+            self.tokens[token] = self.tokens['${i}'] = NetConf.COUNT % i
+            self.execute(body)
+        self.loops.pop()
+        self.tokens.pop(token, None)
+        # enclosing loop is innermost again
+        if self.loops: self.tokens['${i}'] = self.tokens['${i%d}' % len(self.loops)]
+        else: self.tokens.pop('${i}', None)
+        nc = self.nc or self.out
+        if nc.inflight: nc.drain_pipeline(0, self.hformat, self.tstamp)
+        nc.finish_rate_step(self.hformat, self.tstamp)
+        loopstat = loop[1]
+        nc.print_line(self.hformat, self.tstamp, 'LOOP', '=== SUMMARY.STATS ===', None,
+                      (loopstat['sent'], loopstat['recv']), (loopstat['sentsc'], loopstat['recvsc']))
+        nc.print_latency(NetConf.stats_records('LOOP', getattr(nc, 'host', ''), loopstat), self.tstamp)
+        # inner loop is accounted to enclosing one, outermost loops are merged for export
+        if self.loops:
+            NetConf.merge_stats(self.loops[-1][1], loopstat)
+        else:
+            if self.loopstat is None: self.loopstat = NetConf.new_stats()
+            NetConf.merge_stats(self.loopstat, loopstat)
+        return
+
+
+    def run_connect(self, step):
+        url = step['value']
+        # previous session of scenario is closed (reconnecting in loop)
+        if self.nc is not None:
+            if self.nc.inflight: self.nc.drain_pipeline(0, self.hformat, self.tstamp)
+            self.nc.terminate()
+        nc = self.nc = NetConf(url)
+        nc.print_line(None, self.tstamp, 'NC.CONNECT', url)
+        err = nc.connect()
+        nc.print_line(res='FAIL - %s' % err if err else 'OK in %s' % nc.sec(nc.connect_time))
+        if err is None: return
+        NetConf.dbg_dump(err)
+        sys.exit(-1)
+
+
+    def run_hello(self, step):
+        nc = self.nc
+        nc.print_line(None, self.tstamp, 'HELLO')
+        sessionid, bytes, times = nc.send_recv_hello()
+        nc.session_id = sessionid
+        nc.print_line(hrf=self.hformat, par='session_id=%s' % sessionid, bytes=bytes, times=times)
+        nc.add_stats(bytes, times, oper='HELLO')
+        nc.add_setup(times, self.tstamp)
+        return
+
+
+    def run_hellofile(self, step):
+        nc = self.nc
+        rqfname = step['value']
+        rsfname = self.rsfname = self.prefix+os.path.basename(rqfname) if self.prefix is not None else '/dev/null'
+        sent, senttime = nc.send_rq10_file(rqfname)
+        recv, recvtime = nc.recv_rs10_file(rsfname)
+        nc.print_line(None, self.tstamp, 'HELLO')
+        sessionid = nc.session_id = nc.sessionid_fromfile(rsfname)
+        nc.print_line(hrf=self.hformat, par='session_id=%s' % sessionid, bytes=(sent,recv), times=(senttime,recvtime))
+        nc.add_stats((sent,recv), (senttime,recvtime), oper='HELLO')
+        nc.add_setup((senttime,recvtime), self.tstamp)
+        return
 
-$ nc.py -time -con root:toor@localhost:8830 -hello
-[2014-10-22 00:11:56]    CONNECT:                 root:toor@localhost:8830 ... OK
-[2014-10-22 00:11:56]      HELLO:                          session_id=3832 sent:    657 [Bytes], recv:  18042 [Bytes], rq.time:    0.0 [ms], rs.time:  456.2 [ms]
 
+    def run_file(self, step):
+        nc = self.nc
+        idx, loopstat = self.loops[-1] if self.loops else (None, None)
+        rqfname = step['value']
+        rsfname = '/dev/null'
+        if self.prefix is not None:
+            rsfname = self.prefix + step['name']
+            if '${' in rsfname:
+                self.step = step
+                rsfname = self.COUNTER.sub(self.counter, rsfname)
+        self.rsfname = rsfname
+        nc.archive_path = re.sub(r'\$\{i\d*\}[-_.]?', '', self.prefix) + NetConf.archive if NetConf.archive and self.prefix is not None else None
+        nc.loop_idx = idx or 1
+        if nc.rate:
+            intended = nc.wait_schedule(self.hformat, self.tstamp)
+            nc.send_rq11_pipelined(rqfname, rsfname, idx, loopstat, intended, step['tpl'], step['hist'], self.tokens)
+            if nc.pipeline: nc.drain_pipeline(nc.pipeline-1, self.hformat, self.tstamp)
+            return
+        if nc.pipeline:
+            nc.send_rq11_pipelined(rqfname, rsfname, idx, loopstat, None, step['tpl'], step['hist'], self.tokens)
+            nc.drain_pipeline(nc.pipeline-1, self.hformat, self.tstamp)
+            return
+        nc.print_line(None, self.tstamp, 'FILE' if idx is None else '%4d. FILE' % idx, '%s -> %s' % (rqfname,rsfname))
+        sent, senttime = nc.send_rq11_file(rqfname, step['tpl'], self.tokens)
+        recv, recvtime = nc.recv_rs11_file(rsfname, rqfname, idx or 1)
+        nc.print_line(hrf=self.hformat, res=nc.last_status, bytes=(sent,recv), times=(senttime,recvtime))
+        nc.add_stats((sent,recv), (senttime,recvtime), loopstat)
+        step['hist'].add(senttime + recvtime)
+        return
 
-3 - perform get-config operation, response will be stored in 'rs-get-config.xml' file:
 
-$ nc.py -con root:toor@localhost:8830 -hello -file get-config.xml
-   CONNECT:                 root:toor@localhost:8830 ... OK
-     HELLO:                         session_id=29632 sent:    657 [Bytes], recv:  18043 [Bytes], rq.time:    0.0 [ms], rs.time:  432.0 [ms]
-      FILE:      get-config.xml -> rs-get-config.xml sent:    254 [Bytes], recv:   2956 [Bytes], rq.time:    0.1 [ms], rs.time:  642.0 [ms]
+    def run_rs(self, step):
+        self.prefix = step['value']
+        return
 
 
-4 - repeat 3 times get-config operation, do not store responses:
+    def run_nors(self, step):
+        self.prefix = None
+        return
 
-$ nc.py -con root:toor@localhost:8830 -hello -nors -loop 3 -file rq/get-config.xml
-   CONNECT:                 root:toor@localhost:8830 ... OK
-     HELLO:                         session_id=32077 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    54.5 ms
-      LOOP:                              REPEAT 3 x  ... START
-   1. FILE:           rq/get-config.xml -> /dev/null sent:     252 Bytes, recv:    2954 Bytes, rq:     9.2 ms, rs:   712.1 ms
-   2. FILE:           rq/get-config.xml -> /dev/null sent:     252 Bytes, recv:    2954 Bytes, rq:     0.4 ms, rs:   712.1 ms
-   3. FILE:           rq/get-config.xml -> /dev/null sent:     252 Bytes, recv:    2954 Bytes, rq:     0.4 ms, rs:   710.8 ms
-      LOOP:                    === SUMMARY.STATS === sent:     756 Bytes, recv:    8862 Bytes, rq:    10.0 ms, rs:  2134.9 ms
 
+    def run_var(self, step):
+        name, val = step['var']
+        NetConf.VARS[name] = val
+        (self.nc or self.out).print_line(None, self.tstamp, 'VAR', '%s = %s' % (name, val), 'SET')
+        return
 
-5 - repeat 3 times get-config, read requests from subdir rq and store responses to subdir rs with loop counter as prefix:
 
-$ nc.py -time -con root:toor@localhost:8830 -hello -rs 'rs/${i}-' -loop 3 -file rq/get-config.xml
-[2014-10-24 23:58:39]    CONNECT:                 root:toor@localhost:8830 ... OK
-[2014-10-24 23:58:39]      HELLO:                         session_id=13541 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    52.8 ms
-[2014-10-24 23:58:39]       LOOP:                              REPEAT 3 x  ... START
-[2014-10-24 23:58:40]    1. FILE: rq/get-config.xml -> rs/001-get-config.xml sent:     252 Bytes, recv:    2954 Bytes, rq:     0.1 ms, rs:   738.4 ms
-[2014-10-24 23:58:40]    2. FILE: rq/get-config.xml -> rs/002-get-config.xml sent:     252 Bytes, recv:    2954 Bytes, rq:     0.1 ms, rs:   709.6 ms
-[2014-10-24 23:58:41]    3. FILE: rq/get-config.xml -> rs/003-get-config.xml sent:     252 Bytes, recv:    2954 Bytes, rq:     0.1 ms, rs:   709.2 ms
-[2014-10-24 23:58:41]       LOOP:                    === SUMMARY.STATS === sent:     756 Bytes, recv:    8862 Bytes, rq:     0.3 ms, rs:  2157.2 ms
+    def run_get(self, step):
+        nc = self.nc
+        if self.rsfname is None or self.rsfname == '/dev/null':
+            nc.print_line(None, self.tstamp, 'TAG', 'Missing response', 'WARNING')
+            return
+        src = nc.last_rs.archive.open(nc.last_rs.rec) if nc.archive_path is not None else self.rsfname
+        vals = nc.find_all_in_xmlfile(src, step['tags'])
+        for tag in step['tags']:
+            nc.print_line(None, self.tstamp, 'TAG', '%s = %s' % (tag, vals.get(tag)), 'GET')
+        return
 
 
-6 - lock candidate, wait 5.1 seconds then unlock candidate, do not store responses:
+    def run_sleep(self, step):
+        sec = step['sec']
+        (self.nc or self.out).print_line(None, self.tstamp, 'SLEEP', 'for %.2f sec' % sec, '%s' % self.out.sec(sec))
+        time.sleep(sec)
+        return
 
-$ nc.py -time -con root:toor@localhost:8830 -hello -nors -file rq/lock-candidate.xml -sleep 5.1 -file rq/unlock-candidate.xml
-[2014-10-24 23:59:42]    CONNECT:                 root:toor@localhost:8830 ... OK
-[2014-10-24 23:59:42]      HELLO:                         session_id=11243 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    55.8 ms
-[2014-10-24 23:59:42]       FILE:       rq/lock-candidate.xml -> /dev/null sent:     242 Bytes, recv:     153 Bytes, rq:    17.8 ms, rs:   100.8 ms
-[2014-10-24 23:59:42]      SLEEP:                             for 5.10 sec ... 5.10 s
-[2014-10-24 23:59:47]       FILE:     rq/unlock-candidate.xml -> /dev/null sent:     246 Bytes, recv:     153 Bytes, rq:     0.1 ms, rs:   100.8 ms
 
+    def run_commit(self, step):
+        nc = self.nc
+        nc.print_line(None, self.tstamp, 'COMMIT')
+        bytes, times, status = nc.send_commit()
+        nc.print_line(hrf=self.hformat, par=status, bytes=bytes, times=times)
+        nc.add_stats(bytes, times, self.loops[-1][1] if self.loops else None, 'COMMIT')
+        return
 
-7 - get hostname
 
-$ nc.py -time -con root:toor@localhost:8830 -hello -rq rq/host-name/get-hostname.xml -get host-name
-[2014-11-14 00:34:19] NC.CONNECT:                 root:toor@localhost:8830.......... OK
-[2014-11-14 00:34:26]      HELLO:                         session_id=11380 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    60.6 ms
-[2014-11-14 00:34:26]       FILE: rq/host-name/get-hostname.xml -> rs-get-hostname.xml sent:     385 Bytes, recv:     324 Bytes, rq:     0.1 ms, rs:   101.7 ms
-[2014-11-14 00:34:26]        TAG:                  host-name = host.domain ... GET
+    def run_close(self, step):
+        nc = self.nc
+        nc.print_line(None, self.tstamp, 'CLOSE')
+        bytes, times, status = nc.send_close_session()
+        nc.print_line(hrf=self.hformat, par=status, bytes=bytes, times=times)
+        nc.add_stats(bytes, times, self.loops[-1][1] if self.loops else None, 'CLOSE')
+        return
 
 
-8 - change hostname
+    def print_steps(self, top=10):
+        """
+        print request steps in loops which took most of the time (per step counters)
+        :param top: max number of printed steps
+        :return:
+        """
+        steps = [step for step in self.all_steps() if step['op'] == 'file' and step['count'] > 1 and step['hist'].count]
+        out = self.nc or self.out
+        for step in sorted(steps, key=lambda step: step['hist'].total, reverse=True)[:top]:
+            hist = step['hist']
+            out.print_line(None, self.tstamp, 'STEP', 'line %d %s %d x' % (step['line'], step['name'], step['count']),
+                           'ms mean:%.1f max:%.1f total:%s' % (1000*hist.total/hist.count, 1000*hist.max, out.sec(hist.total)))
+        return
 
-$ nc.py -time -con root:toor@localhost:8830 -hello -var HOSTNAME=host.domain -rq rq/host-name/set-hostname.xml -commit
-[2014-11-14 00:36:13] NC.CONNECT:                 root:toor@localhost:8830.......... OK
-[2014-11-14 00:36:20]      HELLO:                         session_id=11940 sent:     657 Bytes, recv:   18043 Bytes, rq:     0.0 ms, rs:    61.4 ms
-[2014-11-14 00:36:20]        VAR:                ${HOSTNAME} = host.domain ... SET
-[2014-11-14 00:36:20]       FILE: rq/host-name/set-hostname.xml -> rs-set-hostname.xml sent:     415 Bytes, recv:     217 Bytes, rq:     0.1 ms, rs:   101.5 ms
-[2014-11-14 00:36:20]     COMMIT:                                       OK sent:     415 Bytes, recv:     217 Bytes, rq:     0.1 ms, rs:   101.5 ms
 
-""" % __version__
+class StepTime:
+    """
+    Latency counters of scenario step (Histogram is too big to keep per step)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        return
 
 
-import subprocess
-import sys
-import time
-import re
-import os
-import fcntl
-import xml.etree.ElementTree as ET
-import datetime
-import inspect
+    def add(self, sec):
+        self.count += 1
+        self.total += sec
+        if sec > self.max: self.max = sec
+        return
 
 
 class NetConf:
@@ -184,20 +1651,78 @@ class NetConf:
 
     sshpass = 'sshpass'
     subsystem = 'netconf'
+    # ssh transport - ssh client process or in-process paramiko channel
+    TRANSPORTS = {'ssh': SshProcess, 'paramiko': ParamikoSsh}
+    transport = 'ssh'
     xmlns = 'urn:ietf:params:xml:ns:netconf:base:1.0'
     ssh_timeout  = 7
     rdln_timeout = 60
+    rdbuf_size   = 65536
+    # max request chunk size (0 = send whole request as single chunk)
+    rq_chunk_size = 1048576
     last_error = ''
-    # debug (* = debug_all)
+    # status of last response stored to file (see RpcStatus)
+    last_status = ''
+    # debug - function name patterns (* = debug_all), enablement cached per function, ring of recent records
     dbg_active = None
+    dbg_cache = {}
+    dbg_ring = None
 
     # framing sequences
     EOM_10 = ']]>]]>'
     EOM_11 = "##\n"
-    CHUNK  = re.compile('^#(\d+)$')
+
+    # message-id of request and rpc-reply start tag attributes
+    MSGID_RQ  = re.compile(r'<(?:\w+:)?rpc\b[^>]*?\bmessage-id\s*=\s*["\']([^"\']*)')
+    MSGID_RS  = re.compile(r'\bmessage-id\s*=\s*["\']([^"\']*)')
+    RPC_REPLY = re.compile(r'<(?:\w+:)?rpc-reply\b([^>]*)>')
+    # elements kept from in-memory parsed responses (rs_status, send_recv_hello)
+    STATUS_PICK = ('/rpc-reply/ok', '/rpc-reply/rpc-error')
+    HELLO_PICK  = ('/hello/session-id',)
 
     # variable token
     VARS = {}
+    TOKEN = re.compile(r'(\$\{[^}$]*\})')
+    # loop counter format in requests and response names ('001')
+    COUNT = '%03d'
+
+    # pipelining - max number of requests in flight (0 = wait for each response)
+    pipeline = 0
+
+    # open-loop scheduling - target rate in rpc/s (0 = send when previous response is received)
+    # and rate increase by ramp_step after each ramp_every requests
+    rate = 0
+    ramp_step  = 0
+    ramp_every = 0
+
+    # reported latency percentiles and file for statistics export (.json or .csv)
+    PERCENTILES = (50, 90, 99, 99.9)
+    stats_file = None
+
+    # store responses to append-only archive or content-addressed store instead of file per response
+    ARCHIVES = {'archive': Archive, 'store': ResponseStore}
+    archive = None
+
+    # notifications - create-subscription request, rotation of output files by size in bytes and age in seconds
+    # (0 = no limit) and seconds between rate reports
+    xmlns_notif = 'urn:ietf:params:xml:ns:netconf:notification:1.0'
+    SUBSCRIPTION = """<?xml version="1.0" encoding="utf-8"?>
+        <rpc message-id="${TIMESTAMP}" xmlns="%s">
+        <create-subscription xmlns="%s"><stream>%s</stream></create-subscription>
+        </rpc>"""
+    rotate_size = 0
+    rotate_time = 0
+    report_interval = 1.0
+    notifications_skipped = 0
+
+    # per rpc phase trace - json lines file (opened for appending) and prometheus textfile name
+    trace_out  = None
+    trace_prom = None
+
+    # receive buffer (allocated per session), first unconsumed and end of valid data positions
+    rbuf = None
+    rpos = 0
+    rend = 0
 
     def __init__(self, url=None, user=None, pswd=None, host=None, port=None):
         """
@@ -213,6 +1738,30 @@ class NetConf:
         if pswd is not None: self.pswd = pswd
         if host is not None: self.host = host
         if port is not None: self.port = port
+        # requests sent and waiting for response, counter for ${MSGID} token and message-id of last request
+        self.inflight = collections.deque()
+        self.msgid = 0
+        self.last_msgid = None
+        # totals of all operations in session
+        self.sessionstat = self.new_stats()
+        # open-loop scheduler state and statistics of finished rate steps
+        self.sched = None
+        self.rate_records = []
+        # merged statistics of outermost loops of scenarios run in session
+        self.scenariostat = None
+        # compiled request templates by file name and loop counter for ${i} token
+        self.templates = {}
+        self.loop_idx = 1
+        # duration of connect till hello is accounted as SETUP phase
+        self.connect_time = None
+        # phase marks (monotonic) of current operation and session-id from hello for trace records
+        self.marks = None
+        self.session_id = None
+        # archive for responses of following requests (None = file per response), opened archives by path
+        # and the last archived response (for -get)
+        self.archive_path = None
+        self.archives = {}
+        self.last_rs = None
         return
 
 
@@ -232,7 +1781,7 @@ class NetConf:
           self.host = hostport
           self.port = '830'
         # debug splitting
-        NetConf.dbg('url(%s) -> user(%s) pswd(%s) host(%s) port(%s)' % (url, self.user, self.pswd, self.host, self.port))
+        NetConf.dbg('url(%s) -> user(%s) pswd(%s) host(%s) port(%s)', url, self.user, self.pswd, self.host, self.port)
         return
 
 
@@ -243,49 +1792,22 @@ class NetConf:
         """
         self.last_error = msg
         print >>sys.stderr, msg
+        NetConf.dbg_dump(msg)
         return
 
 
     def connect(self):
         """
-
-        :return:
+        open transport (see TRANSPORTS)
+        :return: error description or None
         """
-        err = None
-        args = [ self.sshpass, '-p', self.pswd,
-                'ssh',
-                '-o', 'PubkeyAuthentication=no',
-                '-o', 'StrictHostKeyChecking=no',
-                '-o'  'UserKnownHostsFile=/dev/null',
-                '-o', 'ConnectTimeout=%d' % self.ssh_timeout,
-                '-p', self.port,
-                '%s@%s' % (self.user, self.host),
-                '-s', self.subsystem ]
-        try:
-            self.ssh = subprocess.Popen(args,
-                               bufsize=1,
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE,
-                               shell=False,
-                               env={'PATH': '.:'+os.environ['PATH']} )
-                               
-            # http://eyalarubas.com/python-subproc-nonblock.html
-            flags = fcntl.fcntl(self.ssh.stdout, fcntl.F_GETFL)
-            fcntl.fcntl(self.ssh.stdout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-
-            #flags = fcntl.fcntl(self.ssh.stderr, fcntl.F_GETFL)
-            #fcntl.fcntl(self.ssh.stderr, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-
-            err = self.connection_error()
-
-        except (OSError, IOError) as e:
-            # file not found
-            desc = 'sshpass ' if e.errno == 2 else ''
-            err = 'Connect to host %s failed - %s%s' % (self.host, desc, e)
-            self.print_err(err)
-
-        #stdout, stderr = x.communicate()
+        start = monotonic()
+        self.ssh = self.TRANSPORTS[self.transport](self)
+        err = self.ssh.open()
+        self.connect_time = monotonic() - start
+        if err is None: self.trace('CONNECT', (0, 0), {'connect': self.connect_time})
+        # ssh client still waiting for password or retrying would outlive nc.py
+        else: self.ssh.close()
         return err
 
 
@@ -294,98 +1816,461 @@ class NetConf:
         close ssh connection
         :return:
         """
-        if self.is_ssh_running(): self.ssh.terminate()
+        self.ssh.close()
+        for archive in self.archives.itervalues(): archive.close()
+        self.archives = {}
         return
 
 
+    def open_response(self, rsfname, rqfname=None, idx=None, archive_path=None):
+        """
+        open response file or archive entry for writing
+        :param rsfname: response file name (recorded in archive index when archiving)
+        :param rqfname: request file name
+        :param idx: loop iteration
+        :param archive_path: archive (default current archive of session, None = file per response)
+        :return: file-like object with write() and close()
+        """
+        path = archive_path or self.archive_path
+        if path is None:
+            return io.open(rsfname, 'wb')
+        archive = self.archives.get(path)
+        if archive is None:
+            archive = self.archives[path] = self.ARCHIVES[self.archive](path, append=True)
+        self.last_rs = archive.entry(idx, rqfname, rsfname)
+        return self.last_rs
+
+
     def is_ssh_running(self):
         """
-        check if child process is still running
+        check if transport is still connected
         :return:
         """
-        return self.ssh.poll() is None
+        return self.ssh.is_running()
 
 
     def connection_error(self):
         """
+        wait till server starts sending hello (connection is ready) or ssh reports an error, ssh_timeout is only
+        the upper bound, hello bytes already received stay in receive buffer
         :return: try to return as descriptive error as possible
         """
-        # wait till ssh negotiations takes place so we really know if connection was successfull
-        for i in range(self.ssh_timeout):
-            time.sleep(1)
-            if not self.is_ssh_running(): break
-            self.print_progress()
-        #
-        if self.is_ssh_running(): return
-        #
-        for line in self.ssh.stderr:
-            # dbg
-            NetConf.dbg('stderr line(%s)' % line)
-            if 'refused' in line:
-                return 'Invalid host:port - %s' % line
-            if 'denied' in line:
-                return 'Invalid password - %s'  % line
-            if 'disconnect' in line:
-                return 'Invalid username - %s'  % line
-        return
+        out, err = self.ssh.fileno(), self.ssh.stderr.fileno()
+        stoptime = monotonic() + self.ssh_timeout
+        progress = monotonic() + 1
+        errors = ''
+        while True:
+            now = monotonic()
+            if now >= stoptime: return
+            if now >= progress:
+                self.print_progress()
+                progress += 1
+            ready = self.wait_any([out, err], min(stoptime, progress) - now)
+            if err in ready:
+                data = os.read(err, 4096)
+                errors += data
+                # dbg
+                NetConf.dbg('stderr(%s)', data)
+                for line in errors.splitlines():
+                    if 'refused' in line:
+                        return 'Invalid host:port - %s' % line
+                    if 'denied' in line:
+                        return 'Invalid password - %s'  % line
+                    if 'disconnect' in line:
+                        return 'Invalid username - %s'  % line
+                if data: continue
+            if out in ready or err in ready:
+                try:
+                    # first bytes of hello - connection is up
+                    self.read_buf(self.ssh, max(0, stoptime - monotonic()))
+                    return
+                except (OSError, IOError) as e:
+                    return 'Connection failed - %s' % (errors.strip() or e)
+
+
+    def wait_readable(self, fd, timeout):
+        """
+        wait till fd is readable (data or eof)
+        :param fd:
+        :param timeout: seconds
+        :return: True if fd is readable
+        """
+        return len(self.wait_any([fd], timeout)) > 0
 
 
-    def readln(self, stream, eom='', timeout=None):
+    def wait_any(self, fds, timeout):
         """
-        This is a dirty hack due to Python bug - readline() doesn't work in non-blocking mode
-        :param fd:
-        :param eom:
-        :return:
+        wait till any of fds is readable (data or eof) using poll() or select() where poll is not available
+        :param fds:
+        :param timeout: seconds
+        :return: list of readable fds
+        """
+        return self.wait_io(fds, [], timeout)
+
+
+    def wait_io(self, rfds, wfds, timeout):
+        """
+        wait till any of rfds is readable (data or eof) or any of wfds is writable
+        :param rfds:
+        :param wfds:
+        :param timeout: seconds
+        :return: list of ready fds
+        """
+        try:
+            if hasattr(select, 'poll'):
+                poller = select.poll()
+                for fd in rfds:
+                    poller.register(fd, select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR)
+                for fd in wfds:
+                    poller.register(fd, select.POLLOUT | select.POLLHUP | select.POLLERR)
+                return [fd for fd, event in poller.poll(max(0, timeout) * 1000)]
+            ready = select.select(rfds, wfds, [], max(0, timeout))
+            return ready[0] + ready[1]
+        except (select.error, OSError, IOError) as e:
+            # interrupted by signal - let caller recalculate timeout
+            if e.args[0] == errno.EINTR: return []
+            raise
+
+
+    def read_buf(self, stream, timeout=None):
+        """
+        wait for data and read everything available into free space of reusable receive buffer
+        :param stream:
+        :param timeout: seconds without any data
+        :return: number of bytes read
         """
-        line = ''
         fd = stream.fileno()
         if timeout is None: timeout = self.rdln_timeout
+        if self.rbuf is None: self.rbuf = bytearray(self.rdbuf_size)
+        # reuse buffer from the beginning, move unconsumed data to the front or grow buffer for long line
+        if self.rpos == self.rend:
+            self.rpos = self.rend = 0
+        elif self.rend == len(self.rbuf):
+            if self.rpos > 0:
+                self.rbuf[0:self.rend-self.rpos] = self.rbuf[self.rpos:self.rend]
+                self.rend -= self.rpos
+                self.rpos  = 0
+            else:
+                self.rbuf.extend(bytearray(len(self.rbuf)))
         stoptime = time.time() + timeout
         while True:
-            # if ssh diconnected
-            if not self.is_ssh_running():
-                raise IOError('Netconf server disconnected - ssh return code %s' % self.ssh.returncode)
+            wait = stoptime - time.time()
+            if wait <= 0:
+                raise IOError('readln() timeout - %d sec no data' % timeout)
+            if not self.wait_readable(fd, wait): continue
             try:
-                c = os.read(fd, 1)
-            except:
-                #print self.ssh.stderr.readline()
-                if time.time() >  stoptime:
-                    raise IOError('readln() timeout - %d sec no data' % timeout)
-                time.sleep(0.1)
-                continue
-            line += c
-            if c == "\n":
-                break
-            if line == eom:
-                break
-            # move timeout as we got char
-            stoptime = time.time() + timeout
+                cnt = stream.readinto(memoryview(self.rbuf)[self.rend:])
+            except (OSError, IOError) as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR): continue
+                raise
+            # non-blocking read without data
+            if cnt is None: continue
+            # eof - ssh disconnected
+            if cnt == 0:
+                raise IOError('Netconf server disconnected - %s' % self.ssh.status())
+            self.rend += cnt
+            if self.marks is not None and 'first' not in self.marks: self.marks['first'] = monotonic()
+            NetConf.dbg("read(%d) buffered(%d)", cnt, self.rend-self.rpos)
+            return cnt
+
+
+    def readln(self, stream, eom='', timeout=None):
+        """
+        read line (or eom without eoln) from receive buffer, buffer is refilled by read_buf() when needed
+        :param stream:
+        :param eom:
+        :param timeout:
+        :return:
+        """
+        while True:
+            if self.rbuf is not None:
+                end = self.rbuf.find("\n", self.rpos, self.rend)
+                if end >= 0:
+                    end += 1
+                    break
+                if eom and self.rbuf.startswith(eom, self.rpos, self.rend):
+                    end = self.rpos + len(eom)
+                    break
+            self.read_buf(stream, timeout)
+        line = str(self.rbuf[self.rpos:end])
+        self.rpos = end
         # dbg
-        NetConf.dbg("line(%s) eom(%s)" % (line,eom))
+        NetConf.dbg("line(%s) eom(%s)", line, eom)
         return line
 
 
+    def read_chunk_header(self, stream):
+        """
+        read netconf 1.1 chunk header (LF #<len> LF) or end-of-chunks (LF ## LF) from receive buffer
+        :param stream:
+        :return: (chunk length or None for end-of-chunks, bytes consumed)
+        """
+        while True:
+            if self.rbuf is not None:
+                # skip line feeds (and whitespace) preceding the hash
+                pos = self.rpos
+                while pos < self.rend and self.rbuf[pos] in (10, 13, 32, 9): pos += 1
+                if pos < self.rend:
+                    if self.rbuf[pos] != 35:
+                        raise IOError('Received chunking error - header expected, got (%s)' %
+                                      str(self.rbuf[pos:min(pos+20, self.rend)]))
+                    end = self.rbuf.find("\n", pos, self.rend)
+                    if end >= 0:
+                        break
+            self.read_buf(stream)
+        hdr = self.rbuf[pos+1:end]
+        start, self.rpos = self.rpos, end + 1
+        if hdr == '#':
+            return None, end + 1 - start
+        if not hdr.isdigit() or len(hdr) > 10:
+            raise IOError('Received chunking error - invalid chunk length (%s)' % str(hdr))
+        return int(hdr), end + 1 - start
+
+
+    def read_chunk_data(self, stream, clen, write=None):
+        """
+        pass exactly clen bytes of chunk data from receive buffer to write() without intermediate strings
+        :param stream:
+        :param clen: chunk length
+        :param write: callable accepting memoryview, None to drop data
+        :return:
+        """
+        while clen:
+            if self.rpos == self.rend: self.read_buf(stream)
+            cnt = min(clen, self.rend - self.rpos)
+            if write is not None:
+                write(memoryview(self.rbuf)[self.rpos:self.rpos+cnt])
+            self.rpos += cnt
+            clen -= cnt
+        return
+
+
+    def recv_chunks(self, stream, write=None):
+        """
+        netconf 1.1 chunked framing decoder - passes chunk data to write() till end-of-chunks
+        :param stream:
+        :param write: callable accepting memoryview, None to drop data
+        :return: bytes received including framing
+        """
+        size = 0
+        while True:
+            clen, cnt = self.read_chunk_header(stream)
+            size += cnt
+            # end of message
+            if clen is None:
+                break
+            NetConf.dbg("chunk found with len(%d)", clen)
+            self.read_chunk_data(stream, clen, write)
+            size += clen
+        return size
+
+
     def chunk_str(self, str):
         """
         chunkize string
         :param line:
         :return:
         """
-        str = str.rstrip()
         return "\n#%d\n%s" % (len(str), str)
 
 
-    def replace_tokens(self, line):
+    def write_all(self, data):
+        """
+        write all data to transport, with requests in flight their responses are read to receive buffer meanwhile
+        (server blocked on writing responses stops reading requests, so client must not block on writing)
+        :param data: str, bytearray or memoryview
+        :return: bytes written
+        """
+        if not self.inflight: return self.ssh.write(data)
+        view = memoryview(data)
+        rfd, wfd = self.ssh.fileno(), self.ssh.write_fd()
+        cnt = 0
+        stoptime = time.time() + self.rdln_timeout
+        while cnt < len(view):
+            sent = self.ssh.write_some(view[cnt:])
+            if sent:
+                cnt += sent
+                stoptime = time.time() + self.rdln_timeout
+                continue
+            wait = stoptime - time.time()
+            if wait <= 0:
+                raise IOError('write() timeout - %d sec neither request sent nor response received' % self.rdln_timeout)
+            # paramiko channel window can't be polled
+            ready = self.wait_io([rfd], [wfd] if wfd is not None else [], wait if wfd is not None else min(wait, 0.01))
+            if rfd in ready or self.ssh.pending():
+                # response data are not phases of request being sent
+                marks, self.marks = self.marks, None
+                try:
+                    self.read_buf(self.ssh)
+                finally:
+                    self.marks = marks
+                stoptime = time.time() + self.rdln_timeout
+        return cnt
+
+
+    def split_token(self, block):
+        """
+        split block before unfinished token at its end (token continues in next block)
+        :param block:
+        :return: (block, rest)
+        """
+        idx = block.rfind('${')
+        if idx >= 0 and block.find('}', idx) < 0:
+            return block[:idx], block[idx:]
+        if block.endswith('$'):
+            return block[:-1], '$'
+        return block, ''
+
+
+    def send_chunks(self, f, size=None, tokens=None):
+        """
+        netconf 1.1 chunked framing encoder - replace tokens and send request from file object in chunks of rq_chunk_size
+        (whole request as single chunk if size is known and fits) together with end-of-chunks, one write per chunk
+        :param f: file object
+        :param size: request size if known
+        :param tokens: token values of caller (scenario loop counters) preferred to VARS
+        :return: bytes sent including framing
+        """
+        cnt = 0
+        bsize = self.rq_chunk_size
+        if not bsize or (size is not None and size <= bsize): bsize = -1
+        rest = ''
+        self.msgid += 1
+        self.last_msgid = None
+        while True:
+            block = f.read(bsize)
+            eof = bsize < 0 or not block
+            block, rest = self.split_token(rest + block) if not eof else (rest + block, '')
+            block = self.replace_tokens(block, tokens)
+            if self.last_msgid is None:
+                match = self.MSGID_RQ.search(block)
+                if match: self.last_msgid = match.group(1)
+            data = self.chunk_str(block) if block else ''
+            if eof: data += "\n" + self.EOM_11
+            NetConf.dbg("chunk(%d) eof(%s)", len(block), eof)
+            cnt += self.write_all(data)
+            if eof: break
+        return cnt
+
+
+    def token_value(self, token, tokens=None):
+        """
+        value of token, unknown tokens are left as they are
+        :param token: like ${NAME}
+        :param tokens: token values of caller preferred to VARS
+        :return:
+        """
+        value = tokens.get(token) if tokens else None
+        if value is None: value = self.VARS.get(token)
+        if value is not None: return value
+        # unique per request sent in this session
+        if token == '${MSGID}': return '%d' % self.msgid
+        if token == '${i}': return self.COUNT % self.loop_idx
+        # taken once and kept for the whole run (not time of each request), so it never invalidates rendered request
+        if token == '${TIMESTAMP}': return self.VARS.setdefault(token, '%d' % time.time())
+        return token
+
+
+    def replace_tokens(self, line, tokens=None):
         """
-        replace tokens in line requests before sending to device
+        replace tokens in line requests before sending to device (single pass)
         :param line:
+        :param tokens: token values of caller preferred to VARS
         :return:
         """
-        self.VARS.setdefault('${TIMESTAMP}', '%d' % time.time())
-        #if len(line) < 10:   return line
-        for token,value in self.VARS.iteritems():
-            line = line.replace(token, value)
-        return line
+        if '${' not in line: return line
+        return self.TOKEN.sub(lambda match: self.token_value(match.group(0), tokens), line)
+
+
+    def compile_request(self, fname):
+        """
+        parse request file into template - static segments and token slots, file is read again only when it changes
+        :param fname:
+        :return: template
+        """
+        st = os.stat(fname)
+        tpl = self.templates.get(fname)
+        if tpl is not None and tpl['stat'] == (st.st_mtime, st.st_size): return tpl
+        tpl = self.templates[fname] = self.load_request(fname)
+        return tpl
+
+
+    @staticmethod
+    def load_request(fname):
+        """
+        read request file into template (see render_request)
+        :param fname:
+        :return: template
+        """
+        with open(fname, 'rb') as f:
+            st = os.fstat(f.fileno())
+            parts = NetConf.TOKEN.split(f.read())
+        # parts at odd positions are tokens, rendered request is cached for last token values
+        tpl = dict(stat=(st.st_mtime, st.st_size), parts=parts, slots=range(1, len(parts), 2),
+                   values=None, wire=None, msgid=None)
+        NetConf.dbg("compiled %s tokens(%d)", fname, len(tpl['slots']))
+        return tpl
+
+
+    def render_request(self, tpl, tokens=None):
+        """
+        framed request (single chunk and end-of-chunks) from template, rendered again only when some token changed
+        :param tpl:
+        :param tokens: token values of caller preferred to VARS
+        :return: bytes to send
+        """
+        parts = tpl['parts']
+        values = tuple(self.token_value(parts[i], tokens) for i in tpl['slots'])
+        if values != tpl['values'] or tpl['wire'] is None:
+            if values:
+                parts = list(parts)
+                for i, value in zip(tpl['slots'], values): parts[i] = value
+            data = ''.join(parts)
+            match = self.MSGID_RQ.search(data)
+            tpl['values'], tpl['msgid'] = values, match.group(1) if match else None
+            tpl['wire'] = self.chunk_str(data) + "\n" + self.EOM_11
+        return tpl['wire']
+
+
+    def send_template_chunks(self, tpl, tokens=None):
+        """
+        netconf 1.1 chunked framing of template larger than rq_chunk_size - token values are rendered for each request
+        and chunks are cut from template parts (rendered request is never joined or cached), one write per chunk
+        :param tpl: template (see load_request)
+        :param tokens: token values of caller preferred to VARS
+        :return: bytes sent including framing
+        """
+        bsize = self.rq_chunk_size
+        self.msgid += 1
+        self.last_msgid = None
+        parts = list(tpl['parts'])
+        for i in tpl['slots']: parts[i] = self.token_value(parts[i], tokens)
+        # end of previous chunk, rpc tag may span two chunks
+        state = dict(cnt=0, tail='')
+
+        def send(block, eof=False):
+            if self.last_msgid is None:
+                match = self.MSGID_RQ.search(state['tail'] + block)
+                if match: self.last_msgid = match.group(1)
+                state['tail'] = block[-4096:]
+            data = self.chunk_str(block) if block else ''
+            if eof: data += "\n" + self.EOM_11
+            NetConf.dbg("chunk(%d) eof(%s)", len(block), eof)
+            state['cnt'] += self.write_all(data)
+
+        chunk, size = [], 0
+        for part in parts:
+            pos = 0
+            while pos < len(part):
+                piece = part[pos:pos + bsize - size]
+                chunk.append(piece)
+                size += len(piece)
+                pos += len(piece)
+                if size == bsize:
+                    send(''.join(chunk))
+                    chunk, size = [], 0
+        send(''.join(chunk), True)
+        return state['cnt']
 
 
     def send_rq10_str(self, str):
@@ -397,13 +2282,12 @@ class NetConf:
         cnt = 0
         self.last_error = ''
         start = time.time()
+        self.mark_start()
         try:
-            self.ssh.stdin.write(str)
-            cnt += len(str)
-            self.ssh.stdin.write("\n"+self.EOM_10)
-            cnt += len("\n"+self.EOM_10)
+            cnt += self.write_all(str + "\n" + self.EOM_10)
         except (OSError, IOError) as e:
             self.print_err('Sending Rq.10 failed - %s' % e)
+        self.mark('sent')
 
         return cnt, time.time()-start
 
@@ -417,19 +2301,16 @@ class NetConf:
         cnt = 0
         self.last_error = ''
         start = time.time()
+        self.mark_start(fname)
         try:
             with open(fname) as f:
-                for line in f:
-                    # dbg
-                    NetConf.dbg("line(%s)" % line)
-                    self.ssh.stdin.write(line)
-                    cnt += len(line)
-            line = "\n"+self.EOM_10
-            self.ssh.stdin.write(line)
-            self.ssh.stdin.flush()
-            cnt += len(line)
+                rq = f.read()
+            # dbg
+            NetConf.dbg("rq(%s)", rq)
+            cnt += self.write_all(rq + "\n" + self.EOM_10)
         except (OSError, IOError) as e:
             self.print_err('Sending Rq.10 %s failed - %s' % (fname, e))
+        self.mark('sent')
 
         return cnt, time.time()-start
 
@@ -443,180 +2324,411 @@ class NetConf:
         cnt = 0
         self.last_error = ''
         start = time.time()
+        self.mark_start()
         try:
-            cline = self.replace_tokens(str)
-            cline = self.chunk_str(cline)
-            self.ssh.stdin.write(cline)
-            cnt += len(cline)
-
-            cline = "\n"+self.EOM_11
-            self.ssh.stdin.write(cline)
-            cnt += len(cline)
+            cnt = self.send_chunks(io.BytesIO(str), len(str))
         except (OSError, IOError) as e:
             self.print_err('Sending Rq.11 failed - %s' % e)
+        self.mark('sent')
 
         return cnt, time.time()-start
 
 
-    def send_rq11_file(self, fname):
+    def send_rq11_file(self, fname, tpl=None, tokens=None):
         """
         send netconf 1.1 request from file
-        :param fd:
+        :param fname:
+        :param tpl: preloaded template of request (file is not checked for changes)
+        :param tokens: token values of caller preferred to VARS
         :return:
         """
         cnt = 0
         self.last_error = ''
         start = time.time()
+        self.mark_start(fname)
         try:
-            with open(fname) as f:
-                for line in f:
-                    # skip empty lines
-                    if not line.strip(): continue
-                    # dbg
-                    NetConf.dbg("line(%s)" % line)
-                    cline = self.replace_tokens(line)
-                    cline = self.chunk_str(cline)
-                    self.ssh.stdin.write(cline)
-                    cnt += len(cline)
-                    #print 'rq11:%s' % cline,
-            cline = "\n"+self.EOM_11
-            self.ssh.stdin.write(cline)
-            cnt += len(cline)
-            #print 'rq11:%s' % cline,
+            size = os.stat(fname).st_size if tpl is None else tpl['stat'][1]
+            if not self.rq_chunk_size or size <= self.rq_chunk_size:
+                # whole request as single chunk from compiled template
+                self.msgid += 1
+                if tpl is None: tpl = self.compile_request(fname)
+                wire = self.render_request(tpl, tokens)
+                self.last_msgid = tpl['msgid']
+                cnt = self.write_all(wire)
+            elif tpl is not None:
+                # preloaded large request is sent from its template, not from file changed meanwhile
+                cnt = self.send_template_chunks(tpl, tokens)
+            else:
+                # large request is never compiled, it is streamed from file in constant memory
+                with open(fname, 'rb') as f:
+                    cnt = self.send_chunks(f, size, tokens)
+            self.marks['msgid'] = self.last_msgid
         except (OSError, IOError) as e:
             self.print_err('Sending Rq.11 %s failed - %s' % (fname, e))
+        self.mark('sent')
 
         return cnt, time.time()-start
 
 
+    def xml_parser(self, wants=None):
+        """
+        incremental parser fed as response data arrive (parsing overlaps with receiving)
+        :param wants: keep only elements matching these names or paths (see XmlPick), None for full tree
+        :return:
+        """
+        return ET.XMLParser(target=XmlPick(wants))
+
 
-    def recv_rs10_xml(self):
+    def recv_rs10_xml(self, wants=None):
         """
         receive netconf 1.0 response and parse response to xml
+        :param wants: keep only elements matching these names or paths (see XmlPick), None for full tree
         :return:
         """
         cnt = 0
         self.last_error = ''
         start = time.time()
-        res = []
+        self.mark_recv()
         xml = None
         try:
+            parser = self.xml_parser(wants)
             while True:
-                line = self.readln(self.ssh.stdout, self.EOM_10)
-                # dbg
-                NetConf.dbg("line(%s)" % line)
+                line = self.readln(self.ssh, self.EOM_10)
                 cnt += len(line)
                 if line == self.EOM_10:
                     break
-                res.append(line)
-            xml = ET.fromstringlist(res)
-        except (OSError, IOError) as e:
+                parser.feed(line)
+            self.mark('last')
+            xml = parser.close()
+        except (OSError, IOError, SyntaxError) as e:
             self.print_err('Receiving Rq.10 failed - %s' % e)
+        self.mark('done')
 
         return cnt, time.time()-start, xml
 
 
     def recv_rs10_file(self, fname):
         """
-        receive netconf 1.0 response and store it to file
-        :return:
+        receive netconf 1.0 response and store it to file
+        :return:
+        """
+        cnt = 0
+        self.last_error = ''
+        start = time.time()
+        self.mark_recv()
+        try:
+            with open(fname,'w') as f:
+                while True:
+                    line = self.readln(self.ssh, self.EOM_10)
+                    # dbg
+                    NetConf.dbg("line(%s)", line)
+                    cnt += len(line)
+                    if line == self.EOM_10:
+                        break
+                    f.write(line)
+                self.mark('last')
+        except (OSError, IOError) as e:
+            self.print_err('Receiving Rq.10 %s failed - %s' % (fname, cnt))
+        self.mark('done')
+
+        return cnt, time.time()-start
+
+
+    def recv_rs11_file(self, fname, rqfname=None, idx=None):
+        """
+        receive netconf 1.1 response and store it to file (or archive, see open_response)
+        :param fname:
+        :param rqfname: request file name for archive index
+        :param idx: loop iteration for archive index
+        :return:
+        """
+        size = 0
+        self.last_error = ''
+        self.last_status = ''
+        start = time.time()
+        self.mark_recv()
+        try:
+            with self.open_response(fname, rqfname, idx) as f:
+                scan = RpcStatus()
+                size = self.recv_chunks(self.ssh, self.timed(self.scanned(f.write, scan)))
+                self.mark('last')
+                self.last_status = self.marks['status'] = scan.close()
+        except (OSError, IOError) as e:
+            self.print_err('Receiving Rq.11 %s failed - %s' % (fname, e))
+        self.mark('done')
+
+        return size, time.time()-start
+
+    def recv_rs11_xml(self, wants=None):
+        """
+        receive netconf 1.1 response and parse it to xml
+        :param wants: keep only elements matching these names or paths (see XmlPick), None for full tree
+        :return:
+        """
+        size = 0
+        self.last_error = ''
+        xml = None
+        start = time.time()
+        self.mark_recv()
+        try:
+            while True:
+                parser = self.xml_parser(wants)
+                size += self.recv_chunks(self.ssh, self.timed(lambda data: parser.feed(data.tobytes())))
+                xml = parser.close()
+                # notifications still coming after subscribe() are skipped
+                if xml is None or not xml.tag.endswith('}notification'): break
+                self.notifications_skipped += 1
+            self.mark('last')
+        except (OSError, IOError, SyntaxError) as e:
+            self.print_err('Receiving Rq.11 failed - %s' % e)
+        self.mark('done')
+
+        return size, time.time()-start, xml
+
+
+    def send_rq11_pipelined(self, rqfname, rsfname, idx=None, loopstat=None, intended=None, tpl=None, hist=None, tokens=None):
+        """
+        send netconf 1.1 request from file without waiting for response, response is received by recv_rs11_pipelined()
+        :param rqfname:
+        :param rsfname:
+        :param idx: loop counter
+        :param loopstat:
+        :param intended: scheduled send time (monotonic), rq time is measured from it when set
+        :param tpl: preloaded template of request
+        :param hist: latency histogram of scenario step
+        :param tokens: token values of caller preferred to VARS
+        :return:
+        """
+        sent, senttime = self.send_rq11_file(rqfname, tpl, tokens)
+        start = monotonic()
+        if intended is not None: senttime = start - intended
+        stepstat = self.sched['stat'] if self.sched is not None else None
+        self.inflight.append(dict(msgid=self.last_msgid, rq=rqfname, rs=rsfname, idx=idx, loopstat=loopstat,
+                                  stepstat=stepstat, sent=sent, senttime=senttime, start=start, error=self.last_error,
+                                  marks=self.marks, archive=self.archive_path, hist=hist))
+        # receive phases are marked separately for each response
+        self.marks = None
+        NetConf.dbg("message-id(%s) inflight(%d)", self.last_msgid, len(self.inflight))
+        return
+
+
+    def match_reply(self, head):
+        """
+        remove request matching message-id from rpc-reply head out of in-flight requests
+        (replies come in order of requests so the oldest one is used when message-id is missing or not unique)
+        :param head: beginning of response
+        :return: in-flight request, None for reply to no request in flight (reported as error)
+        """
+        msgid = None
+        match = self.RPC_REPLY.search(head)
+        if match:
+            match = self.MSGID_RS.search(match.group(1))
+            if match: msgid = match.group(1)
+        for rq in self.inflight:
+            if rq['msgid'] == msgid:
+                break
+        else:
+            # requests without message-id can't be told apart by it
+            rq = next((rq for rq in self.inflight if msgid is None or rq['msgid'] is None), None)
+            if rq is None:
+                self.print_err('Received rpc-reply message-id(%s) of no request in flight (unsolicited or duplicate)' %
+                               msgid)
+                return None
+            if msgid is not None: NetConf.dbg("message-id(%s) not found - (%s) used", msgid, rq['msgid'])
+        self.inflight.remove(rq)
+        return rq
+
+
+    def recv_rs11_pipelined(self):
+        """
+        receive one netconf 1.1 response, match it to in-flight request by message-id and store it to its file
+        :return: in-flight request with recv and recvtime (since request was sent complete) set
         """
-        cnt = 0
+        size = 0
         self.last_error = ''
-        start = time.time()
+        # matched request and opened response file (dict as python 2 closure can't rebind outer names)
+        state = {}
+        head = bytearray()
+        scan = RpcStatus()
+        self.mark_recv()
+
+        def open_rs():
+            rq = self.match_reply(head)
+            if rq is None:
+                # unexpected reply is received and dropped, requests in flight keep waiting for theirs
+                state['f'] = open(os.devnull, 'wb')
+            else:
+                state['rq'] = rq
+                state['f'] = self.open_response(rq['rs'], rq['rq'], rq['idx'], rq['archive'])
+            state['f'].write(head)
+
+        def write(view):
+            if 'f' in state: return state['f'].write(view)
+            # buffer beginning of response till rpc-reply tag is complete
+            head.extend(view)
+            if len(head) < self.rdbuf_size and self.RPC_REPLY.search(head) is None: return
+            open_rs()
+
         try:
-            with open(fname,'w') as f:
-                while True:
-                    line = self.readln(self.ssh.stdout, self.EOM_10)
-                    # dbg
-                    NetConf.dbg("line(%s)" % line)
-                    cnt += len(line)
-                    if line == self.EOM_10:
-                        break
-                    f.write(line)
+            size = self.recv_chunks(self.ssh, self.timed(self.scanned(write, scan)))
+            self.mark('last')
+            self.marks['status'] = scan.close()
+            if 'f' not in state: open_rs()
         except (OSError, IOError) as e:
-            self.print_err('Receiving Rq.10 %s failed - %s' % (fname, cnt))
+            if 'rq' not in state and 'f' not in state and self.inflight: state['rq'] = self.inflight.popleft()
+            self.print_err('Receiving Rq.11 %s failed - %s' % (state['rq']['rs'] if 'rq' in state else '', e))
+            # incomplete response is never archived (plain response file is kept as received)
+            if 'f' in state: getattr(state.pop('f'), 'abort', lambda: None)()
+        finally:
+            if 'f' in state: state['f'].close()
+        self.mark('done')
+        rq = state.get('rq')
+        if rq is not None:
+            rq['recv'], rq['recvtime'] = size, monotonic()-rq['start']
+            rq['status'] = self.marks.get('status', '')
+            if rq['marks'] is not None: rq['marks'].update(self.marks)
+            if rq['error'] and not self.last_error: self.last_error = rq['error']
+        self.marks = None
+        return rq
+
+
+    def drain_pipeline(self, depth=0, hrf=None, tstamp=None):
+        """
+        receive responses till no more than depth requests are in flight, print them and update loop statistics
+        :param depth:
+        :param hrf:
+        :param tstamp:
+        :return:
+        """
+        while len(self.inflight) > depth:
+            rq = self.recv_rs11_pipelined()
+            # dropped reply to no request in flight
+            if rq is None: continue
+            self.print_line(None, tstamp, 'FILE' if rq['idx'] is None else '%4d. FILE' % rq['idx'], '%s -> %s' % (rq['rq'],rq['rs']))
+            self.print_line(hrf=hrf, res=rq['status'], bytes=(rq['sent'],rq['recv']), times=(rq['senttime'],rq['recvtime']))
+            self.add_stats((rq['sent'],rq['recv']), (rq['senttime'],rq['recvtime']), rq['loopstat'], stepstat=rq['stepstat'],
+                           marks=rq['marks'])
+            if rq['hist'] is not None: rq['hist'].add(rq['senttime']+rq['recvtime'])
+        return
 
-        return cnt, time.time()-start
+
+    def wait_schedule(self, hrf=None, tstamp=None):
+        """
+        open-loop scheduler - wait till intended send time of next request (receiving responses meanwhile),
+        requests are never delayed by responses so latency measured from intended time includes any queueing
+        :param hrf:
+        :param tstamp:
+        :return: intended send time (monotonic)
+        """
+        sched = self.sched
+        if sched is None:
+            sched = self.sched = dict(rate=float(self.rate), t0=monotonic(), n=0, stat=self.new_stats())
+        elif self.ramp_every and sched['n'] >= self.ramp_every:
+            # next step - finish this one first so steps are measured separately
+            self.finish_rate_step(hrf, tstamp)
+            sched = self.sched = dict(rate=sched['rate']+self.ramp_step, t0=monotonic(), n=0, stat=self.new_stats())
+        intended = sched['t0'] + sched['n'] / sched['rate']
+        sched['n'] += 1
+        fd = self.ssh.fileno()
+        while True:
+            wait = intended - monotonic()
+            if wait <= 0: break
+            if not self.inflight:
+                time.sleep(wait)
+            elif self.rpos < self.rend or self.wait_readable(fd, wait):
+                self.drain_pipeline(len(self.inflight)-1, hrf, tstamp)
+        return intended
 
 
-    def recv_rs11_file(self, fname):
+    def finish_rate_step(self, hrf=None, tstamp=None):
         """
-        receive netconf 1.1 response and store it to file
-        :param fname:
+        receive all responses of current rate step and print target vs achieved rate and latency of the step,
+        next request starts new step
+        :param hrf:
+        :param tstamp:
         :return:
         """
-        cnt = clen = size = 0
+        sched = self.sched
+        if sched is None or not sched['n']: return
+        self.drain_pipeline(0, hrf, tstamp)
+        stat = sched['stat']
         self.last_error = ''
-        start = time.time()
-        try:
-            with open(fname,'w') as f:
-                while True:
-                    line = self.readln(self.ssh.stdout, self.EOM_11)
-                    NetConf.dbg("line(%s)" % line)
-                    cnt  += len(line)
-                    size += len(line)
-                    # chunk expected
-                    if cnt >= clen:
-                        # end of message
-                        if line == self.EOM_11:
-                            break
-                        # lenght chunk
-                        match = self.CHUNK.match(line)
-                        if match:
-                            clen = int(match.group(1))
-                            cnt = 0
-                            NetConf.dbg("chunk found with len(%d)" % clen)
-                            continue
-                        if cnt > clen+1:
-                            self.print_err('Received chunking error cnt(%d) > length(%d) line:%s' % (cnt, clen, line))
-                    # write only lines inside chunk
-                    if clen > 0:
-                        f.write(line)
-        except (OSError, IOError) as e:
-            self.print_err('Receiving Rq.11 %s failed - %s' % (fname, e))
+        self.print_line(hrf, tstamp, 'RATE', 'target %.1f rpc/s' % sched['rate'],
+                        'achieved %.1f rpc/s' % self.rpc_rate(stat),
+                        (stat['sent'], stat['recv']), (stat['sentsc'], stat['recvsc']))
+        records = self.stats_records('RATE', '%g' % sched['rate'], stat)
+        self.print_latency(records, tstamp)
+        self.rate_records.extend(records)
+        self.sched = None
+        return
 
-        return size, time.time()-start
 
-    def recv_rs11_xml(self):
+    def subscribe(self, stream='NETCONF', duration=0, prefix=None, hrf=None, tstamp=None):
         """
-        receive netconf 1.1 response and parse it to xml
-        :param fname:
+        create-subscription and receive notifications till duration expires, session ends or ctrl-c,
+        notifications are written to rotated files (see RotatingFile) and event rate, throughput and backlog
+        (data received but not processed yet) are printed every report_interval
+        :param stream: stream name or request file with create-subscription (for filter, start time ..)
+        :param duration: seconds (0 = no limit)
+        :param prefix: response prefix (None = notifications are only counted)
+        :param hrf:
+        :param tstamp:
         :return:
         """
-        cnt = clen = size = 0
+        self.print_line(None, tstamp, 'SUBSCRIBE', stream)
+        if os.path.isfile(stream):
+            sent, senttime = self.send_rq11_file(stream)
+        else:
+            sent, senttime = self.send_rq11_str(self.SUBSCRIPTION % (self.xmlns, self.xmlns_notif, stream))
+        recv, recvtime, xml = self.recv_rs11_xml(self.STATUS_PICK)
+        status = self.rs_status(xml)
+        self.print_line(hrf=hrf, par=status, bytes=(sent,recv), times=(senttime,recvtime))
+        self.add_stats((sent,recv), (senttime,recvtime), oper='SUBSCRIBE')
+        if status != 'OK': return
+
+        out = RotatingFile(prefix, self.rotate_size, self.rotate_time) if prefix is not None else None
+        write = out.write if out is not None else None
+        fd = self.ssh.fileno()
+        start = monotonic()
+        stop = start + duration if duration else None
+        report = start + self.report_interval
+        # totals and counters of current report interval
+        events = size = 0
+        last_events = last_size = 0
+        max_backlog = 0
         self.last_error = ''
-        res = []
-        xml = None
-        start = time.time()
         try:
             while True:
-                line = self.readln(self.ssh.stdout, self.EOM_11)
-                NetConf.dbg("line(%s)" % line)
-                cnt  += len(line)
-                size += len(line)
-                # chunk expected
-                if cnt >= clen:
-                    # end of message
-                    if line == self.EOM_11:
-                        xml = ET.fromstringlist(res)
-                        break
-                    # lenght chunk
-                    match = self.CHUNK.match(line)
-                    if match:
-                        clen = int(match.group(1))
-                        cnt = 0
-                        NetConf.dbg("chunk found with len(%d)" % clen)
-                        continue
-                    if cnt > clen+1:
-                        self.print_err('Received chunking error cnt(%d) > length(%d) line:%s' % (cnt, clen, line))
-                # write only lines inside chunk
-                if clen > 0:
-                    res.append(line)
+                now = monotonic()
+                if now >= report:
+                    backlog = self.rend - self.rpos + self.ssh.pending()
+                    max_backlog = max(max_backlog, backlog)
+                    sec = now - report + self.report_interval
+                    self.print_line(None, tstamp, 'NOTIFY', '%.1f ev/s %sB/s' % ((events-last_events)/sec, self.kMGT((size-last_size)/sec)),
+                                    'backlog %sB total %d' % (self.kMGT(backlog), events))
+                    last_events, last_size = events, size
+                    # skip reports missed while receiving long message
+                    report = max(report + self.report_interval, now)
+                if stop is not None and now >= stop: break
+                wait = min(report, stop) if stop is not None else report
+                # receive only when message is coming so idle stream doesn't hit read timeout
+                if self.rpos == self.rend and not self.wait_readable(fd, wait - now): continue
+                size += self.recv_chunks(self.ssh, write)
+                events += 1
+                if out is not None: out.end_message()
         except (OSError, IOError) as e:
-            self.print_err('Receiving Rq.11 failed - %s' % e)
-
-        return size, time.time()-start, xml
+            self.print_err('Receiving notifications failed - %s' % e)
+        except KeyboardInterrupt:
+            self.print_line(None, tstamp, 'NOTIFY', 'interrupted', 'STOP')
+        finally:
+            if out is not None: out.close()
+        wall = monotonic() - start
+        self.sessionstat['recv'] += size
+        self.print_line(hrf, tstamp, 'NOTIFY', '=== SUMMARY.STATS === %s' % self.sec(wall),
+                        '%d events %.1f ev/s, max backlog %sB, %d files' % (events, events/wall if wall > 0 else 0.0,
+                                                                           self.kMGT(max_backlog), out.files if out else 0),
+                        (0, size), (0, wall))
+        return
 
 
     def send_recv_hello(self):
@@ -635,7 +2747,7 @@ class NetConf:
         </capabilities>
         </hello>"""
         sent, time_sent = self.send_rq10_str(hello_rq % self.xmlns)
-        recv, time_recv, hello_rs = self.recv_rs10_xml()
+        recv, time_recv, hello_rs = self.recv_rs10_xml(self.HELLO_PICK)
         sessionid = hello_rs.findtext('{%s}session-id' % self.xmlns) if hello_rs is not None else '-'
         return sessionid, (sent,recv), (time_sent,time_recv)
 
@@ -651,23 +2763,91 @@ class NetConf:
         
     def find_in_xmlfile(self, fname, match):
         """
-
+        text of the first element matching tag name or path
         :param fname:
         :param match:
         :return:
         """
-        res = None
+        return self.find_all_in_xmlfile(fname, [match]).get(match)
+
+
+    @staticmethod
+    def compile_path(expr):
+        """
+        simple xpath subset - 'tag' or '//a/b' matches anywhere, '/a/b/c' only from root element, '*' matches any
+        element, namespace prefixes are ignored (local names are compared)
+        :param expr:
+        :return: (anchored, steps)
+        """
+        anchored = expr.startswith('/') and not expr.startswith('//')
+        steps = [step.split(':')[-1] for step in expr.strip('/').split('/') if step]
+        return anchored, steps
+
+
+    @staticmethod
+    def match_path(path, anchored, steps):
+        """
+        check if path (local names from root to element) matches compiled expression
+        :param path:
+        :param anchored:
+        :param steps:
+        :return:
+        """
+        if len(path) < len(steps) or (anchored and len(path) != len(steps)): return False
+        for name, step in zip(path[len(path)-len(steps):], steps):
+            if step != '*' and step != name: return False
+        return True
+
+
+    def find_all_in_xmlfile(self, fname, exprs):
+        """
+        incremental (iterparse) search for text of the first element matching each of expressions,
+        processed elements are dropped as parsing goes and parsing stops when all expressions are found
+        :param fname: file name or file-like object
+        :param exprs: list of tag names or simple paths (see compile_path)
+        :return: dict expression -> text (expressions not found are missing)
+        """
+        res = {}
+        # expressions indexed by local name of their last step ('*' for any)
+        todo = {}
+        for expr in exprs:
+            anchored, steps = self.compile_path(expr)
+            if steps: todo.setdefault(steps[-1], []).append((expr, anchored, steps))
+        left = sum(len(lst) for lst in todo.itervalues())
+        # element matched by expression waiting for its end (text complete)
+        pending = []
+        path = []
+        elems = []
+        names = {}
         try:
-            tree = ET.parse(fname)
-            root = tree.getroot()
-            #res = root.find(match, namespaces={'ns':self.xmlns})
-            for elm in root.getiterator():
-                if elm.tag.endswith("}%s" % match):
-                    return elm.text
-        except OSError as e:
+            with open(fname, 'rb') if isinstance(fname, basestring) else fname as f:
+                for event, elem in ET.iterparse(f, events=('start', 'end')):
+                    if event == 'start':
+                        tag = elem.tag
+                        name = names.get(tag)
+                        if name is None: name = names[tag] = tag.rsplit('}', 1)[-1]
+                        path.append(name)
+                        elems.append(elem)
+                        for key in (name, '*'):
+                            lst = todo.get(key)
+                            if not lst: continue
+                            for item in lst[:]:
+                                if self.match_path(path, item[1], item[2]):
+                                    pending.append((elem, item[0]))
+                                    lst.remove(item)
+                        continue
+                    while pending and pending[-1][0] is elem:
+                        res[pending.pop()[1]] = elem.text
+                        left -= 1
+                    if not left: break
+                    path.pop()
+                    elems.pop()
+                    # all previous siblings are done too, keep memory constant
+                    if elems: del elems[-1][:]
+        except (OSError, IOError, SyntaxError) as e:
             self.print_err('XML parsing Rs %s failed - %s' % (fname, e))
-        return
-        
+        return res
+
 
     def send_cmd(self, cmd='close-session'):
         """
@@ -679,8 +2859,10 @@ class NetConf:
         <%s/>
         </rpc>"""
         sent, time_sent = self.send_rq11_str(close_rq % (self.xmlns, cmd))
-        recv, time_recv, xml = self.recv_rs11_xml()
-        return (sent,recv), (time_sent,time_recv), self.rs_status(xml)
+        recv, time_recv, xml = self.recv_rs11_xml(self.STATUS_PICK)
+        status = self.rs_status(xml)
+        if self.marks is not None: self.marks['status'] = status
+        return (sent,recv), (time_sent,time_recv), status
 
 
     def rs_status(self, xml):
@@ -693,17 +2875,17 @@ class NetConf:
         # no xml no status
         if xml is None: return ''
         # ok ?
-        ok = xml.find('./ns:ok', namespaces={'ns':self.xmlns})
+        ok = xml.find('./ns:ok', {'ns':self.xmlns})
         if ok is not None: return 'OK'
         # error ?
-        err = xml.find('./ns:rpc-error', namespaces={'ns':self.xmlns})
+        err = xml.find('./ns:rpc-error', {'ns':self.xmlns})
         if err is None: return '?'
         # error deails
-        err_type = err.find('./ns:error-type', namespaces={'ns':self.xmlns}).text
-        err_tag  = err.find('./ns:error-tag',  namespaces={'ns':self.xmlns}).text
-        err_sev  = err.find('./ns:error-severity', namespaces={'ns':self.xmlns}).text
-        err_path = err.find('./ns:error-path', namespaces={'ns':self.xmlns}).text
-        err_msg  = err.find('./ns:error-message', namespaces={'ns':self.xmlns}).text
+        err_type = err.findtext('./ns:error-type', '', {'ns':self.xmlns})
+        err_tag  = err.findtext('./ns:error-tag',  '', {'ns':self.xmlns})
+        err_sev  = err.findtext('./ns:error-severity', '', {'ns':self.xmlns})
+        err_path = err.findtext('./ns:error-path', '', {'ns':self.xmlns})
+        err_msg  = err.findtext('./ns:error-message', '', {'ns':self.xmlns})
         return "%s: %s" % (err_sev.upper(), err_tag)
 
 
@@ -723,6 +2905,330 @@ class NetConf:
         return self.send_cmd('close-session')
 
 
+    @staticmethod
+    def new_stats():
+        """
+        statistics accumulator (loop, session, fleet)
+        :return:
+        """
+        return dict([
+            ('sent',   0),
+            ('recv',   0),
+            ('sentsc', 0),
+            ('recvsc', 0),
+            ('rpcs',   0),
+            # time of the first operation start and of the last operation end
+            ('start',  None),
+            ('end',    None),
+            # latency histogram per operation
+            ('hist',   {}),
+            # operation -> phase -> [count, total seconds]
+            ('phases', {})
+        ])
+
+
+    def add_stats(self, bytes, times, loopstat=None, oper='FILE', stepstat=None, marks=None):
+        """
+        account operation to session statistics and loop statistics when looping
+        :param bytes: (sent, recv)
+        :param times: (senttime, recvtime)
+        :param loopstat:
+        :param oper: operation for latency histogram
+        :param stepstat: statistics of open-loop rate step
+        :param marks: phase marks of operation (default last operation, see mark_start)
+        :return:
+        """
+        end = time.time()
+        for stat in (self.sessionstat, loopstat, stepstat):
+            if stat is None: continue
+            stat['sent']   += bytes[0]
+            stat['recv']   += bytes[1]
+            stat['sentsc'] += times[0]
+            stat['recvsc'] += times[1]
+            stat['rpcs']   += 1
+            if stat['start'] is None: stat['start'] = end - times[0] - times[1]
+            stat['end'] = end
+            if oper not in stat['hist']: stat['hist'][oper] = Histogram()
+            stat['hist'][oper].add(times[0] + times[1])
+        marks = marks if marks is not None else self.marks
+        self.trace(oper, bytes, self.phases(marks), marks)
+        self.marks = None
+        return
+
+
+    def add_setup(self, times, tstamp=None):
+        """
+        report and account session setup phase (connect + hello) after the first hello of session
+        :param times: (senttime, recvtime) of hello
+        :param tstamp:
+        :return:
+        """
+        if self.connect_time is None: return
+        setup = self.connect_time + times[0] + times[1]
+        self.connect_time = None
+        self.print_line(None, tstamp, 'SETUP', 'connect + hello', self.sec(setup))
+        if 'SETUP' not in self.sessionstat['hist']: self.sessionstat['hist']['SETUP'] = Histogram()
+        self.sessionstat['hist']['SETUP'].add(setup)
+        return
+
+
+    def mark_start(self, rq=None):
+        """
+        start marking phases of new operation (send start)
+        :param rq: request file name
+        :return:
+        """
+        self.marks = {'rq': rq, 'start': monotonic()}
+        return
+
+
+    def mark_recv(self):
+        """
+        start marking receive phases, response data already buffered arrived before receiving started
+        :return:
+        """
+        if self.marks is None: self.marks = {}
+        if self.rpos < self.rend: self.marks['first'] = monotonic()
+        return
+
+
+    def mark(self, name):
+        """
+        mark end of phase of current operation
+        :param name: sent, first (byte), last (byte), done (stored or parsed)
+        :return:
+        """
+        if self.marks is not None: self.marks[name] = monotonic()
+        return
+
+
+    def scanned(self, write, scan):
+        """
+        write callable feeding response status detection (see RpcStatus) till status is known
+        :param write:
+        :param scan: RpcStatus
+        :return:
+        """
+        def scanned_write(data):
+            write(data)
+            if scan.status is None: scan.feed(data)
+
+        return scanned_write
+
+
+    def timed(self, write):
+        """
+        write callable accounting its duration to store time of current operation when tracing
+        (storing and parsing run while response is being received)
+        :param write:
+        :return:
+        """
+        marks = self.marks
+        if marks is None or (self.trace_out is None and self.trace_prom is None): return write
+
+        def timed_write(data):
+            start = monotonic()
+            write(data)
+            marks['store'] = marks.get('store', 0.0) + monotonic() - start
+
+        return timed_write
+
+
+    @staticmethod
+    def phases(marks):
+        """
+        phase durations from marks - send (request written), ttfb (till first response byte), transfer (till last
+        byte without storing), store (storing/parsing including finishing after last byte), phases sum to total
+        :param marks:
+        :return: ordered dict phase -> seconds
+        """
+        phases = collections.OrderedDict()
+        if not marks or 'start' not in marks: return phases
+        if 'sent' in marks: phases['send'] = marks['sent'] - marks['start']
+        if 'first' in marks and 'sent' in marks: phases['ttfb'] = max(0.0, marks['first'] - marks['sent'])
+        if 'last' in marks and 'first' in marks: phases['transfer'] = marks['last'] - marks['first'] - marks.get('store', 0.0)
+        if 'done' in marks and 'last' in marks: phases['store'] = marks['done'] - marks['last'] + marks.get('store', 0.0)
+        if 'done' in marks: phases['total'] = marks['done'] - marks['start']
+        return phases
+
+
+    def trace(self, oper, bytes, phases, marks=None):
+        """
+        account phases to session statistics and write trace record (json line) when tracing
+        :param oper:
+        :param bytes: (sent, recv)
+        :param phases: from phases()
+        :param marks:
+        :return:
+        """
+        for phase, sec in phases.iteritems():
+            acc = self.sessionstat['phases'].setdefault(oper, {}).setdefault(phase, [0, 0.0])
+            acc[0] += 1
+            acc[1] += sec
+        if self.trace_out is None: return
+        rec = collections.OrderedDict([
+            ('time',    round(time.time(), 6)),
+            ('host',    self.host),
+            ('session', self.session_id),
+            ('oper',    oper),
+            ('rq',      marks.get('rq') if marks else None),
+            ('msgid',   marks.get('msgid') if marks else None),
+            ('sent',    bytes[0]),
+            ('recv',    bytes[1])
+        ])
+        for phase, sec in phases.iteritems():
+            rec[phase] = round(sec, 6)
+        rec['status'] = marks.get('status') if marks else None
+        rec['error'] = self.last_error or None
+        # single write of whole line to file opened for appending - lines of parallel sessions don't mix
+        self.trace_out.write(json.dumps(rec) + '\n')
+        return
+
+
+    @staticmethod
+    def merge_stats(total, stat):
+        """
+        add statistics of one session to total (fleet or all sessions)
+        :param total:
+        :param stat:
+        :return:
+        """
+        for key in ('sent', 'recv', 'sentsc', 'recvsc', 'rpcs'):
+            total[key] += stat[key]
+        if stat['start'] is not None:
+            total['start'] = stat['start'] if total['start'] is None else min(total['start'], stat['start'])
+            total['end']   = stat['end']   if total['end']   is None else max(total['end'],   stat['end'])
+        for oper, hist in stat['hist'].iteritems():
+            if oper not in total['hist']: total['hist'][oper] = Histogram()
+            total['hist'][oper].merge(hist)
+        for oper, phases in stat['phases'].iteritems():
+            for phase, (cnt, sec) in phases.iteritems():
+                acc = total['phases'].setdefault(oper, {}).setdefault(phase, [0, 0.0])
+                acc[0] += cnt
+                acc[1] += sec
+        return
+
+
+    @staticmethod
+    def stats_records(scope, name, stat):
+        """
+        statistics as flat records (one per operation) for printing and export
+        :param scope: LOOP, SESSION, DEVICE, FLEET ...
+        :param name:
+        :param stat:
+        :return: list of dicts
+        """
+        records = []
+        span = stat['end'] - stat['start'] if stat['rpcs'] else 0
+        for oper in sorted(stat['hist']):
+            hist = stat['hist'][oper]
+            rec = collections.OrderedDict([
+                ('scope', scope),
+                ('name',  name),
+                ('oper',  oper),
+                ('count', hist.count),
+                ('rate',  hist.count / span if span > 0 else 0.0),
+                ('min',   hist.min),
+                ('mean',  hist.total / hist.count if hist.count else None)
+            ])
+            for pct in NetConf.PERCENTILES:
+                rec['p%s' % pct] = hist.percentile(pct)
+            rec['max'] = hist.max
+            records.append(rec)
+        return records
+
+
+    def print_latency(self, records, tstamp=None):
+        """
+        print latency percentiles (in ms) and rate of operations
+        :param records: from stats_records()
+        :param tstamp:
+        :return:
+        """
+        for rec in records:
+            pcts = ' '.join('p%s:%.1f' % (pct, 1000*rec['p%s' % pct]) for pct in self.PERCENTILES)
+            self.print_line(None, tstamp, 'LATENCY', '%s %d x %.1f rpc/s' % (rec['oper'], rec['count'], rec['rate']),
+                            'ms min:%.1f %s max:%.1f' % (1000*rec['min'], pcts, 1000*rec['max']))
+        return
+
+
+    @staticmethod
+    def export_stats(fname, records):
+        """
+        write statistics records to json or csv file (by extension)
+        :param fname:
+        :param records:
+        :return:
+        """
+        if not fname or not records: return
+        with open(fname, 'wb') as f:
+            if fname.lower().endswith('.csv'):
+                writer = csv.DictWriter(f, records[0].keys())
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                json.dump(records, f, indent=1)
+        return
+
+
+    @staticmethod
+    def export_prom(fname, stats):
+        """
+        write phase times and latency percentiles as prometheus textfile (node exporter textfile collector),
+        file is replaced atomically
+        :param fname:
+        :param stats: list of (scope, name, statistics)
+        :return:
+        """
+        if not fname or not stats: return
+        esc = lambda val: str(val).replace('\\', '\\\\').replace('"', '\\"')
+        lines = ['# HELP nc_phase_seconds Time spent in phase of netconf operation',
+                 '# TYPE nc_phase_seconds summary']
+        for scope, name, stat in stats:
+            for oper in sorted(stat['phases']):
+                for phase, (cnt, sec) in sorted(stat['phases'][oper].iteritems()):
+                    labels = 'scope="%s",name="%s",oper="%s",phase="%s"' % (scope, esc(name), oper, phase)
+                    lines.append('nc_phase_seconds_sum{%s} %.6f' % (labels, sec))
+                    lines.append('nc_phase_seconds_count{%s} %d' % (labels, cnt))
+        lines.extend(['# HELP nc_latency_seconds Latency of netconf operation',
+                      '# TYPE nc_latency_seconds summary'])
+        for scope, name, stat in stats:
+            for rec in NetConf.stats_records(scope, name, stat):
+                labels = 'scope="%s",name="%s",oper="%s"' % (scope, esc(name), rec['oper'])
+                for pct in NetConf.PERCENTILES:
+                    lines.append('nc_latency_seconds{%s,quantile="%s"} %.6f' % (labels, pct / 100.0, rec['p%s' % pct]))
+                lines.append('nc_latency_seconds_sum{%s} %.6f' % (labels, rec['mean'] * rec['count']))
+                lines.append('nc_latency_seconds_count{%s} %d' % (labels, rec['count']))
+        with open(fname + '.tmp', 'wb') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(fname + '.tmp', fname)
+        return
+
+
+    @staticmethod
+    def rpc_rate(stat):
+        """
+        rpcs per second between start of the first and end of the last operation
+        :param stat:
+        :return:
+        """
+        if not stat['rpcs'] or stat['end'] <= stat['start']: return 0.0
+        return stat['rpcs'] / (stat['end'] - stat['start'])
+
+
+    @staticmethod
+    def size_value(text, k=1000):
+        """
+        number with optional k, M, G or T suffix (like kMGT output)
+        :param text:
+        :return:
+        """
+        text = text.strip()
+        for exp, suffix in enumerate('kMGT', 1):
+            if text[-1:] in (suffix, suffix.lower()): return int(float(text[:-1]) * k**exp)
+        return int(float(text or 0))
+
+
     def kMGT(self, val, k=1000):
         """
         human readable format
@@ -796,20 +3302,51 @@ class NetConf:
 
 
     @staticmethod
-    def dbg(msg, level='DBG'):
+    def dbg(msg, *args, **kw):
         """
-        static method for debug output to stderr
-        :param msg:
+        static method for debug output to stderr - message is formatted (msg % args) only when it is printed,
+        records are also kept in ring buffer (see dbg_dump) when enabled
+        :param msg: format string
+        :param args: format arguments
+        :param kw: level='DBG'
         :return:
         """
         # return if debug is not active
-        if NetConf.dbg_active is None: return
+        if NetConf.dbg_active is None and NetConf.dbg_ring is None: return
         # caller function name
-        fnc = inspect.stack()[1][3]
-        # * means debug all
-        if NetConf.dbg_active != '*' and fnc not in NetConf.dbg_active: return
+        fnc = sys._getframe(1).f_code.co_name
+        level = kw.get('level', 'DBG')
+        # raw record, formatted only when dumped
+        if NetConf.dbg_ring is not None: NetConf.dbg_ring.append((time.time(), level, fnc, msg, args))
+        if NetConf.dbg_active is None: return
+        # function enabled by any of patterns, resolved once per function
+        active = NetConf.dbg_cache.get(fnc)
+        if active is None:
+            active = NetConf.dbg_cache[fnc] = any(fnmatch.fnmatchcase(fnc, pat) for pat in NetConf.dbg_active)
+        if not active: return
         # print debug info into stderr
-        print >>sys.stderr, "%s: %s() - %s" % (level.upper(), fnc,msg)
+        print >>sys.stderr, "%s: %s() - %s" % (level.upper(), fnc, msg % args if args else msg)
+        return
+
+
+    @staticmethod
+    def dbg_dump(reason=''):
+        """
+        print debug records from ring buffer to stderr (oldest first, time relative to the last one) and clear it
+        :param reason:
+        :return:
+        """
+        if not NetConf.dbg_ring: return
+        last = NetConf.dbg_ring[-1][0]
+        print >>sys.stderr, "=== DEBUG RING %d records - %s ===" % (len(NetConf.dbg_ring), reason)
+        for stamp, level, fnc, msg, args in NetConf.dbg_ring:
+            try:
+                msg = msg % args if args else msg
+            except (TypeError, ValueError) as e:
+                msg = '%r %r - %s' % (msg, args, e)
+            print >>sys.stderr, "%10.3f ms %s: %s() - %s" % (1000*(stamp-last), level.upper(), fnc, msg)
+        print >>sys.stderr, "=== DEBUG RING END ==="
+        NetConf.dbg_ring.clear()
         return
 
 
@@ -830,17 +3367,24 @@ class NetConf:
         loop = []
         loopcnt = 0
         rsfname = None
+        workers = 16
+        sessions = 1
 
         it = iter(lst)
         for par in it:
 
             # debug
-            NetConf.dbg("processing par(%s)" % par)
+            NetConf.dbg("processing par(%s)", par)
 
             # ignore empty values
             if par in ['', ' ']:
                   continue
 
+            # responses of pipelined requests are needed by anything else than next request
+            if nc is not None and nc.inflight and par not in ['-f', '-file', '-rq', '-rs', '-response', '-prefix',
+                                                              '-nors', '-noresponse', '-var', '-set']:
+                  nc.drain_pipeline(0, hformat, tstamp)
+
             # help
             if par in ['-h', '-help', '-?']:
                   usage()
@@ -853,11 +3397,13 @@ class NetConf:
 
             # activate debug
             if par in ['-dbg', '-debug', '-v']:
-                  dbg = next(it)
-                  if dbg == '*':
-                      NetConf.dbg_active = dbg
-                  else:
-                      NetConf.dbg_active = dbg.split(',')
+                  NetConf.dbg_active = next(it).split(',')
+                  NetConf.dbg_cache = {}
+                  continue
+
+            # keep last n debug records and dump them on error
+            if par in ['-dbgring', '-ring']:
+                  NetConf.dbg_ring = collections.deque(maxlen=int(next(it)))
                   continue
 
             # response prefix
@@ -896,8 +3442,11 @@ class NetConf:
                   tag = next(it)
                   loop.extend([par, tag])
                   if rsfname is not None and rsfname != '/dev/null':
-                        val = nc.find_in_xmlfile(rsfname, tag)
-                        nc.print_line(None, tstamp, 'TAG', '%s = %s' % (tag, val), 'GET')
+                        tags = tag.split(',')
+                        src = nc.last_rs.archive.open(nc.last_rs.rec) if nc.archive_path is not None else rsfname
+                        vals = nc.find_all_in_xmlfile(src, tags)
+                        for tag in tags:
+                            nc.print_line(None, tstamp, 'TAG', '%s = %s' % (tag, vals.get(tag)), 'GET')
                   else:
                         nc.print_line(None, tstamp, 'TAG', 'Missing response', 'WARNING')
                   continue
@@ -906,29 +3455,114 @@ class NetConf:
             if par in ['-l', '-loop', '-repeat']:
                   loopcnt = int(next(it))
                   nc.print_line(None, tstamp, 'LOOP', 'REPEAT %d x ' % loopcnt, 'START')
-                  loopstat = dict([
-                      ('sent',   0),
-                      ('recv',   0),
-                      ('sentsc', 0),
-                      ('recvsc', 0)
-                  ])
+                  loopstat = NetConf.new_stats()
                   continue
 
             # connect
             if par in ['-c', '-con', '-connect', '-url']:
                   url = next(it)
+                  # run rest of parameters in parallel sessions
+                  if sessions > 1:
+                      NetConf.fanout([('s%03d' % i, url) for i in xrange(1, sessions+1)], list(it), sessions,
+                                     rs_prefix, tstamp, hformat, ('SESSION', 'SESSIONS'))
+                      continue
                   nc = NetConf(url)
                   nc.print_line(None, tstamp, 'NC.CONNECT', url)
                   err = nc.connect()
-                  nc.print_line(res='FAIL - %s' % err if err else 'OK')
+                  nc.print_line(res='FAIL - %s' % err if err else 'OK in %s' % nc.sec(nc.connect_time))
                   if err is None: continue
+                  NetConf.dbg_dump(err)
                   sys.exit(-1)
 
+            # number of devices processed in parallel
+            if par in ['-w', '-workers']:
+                  workers = int(next(it))
+                  continue
+
+            # run rest of parameters against all devices from inventory file
+            if par in ['-i', '-inventory', '-devices']:
+                  NetConf.fanout(NetConf.read_inventory(next(it)), list(it), workers, rs_prefix, tstamp, hformat)
+                  continue
+
+            # number of parallel sessions to the same device
+            if par in ['-sessions']:
+                  sessions = int(next(it))
+                  continue
+
+            # statistics export
+            if par in ['-stats', '-export']:
+                  NetConf.stats_file = next(it)
+                  continue
+
+            # open-loop rate
+            if par in ['-r', '-rate']:
+                  NetConf.rate = float(next(it))
+                  continue
+
+            # rate ramp step,every
+            if par in ['-ramp']:
+                  step, every = next(it).split(',', 1)
+                  NetConf.ramp_step, NetConf.ramp_every = float(step), int(every)
+                  continue
+
+            # pipelining depth
+            if par in ['-p', '-pipeline']:
+                  NetConf.pipeline = int(next(it))
+                  continue
+
+            # ssh transport
+            if par in ['-transport']:
+                  name = next(it)
+                  if name not in NetConf.TRANSPORTS:
+                      print >>sys.stderr, 'CLI - unknown transport [%s], use one of %s' % (name, ', '.join(sorted(NetConf.TRANSPORTS)))
+                      sys.exit(-1)
+                  NetConf.transport = name
+                  continue
+
+            # per rpc phase trace
+            if par in ['-trace']:
+                  for fname in next(it).split(','):
+                      if fname.lower().endswith('.prom'):
+                          NetConf.trace_prom = fname
+                      else:
+                          # truncated once, sessions running in parallel append to it
+                          open(fname, 'wb').close()
+                          NetConf.trace_out = io.open(fname, 'ab', buffering=0)
+                  continue
+
+            # request chunk size
+            if par in ['-chunk', '-chunksize']:
+                  NetConf.rq_chunk_size = int(next(it))
+                  continue
+
+            # responses to append-only archive
+            if par in ['-archive']:
+                  NetConf.archive = 'archive'
+                  continue
+
+            # responses to content-addressed store
+            if par in ['-store']:
+                  NetConf.archive = 'store'
+                  continue
+
+            # list archive or print archived responses
+            if par in ['-extract']:
+                  NetConf.extract(*next(it).split(':', 2))
+                  continue
+
+            # rebuild response files from archive
+            if par in ['-restore']:
+                  NetConf.extract(*next(it).split(':', 2), restore=True)
+                  continue
+
             # hello handshake
             if par in ['-hello']:
                   nc.print_line(None, tstamp, 'HELLO')
                   sessionid, bytes, times =  nc.send_recv_hello()
+                  nc.session_id = sessionid
                   nc.print_line(hrf=hformat, par='session_id=%s' % sessionid, bytes=bytes, times=times)
+                  nc.add_stats(bytes, times, oper='HELLO')
+                  nc.add_setup(times, tstamp)
                   continue
 
             # hello file handshake
@@ -939,7 +3573,10 @@ class NetConf:
                   recv, recvtime = nc.recv_rs10_file(rsfname)
                   nc.print_line(None, tstamp, 'HELLO')
                   sessionid = nc.sessionid_fromfile(rsfname)
+                  nc.session_id = sessionid
                   nc.print_line(hrf=hformat, par='session_id=%s' % sessionid, bytes=(sent,recv), times=(senttime,recvtime))
+                  nc.add_stats((sent,recv), (senttime,recvtime), oper='HELLO')
+                  nc.add_setup((senttime,recvtime), tstamp)
                   continue
 
             # send request from file
@@ -947,16 +3584,56 @@ class NetConf:
                   rqfname = next(it)
                   loop.extend([par, rqfname])
                   rsfname = rs_prefix+os.path.basename(rqfname) if rs_prefix is not None else '/dev/null'
-                  rsfname = rsfname.replace('${i}', '%03d' % idx)
+                  rsfname = rsfname.replace('${i}', NetConf.COUNT % idx)
+                  nc.archive_path = re.sub(r'\$\{i\}[-_.]?', '', rs_prefix) + NetConf.archive if NetConf.archive and rs_prefix is not None else None
+                  nc.loop_idx = idx
+                  if nc.rate:
+                      intended = nc.wait_schedule(hformat, tstamp)
+                      nc.send_rq11_pipelined(rqfname, rsfname, None if loopstat is None else idx, loopstat, intended)
+                      if nc.pipeline: nc.drain_pipeline(nc.pipeline-1, hformat, tstamp)
+                      continue
+                  if nc.pipeline:
+                      nc.send_rq11_pipelined(rqfname, rsfname, None if loopstat is None else idx, loopstat)
+                      nc.drain_pipeline(nc.pipeline-1, hformat, tstamp)
+                      continue
                   nc.print_line(None, tstamp, 'FILE' if loopstat is None else '%4d. FILE' % idx, '%s -> %s' % (rqfname,rsfname))
                   sent, senttime = nc.send_rq11_file(rqfname)
-                  recv, recvtime = nc.recv_rs11_file(rsfname)
-                  nc.print_line(hrf=hformat, bytes=(sent,recv), times=(senttime,recvtime))
-                  if loopstat is not None:
-                      loopstat['sent']   += sent
-                      loopstat['recv']   += recv
-                      loopstat['sentsc'] += senttime
-                      loopstat['recvsc'] += recvtime
+                  recv, recvtime = nc.recv_rs11_file(rsfname, rqfname, idx)
+                  nc.print_line(hrf=hformat, res=nc.last_status, bytes=(sent,recv), times=(senttime,recvtime))
+                  nc.add_stats((sent,recv), (senttime,recvtime), loopstat)
+                  continue
+
+            # notification stream receiver
+            if par in ['-subscribe', '-notifications']:
+                  stream, _, duration = next(it).partition(',')
+                  nc.subscribe(stream or 'NETCONF', float(duration or 0), rs_prefix, hformat, tstamp)
+                  continue
+
+            # rotation of notification files
+            if par in ['-rotate']:
+                  size, _, sec = next(it).partition(',')
+                  NetConf.rotate_size, NetConf.rotate_time = NetConf.size_value(size), float(sec or 0)
+                  continue
+
+            # seconds between notification rate reports
+            if par in ['-report']:
+                  NetConf.report_interval = float(next(it))
+                  continue
+
+            # compiled scenario file
+            if par in ['-scenario', '-script']:
+                  fname = next(it)
+                  loop.extend([par, fname])
+                  try:
+                      scenario = Scenario.load(fname)
+                  except (ValueError, OSError, IOError) as e:
+                      print >>sys.stderr, 'CLI - invalid scenario - %s' % e
+                      sys.exit(-1)
+                  nc, stat = scenario.run(nc, rs_prefix, tstamp, hformat)
+                  # scenario loops are exported separately, -loop statistics stay as they are
+                  if stat is not None and nc is not None:
+                      if nc.scenariostat is None: nc.scenariostat = NetConf.new_stats()
+                      NetConf.merge_stats(nc.scenariostat, stat)
                   continue
 
             # sleep
@@ -972,7 +3649,8 @@ class NetConf:
             if par in ['-commit']:
                   nc.print_line(None, tstamp, 'COMMIT')
                   bytes, times, status =  nc.send_commit()
-                  nc.print_line(hrf=hformat, par=status, bytes=(sent,recv), times=(senttime,recvtime))
+                  nc.print_line(hrf=hformat, par=status, bytes=bytes, times=times)
+                  nc.add_stats(bytes, times, loopstat, 'COMMIT')
                   continue
 
             # close session
@@ -980,6 +3658,7 @@ class NetConf:
                   nc.print_line(None, tstamp, 'CLOSE')
                   bytes, times, status =  nc.send_close_session()
                   nc.print_line(hrf=hformat, par=status, bytes=bytes, times=times)
+                  nc.add_stats(bytes, times, loopstat, 'CLOSE')
                   continue
 
             print >>sys.stderr, 'CLI - invalid parameter [%s] ignored' % par
@@ -989,13 +3668,137 @@ class NetConf:
             # loop loopcnt-1 x
             for i in xrange(2, loopcnt+1):
                 NetConf.process_parameters(loop, i, rs_prefix, nc, loopstat, tstamp, hformat, recursive=False)
+            if nc.inflight: nc.drain_pipeline(0, hformat, tstamp)
+            nc.finish_rate_step(hformat, tstamp)
             # final statistics from loop
             nc.print_line(hformat, tstamp, 'LOOP', '=== SUMMARY.STATS ===', None,
                           (loopstat['sent'], loopstat['recv']),
                           (loopstat['sentsc'], loopstat['recvsc']))
+            nc.print_latency(NetConf.stats_records('LOOP', nc.host, loopstat), tstamp)
         # terminate ssh process
-        if recursive and nc: nc.terminate()
+        if recursive and nc:
+            if nc.inflight: nc.drain_pipeline(0, hformat, tstamp)
+            nc.finish_rate_step(hformat, tstamp)
+            nc.terminate()
+            records = nc.rate_records + (NetConf.stats_records('LOOP', nc.host, loopstat) if loopstat is not None else [])
+            if nc.scenariostat is not None: records += NetConf.stats_records('SCENARIO', nc.host, nc.scenariostat)
+            NetConf.export_stats(NetConf.stats_file, records + NetConf.stats_records('SESSION', nc.host, nc.sessionstat))
+            NetConf.export_prom(NetConf.trace_prom, [('SESSION', nc.host, nc.sessionstat)])
+
+        return nc
+
+
+    @staticmethod
+    def extract(base, i=None, rq=None, restore=False):
+        """
+        print index of archive or store (without selection) or responses of iteration i (* = all) and request rq,
+        responses are written back to their original response files when restoring
+        :param base: archive path without extension or store directory
+        :param i:
+        :param rq: request file name (or its base name)
+        :param restore:
+        :return:
+        """
+        archive = ResponseStore(base) if os.path.isdir(base) else Archive(base)
+        try:
+            for rec in archive.entries():
+                if i is None and not restore:
+                    print '\t'.join(str(rec[key]) for key in archive.FIELDS)
+                    continue
+                if i not in (None, '*') and str(rec['i']) != i: continue
+                if rq is not None and rq not in (rec['rq'], os.path.basename(rec['rq'])): continue
+                if restore:
+                    if os.path.dirname(rec['rs']) and not os.path.isdir(os.path.dirname(rec['rs'])):
+                        os.makedirs(os.path.dirname(rec['rs']))
+                    with open(rec['rs'], 'wb') as f:
+                        f.write(archive.read(rec))
+                    print rec['rs']
+                    continue
+                sys.stdout.write(archive.read(rec))
+                sys.stdout.write('\n')
+        except (OSError, IOError) as e:
+            print >>sys.stderr, 'Archive %s failed - %s' % (base, e)
+        finally:
+            archive.close()
+        return
+
+
+    @staticmethod
+    def read_inventory(fname):
+        """
+        read devices from inventory file, one device per line in format 'user:password@host[:port][ name]'
+        empty lines and lines starting with '#' are ignored, name defaults to host[_port]
+        :param fname:
+        :return: list of (name, url)
+        """
+        devices = []
+        with open(fname) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'): continue
+                fields = line.split()
+                url = fields[0]
+                name = fields[1] if len(fields) > 1 else url.rsplit('@', 1)[-1].replace(':', '_')
+                devices.append((name, url))
+        return devices
 
+
+    @staticmethod
+    def fanout(devices, params, workers=16, rs_prefix='rs-', tstamp=False, hformat=False, label=('DEVICE', 'FLEET')):
+        """
+        run the same sequence of parameters against all devices in parallel (max workers at once),
+        output of each device is printed as a block when device is done and fleet summary at the end
+        :param devices: list of (name, url)
+        :param params: parameters (without -connect)
+        :param workers: max number of devices processed in parallel
+        :param rs_prefix: token '${DEVICE}' is replaced by device name, otherwise device name is appended to prefix
+        :param tstamp:
+        :param hformat:
+        :param label: operation names for device and summary lines
+        :return:
+        """
+        nc = NetConf()
+        nc.print_line(None, tstamp, label[1], '%d x %s, %d workers' % (len(devices), label[0].lower(), workers), 'START')
+        jobs = []
+        for name, url in devices:
+            prefix = None
+            if rs_prefix is not None:
+                prefix = rs_prefix.replace('${DEVICE}', name) if '${DEVICE}' in rs_prefix else '%s%s-' % (rs_prefix, name)
+            jobs.append((name, ['-connect', url] + (['-rs', prefix] if prefix is not None else ['-nors']) + params,
+                         tstamp, hformat))
+        fleetstat = NetConf.new_stats()
+        records = []
+        stats = []
+        failed = 0
+        start = time.time()
+        pool = multiprocessing.Pool(max(1, min(workers, len(jobs))))
+        try:
+            for name, output, stat, wall in pool.imap_unordered(run_device, jobs):
+                sys.stdout.write(output)
+                if stat is None: failed += 1
+                nc.last_error = '' if stat is not None else 'FAILED'
+                stat = stat or NetConf.new_stats()
+                NetConf.merge_stats(fleetstat, stat)
+                records.extend(NetConf.stats_records(label[0], name, stat))
+                stats.append((label[0], name, stat))
+                nc.print_line(hformat, tstamp, label[0], '%s in %s' % (name, nc.sec(wall)),
+                              '%d rpc %.1f rpc/s' % (stat['rpcs'], NetConf.rpc_rate(stat)),
+                              (stat['sent'], stat['recv']), (stat['sentsc'], stat['recvsc']))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        nc.last_error = '%d failed' % failed if failed else ''
+        nc.print_line(hformat, tstamp, label[1], '=== SUMMARY.STATS === %s' % nc.sec(time.time()-start),
+                      '%d rpc %.1f rpc/s' % (fleetstat['rpcs'], NetConf.rpc_rate(fleetstat)),
+                      (fleetstat['sent'], fleetstat['recv']),
+                      (fleetstat['sentsc'], fleetstat['recvsc']))
+        fleetrecords = NetConf.stats_records(label[1], '*', fleetstat)
+        nc.print_latency(fleetrecords, tstamp)
+        NetConf.export_stats(NetConf.stats_file, records + fleetrecords)
+        NetConf.export_prom(NetConf.trace_prom, stats + [(label[1], '*', fleetstat)])
         return
 
 
@@ -1006,6 +3809,33 @@ class NetConf:
         return
 
 
+def run_device(job):
+    """
+    fanout worker - process parameters against one device with output captured
+    :param job: (name, params, tstamp, hformat)
+    :return: (name, output, session statistics or None when failed, wall time)
+    """
+    name, params, tstamp, hformat = job
+    # statistics are exported by parent process
+    NetConf.stats_file = None
+    NetConf.trace_prom = None
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO.StringIO()
+    start = time.time()
+    stat = None
+    try:
+        nc = NetConf.process_parameters(params, tstamp=tstamp, hformat=hformat)
+        if nc is not None: stat = nc.sessionstat
+    except SystemExit:
+        pass
+    except Exception as e:
+        print >>sys.stderr, 'Device %s failed - %s' % (name, e)
+    finally:
+        output = sys.stdout.getvalue()
+        sys.stdout, sys.stderr = stdout, stderr
+    return name, output, stat, time.time()-start
+
+
 if __name__ == '__main__':
 
     NetConf.version_check()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__version__ = '1.0.0'
+
+
+def usage():
+    print """
+Local stand-in NETCONF server for testing nc.py without a router (Python 2.x)
+
+usage: ncserver.py [ -port port][ -listen address][ -user user:password][ -data file][ -delay sec][ -notify rate[,size]][ -stdio]
+
+    -port port        ... ssh port to listen on (default 8830)
+    -listen address   ... address to listen on (default 127.0.0.1)
+    -user u:p         ... accepted username and password (default any)
+    -data file        ... content of <data> returned by get/get-config (default empty), file is either just
+                          the content or stored reply (like rs-get-config.xml) whose <data> content is used
+    -delay sec        ... delay of each reply
+    -notify r[,size]  ... after create-subscription emit synthetic notifications at r events/s (default 10, 0 = none)
+                          with payload of size bytes (default 100) till session ends
+    -key file         ... RSA host key file (default generated at start)
+    -stdio            ... serve single session on stdin/stdout (ssh subsystem style, no paramiko needed)
+    -help             ... shows this help
+
+    supported operations: get, get-config, edit-config, copy-config, delete-config, lock, unlock, commit,
+                          discard-changes, validate, kill-session, close-session and create-subscription,
+                          anything else is answered by rpc-error operation-not-supported
+
+examples:
+    ./ncserver.py -port 8830 -user cisco:cisco -data rs-get-config.xml &
+    ./nc.py -transport paramiko -connect cisco:cisco@127.0.0.1:8830 -hello -rq get-config.xml -close
+    ./ncserver.py -port 8830 -notify 20000,200 &
+    ./nc.py -transport paramiko -connect cisco:cisco@127.0.0.1:8830 -hello -rotate 100M,3600 -subscribe NETCONF,60
+"""
+    return
+
+
+import sys
+import os
+import re
+import time
+import socket
+import threading
+import itertools
+import datetime
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+
+class NetConfServer:
+    """
+    Netconf server session - framing and canned replies, transport is any pair of read/write callables
+    """
+
+    xmlns = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+    EOM_10 = ']]>]]>'
+    CAP_11 = 'urn:ietf:params:netconf:base:1.1'
+    OK_OPS = ['edit-config', 'copy-config', 'delete-config', 'lock', 'unlock', 'commit', 'discard-changes',
+              'validate', 'kill-session', 'close-session']
+    CHUNK = re.compile(r'\s*\n#(#|\d+)\n')
+    XML_DECL = re.compile(r'^\s*<\?xml[^>]*\?>')
+    RPC_REPLY = re.compile(r'\s*<([\w.-]+:)?rpc-reply\b')
+    DATA = re.compile(r'<(?:[\w.-]+:)?data\b[^>]*?(/?)>(.*)</(?:[\w.-]+:)?data\s*>', re.S)
+    xmlns_notif = 'urn:ietf:params:xml:ns:netconf:notification:1.0'
+
+    user = None
+    pswd = None
+    data = ''
+    delay = 0.0
+    notify_rate = 10.0
+    notify_size = 100
+
+    session_ids = itertools.count(1)
+
+    def __init__(self, read, write):
+        """
+        :param read: callable returning data received (empty string at eof)
+        :param write: callable sending all data
+        """
+        self.read = read
+        self.write = write
+        self.buf = ''
+        self.chunked = False
+        self.session_id = next(self.session_ids)
+        # notifications are sent by another thread, messages must not interleave
+        self.lock = threading.Lock()
+        self.closed = False
+        self.notifier = None
+        return
+
+
+    @classmethod
+    def load_data(cls, fname):
+        """
+        content of <data> from file with stored reply or just the content
+        :param fname:
+        :return:
+        """
+        with open(fname) as f: text = cls.XML_DECL.sub('', f.read(), 1)
+        if cls.RPC_REPLY.match(text):
+            m = cls.DATA.search(text)
+            text = m.group(2) if m is not None and not m.group(1) else ''
+        # content must fit into reply as it is
+        ET.fromstring('<data xmlns="%s">%s</data>' % (cls.xmlns, text))
+        return text
+
+
+    def recv_msg(self):
+        """
+        receive one message in current framing
+        :return: message or None at eof
+        """
+        while True:
+            if not self.chunked:
+                end = self.buf.find(self.EOM_10)
+                if end >= 0:
+                    msg, self.buf = self.buf[:end], self.buf[end+len(self.EOM_10):]
+                    return msg
+            else:
+                msg = self.decode_chunks()
+                if msg is not None: return msg
+            data = self.read()
+            if not data: return None
+            self.buf += data
+
+
+    def decode_chunks(self):
+        """
+        decode complete chunked message from buffer
+        :return: message or None if more data are needed
+        """
+        parts = []
+        pos = 0
+        while True:
+            m = self.CHUNK.match(self.buf, pos)
+            if m is None: return None
+            pos = m.end()
+            if m.group(1) == '#':
+                self.buf = self.buf[pos:]
+                return ''.join(parts)
+            clen = int(m.group(1))
+            if len(self.buf) < pos + clen: return None
+            parts.append(self.buf[pos:pos+clen])
+            pos += clen
+
+
+    def send_msg(self, msg):
+        """
+        send one message in current framing
+        :param msg:
+        :return:
+        """
+        if self.delay: time.sleep(self.delay)
+        self.send_frame(msg)
+        return
+
+
+    def send_frame(self, msg):
+        with self.lock:
+            if self.chunked:
+                self.write("\n#%d\n%s\n##\n" % (len(msg), msg))
+            else:
+                self.write(msg + self.EOM_10)
+        return
+
+
+    def hello(self):
+        """
+        exchange hello messages, 1.1 framing is used when both sides support it
+        :return: False if client disconnected
+        """
+        self.send_msg('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<hello xmlns="%s"><capabilities>'
+                      '<capability>urn:ietf:params:netconf:base:1.0</capability>'
+                      '<capability>%s</capability>'
+                      '<capability>urn:ietf:params:netconf:capability:candidate:1.0</capability>'
+                      '</capabilities><session-id>%d</session-id></hello>\n' % (self.xmlns, self.CAP_11, self.session_id))
+        msg = self.recv_msg()
+        if msg is None: return False
+        self.chunked = self.CAP_11 in msg
+        return True
+
+
+    def reply(self, msg):
+        """
+        canned reply for request
+        :param msg:
+        :return: (reply, True if session is to be closed)
+        """
+        try:
+            rpc = ET.fromstring(msg)
+        except SyntaxError as e:
+            return self.rpc_reply('', self.rpc_error('rpc', 'malformed-message', str(e))), False
+        attrs = ''.join(' %s="%s"' % (k, v) for k, v in rpc.attrib.iteritems())
+        op = rpc[0].tag.rsplit('}', 1)[-1] if len(rpc) else ''
+        if op in ['get', 'get-config']:
+            return self.rpc_reply(attrs, '<data>%s</data>' % self.data), False
+        if op in self.OK_OPS:
+            return self.rpc_reply(attrs, '<ok/>'), op == 'close-session'
+        if op == 'create-subscription':
+            if self.notifier is not None:
+                return self.rpc_reply(attrs, self.rpc_error('protocol', 'operation-failed', 'subscription exists')), False
+            stream = rpc[0].findtext('{%s}stream' % self.xmlns_notif) or 'NETCONF'
+            if self.notify_rate > 0:
+                # started after reply is sent
+                self.notifier = threading.Thread(target=self.notify, args=(stream,))
+                self.notifier.daemon = True
+            return self.rpc_reply(attrs, '<ok/>'), False
+        return self.rpc_reply(attrs, self.rpc_error('protocol', 'operation-not-supported', op)), False
+
+
+    def rpc_reply(self, attrs, body):
+        return '<?xml version="1.0" encoding="UTF-8"?>\n<rpc-reply xmlns="%s"%s>%s</rpc-reply>' % (self.xmlns, attrs, body)
+
+
+    def rpc_error(self, etype, tag, msg):
+        return ('<rpc-error><error-type>%s</error-type><error-tag>%s</error-tag>'
+                '<error-severity>error</error-severity><error-message>%s</error-message></rpc-error>' % (etype, tag, msg))
+
+
+    def notify(self, stream):
+        """
+        send synthetic notifications at notify_rate till session ends
+        :param stream:
+        :return:
+        """
+        payload = 'x' * self.notify_size
+        start = time.time()
+        seq = 0
+        try:
+            while not self.closed:
+                seq += 1
+                self.send_frame('<?xml version="1.0" encoding="UTF-8"?>\n<notification xmlns="%s">'
+                                '<eventTime>%sZ</eventTime><synthetic-event xmlns="urn:ncserver:synthetic">'
+                                '<stream>%s</stream><sequence>%d</sequence><payload>%s</payload></synthetic-event>'
+                                '</notification>' % (self.xmlns_notif, datetime.datetime.utcnow().isoformat(), stream, seq, payload))
+                wait = start + seq / self.notify_rate - time.time()
+                if wait > 0: time.sleep(wait)
+        except (socket.error, EOFError, OSError, IOError):
+            # client disconnected
+            pass
+        return
+
+
+    def serve(self):
+        """
+        serve session till close-session or disconnect
+        :return:
+        """
+        if not self.hello(): return
+        try:
+            while True:
+                msg = self.recv_msg()
+                if msg is None: return
+                rs, close = self.reply(msg)
+                self.send_msg(rs)
+                if self.notifier is not None and self.notifier.ident is None: self.notifier.start()
+                if close: return
+        finally:
+            self.closed = True
+
+
+def serve_stdio():
+    """
+    single session on stdin/stdout
+    :return:
+    """
+    fdin, fdout = sys.stdin.fileno(), sys.stdout.fileno()
+    def write(data):
+        while data:
+            data = data[os.write(fdout, data):]
+    NetConfServer(lambda: os.read(fdin, 65536), write).serve()
+    return
+
+
+def serve_ssh(address, port, keyfile=None):
+    """
+    netconf ssh subsystem server, every connection is served by its own thread
+    :param address:
+    :param port:
+    :param keyfile:
+    :return:
+    """
+    import paramiko
+
+    class Server(paramiko.ServerInterface):
+
+        def check_auth_password(self, username, password):
+            if NetConfServer.user in (None, username) and NetConfServer.pswd in (None, password):
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session': return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_subsystem_request(self, channel, name):
+            if name != 'netconf': return False
+            thread = threading.Thread(target=session, args=(channel,))
+            thread.daemon = True
+            thread.start()
+            return True
+
+    def session(channel):
+        try:
+            NetConfServer(lambda: channel.recv(65536), channel.sendall).serve()
+        except (socket.error, EOFError) as e:
+            print >>sys.stderr, 'Session failed - %s' % e
+        finally:
+            channel.close()
+
+    def connection(sock, key):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(key)
+        try:
+            transport.start_server(server=Server())
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            print >>sys.stderr, 'SSH negotiation failed - %s' % e
+            return
+        # channels are served by subsystem threads, transport lives till client disconnects
+        while transport.is_active(): time.sleep(1)
+
+    key = paramiko.RSAKey(filename=keyfile) if keyfile else paramiko.RSAKey.generate(2048)
+    lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    lsock.bind((address, port))
+    lsock.listen(128)
+    print >>sys.stderr, 'Listening on %s:%d' % (address, port)
+    while True:
+        sock, peer = lsock.accept()
+        thread = threading.Thread(target=connection, args=(sock, key))
+        thread.daemon = True
+        thread.start()
+
+
+if __name__ == '__main__':
+
+    address, port, keyfile, stdio = '127.0.0.1', 8830, None, False
+    it = iter(sys.argv[1:])
+    for par in it:
+        if par in ['-port']:
+            port = int(next(it))
+        elif par in ['-listen']:
+            address = next(it)
+        elif par in ['-user']:
+            NetConfServer.user, NetConfServer.pswd = next(it).split(':', 1)
+        elif par in ['-data']:
+            fname = next(it)
+            try:
+                NetConfServer.data = NetConfServer.load_data(fname)
+            except (IOError, SyntaxError) as e:
+                print >>sys.stderr, 'Invalid -data %s - %s' % (fname, e)
+                sys.exit(1)
+        elif par in ['-delay']:
+            NetConfServer.delay = float(next(it))
+        elif par in ['-notify']:
+            rate, _, size = next(it).partition(',')
+            NetConfServer.notify_rate = float(rate)
+            if size: NetConfServer.notify_size = int(size)
+        elif par in ['-key']:
+            keyfile = next(it)
+        elif par in ['-stdio']:
+            stdio = True
+        else:
+            usage()
+            sys.exit(1)
+
+    try:
+        if stdio:
+            serve_stdio()
+        else:
+            serve_ssh(address, port, keyfile)
+    except KeyboardInterrupt:
+        pass
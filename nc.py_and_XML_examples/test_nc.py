@@ -0,0 +1,823 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of nc.py against local ncserver.py (no router needed)
+
+nc.py runs as it would from command line, 'sshpass' found first on PATH is replaced by script serving the session
+by 'ncserver.py -stdio', paramiko transport talks to 'ncserver.py -port'. nc.py is python 2.x, when tests run by
+python 3.x set NC_PYTHON to python 2.x interpreter (tests needing it are skipped otherwise).
+
+    python test_nc.py
+    NC_PYTHON=python2.7 python3 -m pytest test_nc.py
+"""
+import io
+import csv
+import json
+import os
+import re
+import sys
+import glob
+import collections
+import shutil
+import socket
+import tempfile
+import time
+import threading
+import subprocess
+import unittest
+import xml.etree.ElementTree as ET
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PYTHON = os.environ.get('NC_PYTHON') or (sys.executable if sys.version_info[0] == 2 else None)
+# seconds any nc.py run may take, hung session (deadlock) fails the test instead of blocking the suite
+TIMEOUT = 60
+
+NC_NS = '{urn:ietf:params:xml:ns:netconf:base:1.0}'
+
+GET_CONFIG = '''<?xml version="1.0" encoding="utf-8"?>
+<rpc message-id="%s" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+    <get-config>
+        <source>
+            <running/>
+        </source>
+    </get-config>%s
+</rpc>
+'''
+
+if sys.version_info[0] == 2:
+    sys.path.insert(0, HERE)
+    import nc
+
+
+def run(args, cwd, env=None):
+    """
+    run command, kill it after TIMEOUT
+    :return: (return code, stdout and stderr)
+    """
+    proc = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    timer = threading.Timer(TIMEOUT, proc.kill)
+    timer.start()
+    try:
+        out = proc.communicate()[0]
+    finally:
+        timer.cancel()
+    return proc.returncode, out.decode('utf-8', 'replace')
+
+
+@unittest.skipIf(PYTHON is None, 'nc.py needs python 2.x (set NC_PYTHON)')
+class NcTestCase(unittest.TestCase):
+    """
+    temporary directory with requests and 'sshpass' running ncserver.py
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_nc')
+        self.server()
+        self.rq('get-config.xml')
+        return
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        return
+
+
+    def path(self, *names):
+        return os.path.join(self.dir, *names)
+
+
+    def server(self, *args):
+        """
+        options of ncserver.py serving sessions opened by following nc.py runs
+        """
+        with open(self.path('sshpass'), 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" -stdio %s\n' % (PYTHON, os.path.join(HERE, 'ncserver.py'), ' '.join(args)))
+        os.chmod(self.path('sshpass'), 0o755)
+        return
+
+
+    def rq(self, name, msgid='${MSGID}', padding=0):
+        """
+        get-config request file, padding (xml comment) makes request of any size
+        """
+        with open(self.path(name), 'w') as f:
+            f.write(GET_CONFIG % (msgid, '\n<!-- %s -->' % ('x' * padding) if padding else ''))
+        return
+
+
+    def data(self, interfaces):
+        """
+        -data file of ncserver.py with given number of interfaces
+        """
+        with open(self.path('data.xml'), 'w') as f:
+            f.write('<interfaces xmlns="urn:test">\n')
+            for i in range(interfaces):
+                f.write('<interface><name>GigabitEthernet0/0/0/%d</name><description>%s</description></interface>\n' %
+                        (i, 'd' * 100))
+            f.write('</interfaces>\n')
+        return 'data.xml'
+
+
+    def nc(self, *args):
+        """
+        run nc.py connected to ncserver.py
+        :return: output
+        """
+        env = dict(os.environ, PATH=self.dir + os.pathsep + os.environ['PATH'])
+        code, out = run([PYTHON, os.path.join(HERE, 'nc.py')] + list(args), self.dir, env)
+        self.assertEqual(code, 0, out)
+        self.assertNotIn('failed', out)
+        return out
+
+
+    def connect(self, *args):
+        return self.nc('-connect', 'test:test@127.0.0.1:830', '-hello', *args)
+
+
+    def reply(self, name):
+        """
+        parsed response file
+        """
+        root = ET.parse(self.path(name)).getroot()
+        self.assertEqual(root.tag, NC_NS + 'rpc-reply')
+        return root
+
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+
+class TransportTest(NcTestCase):
+
+    def test_stdio_reply_round_trip(self):
+        # ncserver.py -data takes stored reply as well as bare data
+        self.server('-data', os.path.join(HERE, 'rs-get-config.xml'))
+        self.connect('-f', 'get-config.xml', '-close')
+        aaa = '{http://cisco.com/ns/yang/Cisco-IOS-XR-aaa-locald-admin-cfg}'
+        self.assertIn('guest', [e.text for e in self.reply('rs-get-config.xml').iter(aaa + 'name')])
+
+
+class ParamikoTest(NcTestCase):
+
+    def setUp(self):
+        NcTestCase.setUp(self)
+        if run([PYTHON, '-c', 'import paramiko'], self.dir)[0] != 0: self.skipTest('paramiko not installed')
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.port = s.getsockname()[1]
+        s.close()
+        self.proc = subprocess.Popen([PYTHON, os.path.join(HERE, 'ncserver.py'), '-port', str(self.port), '-user', 'test:test'],
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # generated host key first, then listening
+        for line in iter(self.proc.stdout.readline, b''):
+            if line.startswith(b'Listening'): break
+        return
+
+
+    def tearDown(self):
+        self.proc.kill()
+        self.proc.wait()
+        NcTestCase.tearDown(self)
+        return
+
+
+    def test_reply_round_trip(self):
+        self.nc('-transport', 'paramiko', '-connect', 'test:test@127.0.0.1:%d' % self.port, '-hello',
+                '-rs', 'rs-${i}-', '-loop', '2', '-f', 'get-config.xml')
+        self.reply('rs-001-get-config.xml')
+        self.reply('rs-002-get-config.xml')
+
+
+class ChunkedReplyTest(NcTestCase):
+
+    def test_reply_larger_than_receive_buffer(self):
+        self.server('-data', self.data(5000))
+        self.connect('-f', 'get-config.xml', '-close')
+        self.assertEqual(len(list(self.reply('rs-get-config.xml').iter('{urn:test}interface'))), 5000)
+
+
+class ChunkedRequestTest(NcTestCase):
+
+    def test_request_in_many_chunks(self):
+        self.rq('big.xml', padding=100000)
+        self.connect('-chunk', '4096', '-f', 'big.xml', '-close')
+        self.reply('rs-big.xml')
+
+
+    def test_token_split_between_chunks(self):
+        head = '<?xml version="1.0" encoding="utf-8"?>\n<!-- %s -->\n<rpc message-id="'
+        # ${MSGID} starts 3 bytes before the end of the first 4096 bytes block of request file
+        head = head % ('x' * (4096 - 3 - len(head % '')))
+        with open(self.path('split.xml'), 'w') as f:
+            f.write(head + '${MSGID}" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">'
+                    '<get-config><source><running/></source></get-config>\n<!-- %s -->\n</rpc>\n' % ('y' * 10000))
+        self.connect('-chunk', '4096', '-f', 'split.xml', '-close')
+        self.assertTrue(self.reply('rs-split.xml').get('message-id').isdigit())
+
+
+class PipelineTest(NcTestCase):
+
+    def test_replies_stored_to_their_requests(self):
+        self.rq('p.xml', msgid='${MSGID}-${i}')
+        self.connect('-rs', 'rs-${i}-', '-pipeline', '4', '-loop', '12', '-f', 'p.xml')
+        for i in range(1, 13):
+            self.assertTrue(self.reply('rs-%03d-p.xml' % i).get('message-id').endswith('-%03d' % i))
+
+
+    def test_large_requests_and_replies_in_flight(self):
+        # neither side may block on writing while the other one writes too
+        self.server('-data', self.data(20000))
+        self.rq('big.xml', padding=3000000)
+        out = self.connect('-pipeline', '4', '-loop', '6', '-f', 'big.xml')
+        self.assertEqual(len(re.findall(r'FILE:.*DATA', out)), 6)
+        self.assertEqual(len(list(self.reply('rs-big.xml').iter('{urn:test}interface'))), 20000)
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class MatchReplyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nc = nc.NetConf()
+        self.nc.print_err = lambda msg: setattr(self.nc, 'last_error', msg)
+        return
+
+
+    def inflight(self, *msgids):
+        self.nc.inflight.extend(dict(msgid=msgid) for msgid in msgids)
+        return
+
+
+    def match(self, msgid):
+        return self.nc.match_reply(bytearray('<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"%s>' %
+                                             (' message-id="%s"' % msgid if msgid else '')))
+
+
+    def test_out_of_order(self):
+        self.inflight('1', '2', '3')
+        self.assertEqual(self.match('2')['msgid'], '2')
+        self.assertEqual(self.match('3')['msgid'], '3')
+        self.assertEqual(self.match('1')['msgid'], '1')
+
+
+    def test_missing_message_id_takes_oldest(self):
+        self.inflight('1', '2')
+        self.assertEqual(self.match(None)['msgid'], '1')
+
+
+    def test_unsolicited_and_duplicate(self):
+        self.assertIsNone(self.match('1'))
+        self.inflight('1', '2')
+        self.match('1')
+        self.nc.last_error = ''
+        self.assertIsNone(self.match('1'))
+        self.assertIn('message-id(1)', self.nc.last_error)
+        self.assertEqual(len(self.nc.inflight), 1)
+
+
+class InventoryTest(NcTestCase):
+
+    def test_devices_in_parallel(self):
+        self.server('-delay', '0.3')
+        with open(self.path('devices.txt'), 'w') as f:
+            f.write('test:test@127.0.0.1 r1\ntest:test@127.0.0.1:830 r2\ntest:test@127.0.0.1 r3\ntest:test@localhost\n')
+        start = time.time()
+        out = self.nc('-workers', '2', '-rs', 'rs-${DEVICE}-', '-inventory', 'devices.txt', '-hello', '-f', 'get-config.xml')
+        elapsed = time.time() - start
+        for name in ('r1', 'r2', 'r3', 'localhost'):
+            self.reply('rs-%s-get-config.xml' % name)
+        self.assertEqual(len(re.findall(r'DEVICE:.* 2 rpc ', out)), 4)
+        self.assertTrue(re.search(r'FLEET: +=== SUMMARY.STATS ===.* 8 rpc ', out), out)
+        # hello and get-config take 0.6 s per device, 2 workers take two rounds
+        self.assertGreaterEqual(elapsed, 1.2)
+        self.assertLess(elapsed, 2.4)
+
+
+class SessionsTest(NcTestCase):
+
+    def test_sessions_in_parallel(self):
+        self.server('-delay', '0.3')
+        start = time.time()
+        out = self.nc('-rs', 'rs-${i}-', '-sessions', '3', '-connect', 'test:test@127.0.0.1', '-hello',
+                      '-loop', '2', '-f', 'get-config.xml')
+        elapsed = time.time() - start
+        for i in range(1, 3):
+            for s in range(1, 4):
+                self.reply('rs-%03d-s%03d-get-config.xml' % (i, s))
+        self.assertEqual(sorted(re.findall(r'SESSION: +(s\d+) in .* 3 rpc ', out)), ['s001', 's002', 's003'])
+        self.assertTrue(re.search(r'SESSIONS: +=== SUMMARY.STATS ===.* 9 rpc ', out), out)
+        # latency of all sessions merged
+        self.assertTrue(re.search(r'LATENCY: +FILE 6 x ', out), out)
+        # 0.9 s of replies per session, 2.7 s one after another
+        self.assertLess(elapsed, 2.4)
+
+
+class RateTest(NcTestCase):
+
+    def test_ramp_past_saturation(self):
+        # server answers one request per 50 ms, 20 rpc/s at most
+        self.server('-delay', '0.05')
+        out = self.connect('-rs', 'rs-${i}-', '-rate', '20', '-ramp', '20,10', '-loop', '30', '-f', 'get-config.xml')
+        self.assertEqual(len(glob.glob(self.path('rs-*-get-config.xml'))), 30)
+        steps = [(float(target), float(achieved)) for target, achieved in
+                 re.findall(r'RATE: +target ([\d.]+) rpc/s \.\.\. achieved ([\d.]+) rpc/s', out)]
+        self.assertEqual([target for target, achieved in steps], [20.0, 40.0, 60.0])
+        for target, achieved in steps:
+            self.assertGreater(achieved, 15)
+            self.assertLess(achieved, 25)
+        # latency from intended send time includes waiting behind earlier requests
+        top = [float(ms) for ms in re.findall(r'LATENCY: +FILE 10 x .* max:([\d.]+)', out)]
+        self.assertLess(top[0], 150)
+        self.assertGreater(top[2], 200)
+
+
+class GetTest(NcTestCase):
+
+    def test_tags_and_paths(self):
+        self.server('-data', self.data(3))
+        out = self.connect('-f', 'get-config.xml', '-get', 'name,/rpc-reply/data/interfaces/interface/description,'
+                           '//interfaces/*/name,/data/interfaces,missing')
+        values = dict(re.findall(r'TAG: +(\S+) = (\S+) \.\.\. GET', out))
+        self.assertEqual(values, {'name': 'GigabitEthernet0/0/0/0', '/rpc-reply/data/interfaces/interface/description': 'd' * 100,
+                                  '//interfaces/*/name': 'GigabitEthernet0/0/0/0', '/data/interfaces': 'None',
+                                  'missing': 'None'})
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class FindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nc = nc.NetConf()
+        self.errors = []
+        self.nc.print_err = self.errors.append
+        return
+
+
+    def find(self, text, exprs):
+        return self.nc.find_all_in_xmlfile(io.BytesIO(text), exprs)
+
+
+    def test_namespace_prefixes_ignored(self):
+        xml = '<a xmlns="urn:a" xmlns:y="urn:y"><y:b><c>1</c></y:b><b><c>2</c><d>3</d></b></a>'
+        self.assertEqual(self.find(xml, ['x:b/c', '/a/b/d', '/b/c', '*/d']), {'x:b/c': '1', '/a/b/d': '3', '*/d': '3'})
+        self.assertEqual(self.errors, [])
+
+
+    def test_stops_when_all_found(self):
+        # broken end of document is never read
+        xml = '<a><b>1</b><c>2</c>%s<<<' % ('<pad>%s</pad>' % ('x' * 100) * 2000)
+        self.assertEqual(self.find(xml, ['b', 'c']), {'b': '1', 'c': '2'})
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.find(xml, ['b', 'missing']), {'b': '1'})
+        self.assertEqual(len(self.errors), 1)
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class XmlPickTest(unittest.TestCase):
+
+    REPLY = ('<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">%s<data>%s</data></rpc-reply>' %
+             ('%s', '<a><b>x</b></a>' * 1000))
+
+    def setUp(self):
+        self.nc = nc.NetConf()
+        return
+
+
+    def parse(self, text, wants):
+        # fed in pieces as they come from session
+        parser = self.nc.xml_parser(wants)
+        for pos in range(0, len(text), 7): parser.feed(text[pos:pos+7])
+        return parser.close()
+
+
+    def test_status_without_data(self):
+        xml = self.parse(self.REPLY % '<ok/>', self.nc.STATUS_PICK)
+        self.assertEqual([e.tag for e in xml], [NC_NS + 'ok'])
+        self.assertEqual(self.nc.rs_status(xml), 'OK')
+
+
+    def test_error_subtree_kept(self):
+        error = ('<rpc-error><error-type>application</error-type><error-tag>invalid-value</error-tag>'
+                 '<error-severity>error</error-severity></rpc-error>')
+        xml = self.parse(self.REPLY % error, self.nc.STATUS_PICK)
+        self.assertEqual(len(xml.find(NC_NS + 'rpc-error')), 3)
+        self.assertEqual(self.nc.rs_status(xml), 'ERROR: invalid-value')
+
+
+    def test_paths_and_full_tree(self):
+        text = self.REPLY % ''
+        xml = self.parse(text, ['/rpc-reply/data/a/b'])
+        self.assertEqual(len(xml.findall('.//' + NC_NS + 'b')), 1000)
+        self.assertEqual(ET.tostring(self.parse(text, None)), ET.tostring(ET.fromstring(text)))
+        hello = '<hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><capabilities/><session-id>7</session-id></hello>'
+        self.assertEqual([e.text for e in self.parse(hello, self.nc.HELLO_PICK)], ['7'])
+
+
+class StatusTest(NcTestCase):
+
+    def test_status_of_stored_responses(self):
+        with open(self.path('bad.xml'), 'w') as f:
+            f.write('<rpc message-id="${MSGID}" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><frobnicate/></rpc>\n')
+        with open(self.path('lock.xml'), 'w') as f:
+            f.write('<rpc message-id="${MSGID}" xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">'
+                    '<lock><target><running/></target></lock></rpc>\n')
+        for args in ([], ['-pipeline', '3']):
+            out = self.connect(*(args + ['-f', 'bad.xml', '-f', 'lock.xml', '-f', 'get-config.xml']))
+            self.assertEqual(re.findall(r'FILE: .* \.\.\. (.+?) sent:', out), ['ERROR: operation-not-supported', 'OK', 'DATA'])
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class RpcStatusTest(unittest.TestCase):
+
+    def status(self, reply, size=1):
+        """
+        feed reply in pieces of size till status is known
+        :return: (status, bytes fed)
+        """
+        scan = nc.RpcStatus()
+        for pos in range(0, len(reply), size):
+            if scan.feed(reply[pos:pos+size]): break
+        return scan.close(), pos + size
+
+
+    def test_status_known_early(self):
+        data = '<data>%s</data></nc:rpc-reply>' % ('x' * 100000)
+        status, fed = self.status('<nc:rpc-reply xmlns:nc="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">\n'
+                                  '<!-- data follow -->' + data)
+        self.assertEqual(status, 'DATA')
+        # status goes to json trace records
+        self.assertIs(type(status), str)
+        self.assertLess(fed, 200)
+        self.assertEqual(self.status('<rpc-reply message-id="1"><ok/></rpc-reply>', 7)[0], 'OK')
+
+
+    def test_error_details(self):
+        error = ('<rpc-reply message-id="1"><rpc-error>\n<error-type>application</error-type>\n'
+                 '<error-tag> invalid-value </error-tag><error-severity>warning</error-severity></rpc-error></rpc-reply>')
+        self.assertEqual(self.status(error), ('WARNING: invalid-value', len(error) - len('</rpc-reply>')))
+        # end of response before rpc-error end
+        self.assertEqual(self.status('<rpc-reply><rpc-error><error-tag>in-use</error-tag>')[0], 'ERROR: in-use')
+        self.assertEqual(self.status('<rpc-reply>')[0], '?')
+
+
+class ConnectTest(NcTestCase):
+
+    def fail(self, stderr):
+        """
+        'sshpass' reporting error and hanging like ssh client would before timeout
+        :return: (return code, output, seconds)
+        """
+        with open(self.path('sshpass'), 'w') as f:
+            f.write('#!/bin/sh\necho $$ > ssh.pid\necho "%s" >&2\nexec sleep 30\n' % stderr)
+        start = time.time()
+        env = dict(os.environ, PATH=self.dir + os.pathsep + os.environ['PATH'])
+        code, out = run([PYTHON, os.path.join(HERE, 'nc.py'), '-connect', 'test:test@127.0.0.1', '-hello'], self.dir, env)
+        elapsed = time.time() - start
+        with open(self.path('ssh.pid')) as f: pid = int(f.read())
+        # ssh process is terminated, not left behind
+        self.assertRaises(OSError, os.kill, pid, 0)
+        return code, out, elapsed
+
+
+    def test_ready_on_first_hello_bytes(self):
+        out = self.connect('-close')
+        ms = float(re.search(r'CONNECT: .* OK in ([\d.]+) ms', out).group(1))
+        # not the whole connect timeout (7 s)
+        self.assertLess(ms, 3000)
+        self.assertTrue(re.search(r'SETUP: +connect \+ hello \.\.\. [\d.]+ ms', out), out)
+
+
+    def test_errors_reported_without_waiting(self):
+        for stderr in ('ssh: connect to host 127.0.0.1 port 830: Connection refused',
+                       'Permission denied, please try again.'):
+            code, out, elapsed = self.fail(stderr)
+            self.assertNotEqual(code, 0)
+            self.assertIn('CONNECT', out)
+            self.assertIn('FAIL', out)
+            self.assertIn(stderr, out)
+            self.assertLess(elapsed, 3)
+
+
+class TraceTest(NcTestCase):
+
+    def test_trace_records_and_prometheus(self):
+        self.nc('-trace', 'trace.jsonl,trace.prom', '-connect', 'test:test@127.0.0.1', '-hello',
+                '-rs', 'rs-${i}-', '-loop', '2', '-f', 'get-config.xml')
+        with open(self.path('trace.jsonl')) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([rec['oper'] for rec in records], ['CONNECT', 'HELLO', 'FILE', 'FILE'])
+        for rec in records[2:]:
+            self.assertEqual((rec['rq'], rec['status'], rec['error']), ('get-config.xml', 'DATA', None))
+            # phases follow each other
+            self.assertAlmostEqual(rec['send'] + rec['ttfb'] + rec['transfer'] + rec['store'], rec['total'], delta=0.00001)
+        with open(self.path('trace.prom')) as f:
+            prom = dict(line.rsplit(' ', 1) for line in f if not line.startswith('#'))
+        self.assertEqual(prom['nc_phase_seconds_count{scope="SESSION",name="127.0.0.1",oper="FILE",phase="ttfb"}'], '2\n')
+        self.assertEqual(prom['nc_latency_seconds_count{scope="SESSION",name="127.0.0.1",oper="FILE"}'], '2\n')
+
+
+    def test_stats_csv_and_json(self):
+        self.connect('-stats', 'stats.csv', '-loop', '3', '-f', 'get-config.xml')
+        with open(self.path('stats.csv')) as f:
+            rows = dict(((row['scope'], row['oper']), row) for row in csv.DictReader(f))
+        self.assertEqual(rows[('LOOP', 'FILE')]['count'], '3')
+        self.assertEqual(rows[('SESSION', 'HELLO')]['count'], '1')
+        self.connect('-stats', 'stats.json', '-loop', '3', '-f', 'get-config.xml')
+        with open(self.path('stats.json')) as f:
+            rows = dict(((row['scope'], row['oper']), row) for row in json.load(f))
+        row = rows[('SESSION', 'FILE')]
+        self.assertEqual(row['count'], 3)
+        self.assertTrue(row['min'] <= row['p50'] <= row['p90'] <= row['max'])
+
+
+class DebugTest(NcTestCase):
+
+    def test_debug_selected_functions(self):
+        out = self.nc('-debug', 'read*', '-connect', 'test:test@127.0.0.1', '-hello', '-f', 'get-config.xml')
+        self.assertEqual(set(re.findall(r'DBG: (\w+)\(\)', out)), set(['read_buf', 'readln']))
+
+
+    def test_ring_dumped_on_error(self):
+        with open(self.path('sshpass'), 'w') as f:
+            f.write('#!/bin/sh\necho "Connection refused" >&2\n')
+        env = dict(os.environ, PATH=self.dir + os.pathsep + os.environ['PATH'])
+        code, out = run([PYTHON, os.path.join(HERE, 'nc.py'), '-dbgring', '100', '-connect', 'test:test@127.0.0.1'],
+                        self.dir, env)
+        self.assertNotEqual(code, 0)
+        ring = out[out.index('=== DEBUG RING'):out.index('=== DEBUG RING END')]
+        self.assertIn('Invalid host:port', ring.splitlines()[0])
+        self.assertIn('DBG: parse_url() - url(test:test@127.0.0.1)', ring)
+        self.assertIn("DBG: connection_error() - stderr(Connection refused\n)", ring)
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class DbgTest(unittest.TestCase):
+
+    class Arg:
+        formatted = 0
+        def __str__(self):
+            DbgTest.Arg.formatted += 1
+            return 'arg'
+
+
+    def setUp(self):
+        self.saved = nc.NetConf.dbg_active, nc.NetConf.dbg_cache, nc.NetConf.dbg_ring
+        nc.NetConf.dbg_active, nc.NetConf.dbg_cache, nc.NetConf.dbg_ring = None, {}, None
+        self.stderr, sys.stderr = sys.stderr, io.BytesIO()
+        self.Arg.formatted = 0
+        return
+
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        nc.NetConf.dbg_active, nc.NetConf.dbg_cache, nc.NetConf.dbg_ring = self.saved
+        return
+
+
+    def recv_x(self, arg):
+        nc.NetConf.dbg('arg(%s)', arg)
+        return
+
+
+    def send_x(self, arg):
+        nc.NetConf.dbg('arg(%s)', arg)
+        return
+
+
+    def test_formatted_only_for_active_functions(self):
+        arg = self.Arg()
+        self.recv_x(arg)
+        nc.NetConf.dbg_active = ['recv_*']
+        for i in range(3):
+            self.recv_x(arg)
+            self.send_x(arg)
+        self.assertEqual(self.Arg.formatted, 3)
+        self.assertEqual(sys.stderr.getvalue(), 'DBG: recv_x() - arg(arg)\n' * 3)
+        # enablement resolved once per function
+        self.assertEqual(nc.NetConf.dbg_cache, {'recv_x': True, 'send_x': False})
+
+
+    def test_ring_formatted_when_dumped(self):
+        nc.NetConf.dbg_ring = collections.deque(maxlen=3)
+        arg = self.Arg()
+        for i in range(5): self.send_x(arg)
+        self.assertEqual((self.Arg.formatted, sys.stderr.getvalue()), (0, ''))
+        nc.NetConf.dbg_dump('test')
+        lines = sys.stderr.getvalue().splitlines()
+        self.assertEqual(lines[0], '=== DEBUG RING 3 records - test ===')
+        self.assertEqual([line.split(' ms ')[1] for line in lines[1:-1]], ['DBG: send_x() - arg(arg)'] * 3)
+        self.assertEqual(len(nc.NetConf.dbg_ring), 0)
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class HistogramTest(unittest.TestCase):
+
+    def test_bucket_of_value(self):
+        h = nc.Histogram()
+        for usec in [0, 1, 127, 128, 129, 255, 256, 1000, 123456, 10**9, h.MAXV - 1]:
+            idx = h.index(usec)
+            self.assertLess(idx, len(h.counts))
+            # middle of bucket within 1% of value
+            self.assertLessEqual(abs(h.value(idx) - usec), usec / 100.0 + 0.5)
+
+
+    def test_percentiles(self):
+        h = nc.Histogram()
+        for ms in range(1, 1001): h.add(ms / 1000.0)
+        self.assertEqual(h.count, 1000)
+        for pct in (50, 90, 99, 99.9):
+            self.assertAlmostEqual(h.percentile(pct), pct / 100.0, delta=pct / 100.0 * 0.01)
+        self.assertEqual(h.percentile(100), 1.0)
+        self.assertAlmostEqual(h.percentile(0), 0.001, delta=0.00001)
+
+
+    def test_merge(self):
+        a, b = nc.Histogram(), nc.Histogram()
+        a.add(0.001)
+        b.add(2.0)
+        a.merge(b)
+        self.assertEqual((a.count, a.min, a.max), (2, 0.001, 2.0))
+        self.assertAlmostEqual(a.percentile(50), 0.001, delta=0.00001)
+
+
+class ArchiveTest(NcTestCase):
+
+    def loop(self, *args):
+        self.connect('-rs', 'rs-${i}-', '-loop', '3', '-f', 'get-config.xml')
+        expected = [self.read('rs-%03d-get-config.xml' % i) for i in range(1, 4)]
+        for i in range(1, 4): os.remove(self.path('rs-%03d-get-config.xml' % i))
+        self.connect(*(list(args) + ['-rs', 'rs-${i}-', '-loop', '3', '-f', 'get-config.xml']))
+        return expected
+
+
+    def test_archive_round_trip(self):
+        expected = self.loop('-archive')
+        with open(self.path('rs-archive.idx')) as f:
+            index = [line.rstrip('\n').split('\t') for line in f]
+        self.assertEqual([int(rec[4]) for rec in index], [len(rs) for rs in expected])
+        self.assertEqual(os.path.getsize(self.path('rs-archive.seg')), sum(len(rs) for rs in expected))
+        self.nc('-restore', 'rs-archive')
+        # message-id is the same ${MSGID} in each session
+        self.assertEqual([self.read('rs-%03d-get-config.xml' % i) for i in range(1, 4)], expected)
+
+
+    def test_store_round_trip(self):
+        expected = self.loop('-store')
+        # equal data stored once
+        self.assertEqual(len(glob.glob(self.path('rs-store', 'objects', '*', '*.gz'))), 1)
+        self.nc('-restore', 'rs-store')
+        self.assertEqual([self.read('rs-%03d-get-config.xml' % i) for i in range(1, 4)], expected)
+
+
+class SubscribeTest(NcTestCase):
+
+    def subscribe(self, rotate, sec):
+        """
+        receive synthetic notifications (200/s, 100 bytes payload) to files of notifications/ prefix
+        :return: (number of events reported by nc.py, contents of notification files in order)
+        """
+        self.server('-notify', '200,100')
+        out = self.connect('-rs', 'notifications/', '-rotate', rotate, '-subscribe', 'NETCONF,%s' % sec, '-close')
+        events = int(re.search(r'SUMMARY.STATS.* (\d+) events', out).group(1))
+        names = sorted(glob.glob(self.path('notifications', 'notifications-*.xml')), key=lambda name: name[-8:])
+        files = []
+        for name in names:
+            with open(name, 'rb') as f: files.append(f.read().decode('utf-8'))
+        return events, files
+
+
+    def sequences(self, files):
+        # each file holds whole notifications only
+        for data in files:
+            self.assertEqual(data.count('<?xml'), data.count('</notification>'))
+        return [int(seq) for data in files for seq in re.findall(r'<sequence>(\d+)</sequence>', data)]
+
+
+    def test_rotation_by_size(self):
+        events, files = self.subscribe('20k', 1.5)
+        self.assertGreater(len(files), 2)
+        # file is closed by the first message reaching the size
+        for data in files[:-1]:
+            self.assertGreaterEqual(len(data), 20000)
+            self.assertLess(len(data), 21000)
+        self.assertLess(len(files[-1]), 21000)
+        # nothing lost or repeated between files
+        self.assertEqual(self.sequences(files), list(range(1, events + 1)))
+
+
+    def test_rotation_by_age(self):
+        events, files = self.subscribe('0,0.5', 1.6)
+        self.assertGreaterEqual(len(files), 3)
+        self.assertLessEqual(len(files), 5)
+        self.assertEqual(self.sequences(files), list(range(1, events + 1)))
+
+
+class TemplateTest(NcTestCase):
+
+    def test_loop_counter_in_request_and_response_name(self):
+        self.rq('loop.xml', msgid='m-${i}')
+        self.connect('-rs', 'rs-${i}-', '-loop', '3', '-f', 'loop.xml')
+        for i in range(1, 4):
+            self.assertEqual(self.reply('rs-%03d-loop.xml' % i).get('message-id'), 'm-%03d' % i)
+
+
+class ScenarioTest(NcTestCase):
+
+    def setUp(self):
+        NcTestCase.setUp(self)
+        self.rq('g.xml', msgid='m-${i1}-${i}')
+        self.rq('h.xml', msgid='m-${i1}-${i}')
+        with open(self.path('sc.txt'), 'w') as f:
+            f.write('# nested loops\nrs rs-${i1}-${i}-${n}-\nloop 2\n  loop 2\n    file g.xml\n  end\n  file h.xml\nend\n')
+        return
+
+
+    def test_nested_loop_counters(self):
+        self.connect('-scenario', 'sc.txt')
+        names = sorted(os.path.basename(name) for name in glob.glob(self.path('rs-*.xml')))
+        # ${n} counts executions of each step, ${i} after inner loop is the outer one again
+        self.assertEqual(names, ['rs-001-001-001-g.xml', 'rs-001-001-001-h.xml', 'rs-001-002-002-g.xml',
+                                 'rs-002-001-003-g.xml', 'rs-002-002-002-h.xml', 'rs-002-002-004-g.xml'])
+        for name in names:
+            self.assertEqual(self.reply(name).get('message-id'), 'm-' + name[3:10])
+
+
+    def test_compiled_once_under_loop(self):
+        out = self.connect('-debug', 'compile', '-loop', '2', '-scenario', 'sc.txt')
+        self.assertEqual(out.count('compiled sc.txt'), 1)
+        self.assertEqual(len(re.findall(r'FILE:.*DATA', out)), 12)
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'nc.py is python 2.x')
+class RenderTest(unittest.TestCase):
+
+    class Transport:
+        def __init__(self): self.data = []
+        def write(self, data):
+            self.data.append(str(data))
+            return len(data)
+
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='test_nc')
+        self.fname = os.path.join(self.dir, 'rq.xml')
+        self.write('<rpc message-id="${MSGID}-${i}-${TIMESTAMP}">%s</rpc>' % ('x' * 1000))
+        self.nc = nc.NetConf()
+        self.nc.ssh = self.Transport()
+        return
+
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        return
+
+
+    def write(self, text):
+        with open(self.fname, 'w') as f: f.write(text)
+        return
+
+
+    def sent(self):
+        """
+        request sent, chunked framing checked and removed
+        """
+        wire = ''.join(self.nc.ssh.data)
+        self.nc.ssh.data = []
+        self.assertTrue(wire.endswith('\n##\n'))
+        body, pos = [], 0
+        while not wire.startswith('\n##\n', pos):
+            match = re.compile(r'\n#(\d+)\n').match(wire, pos)
+            self.assertIsNotNone(match)
+            body.append(wire[match.end():match.end() + int(match.group(1))])
+            pos = match.end() + int(match.group(1))
+        return ''.join(body), len(body)
+
+
+    def test_render_cache(self):
+        tpl = self.nc.compile_request(self.fname)
+        self.assertIs(self.nc.compile_request(self.fname), tpl)
+        self.nc.loop_idx = 7
+        wire = self.nc.render_request(tpl, {'${MSGID}': 'a'})
+        # ${TIMESTAMP} is fixed per run, so it doesn't invalidate rendered request
+        self.assertIs(self.nc.render_request(tpl, {'${MSGID}': 'a'}), wire)
+        self.assertIn('message-id="a-007-%s"' % self.nc.VARS['${TIMESTAMP}'], wire)
+        self.nc.loop_idx = 8
+        self.assertIn('message-id="a-008-', self.nc.render_request(tpl, {'${MSGID}': 'a'}))
+        # size differs too, so change is seen within mtime resolution
+        self.write('<rpc message-id="changed">')
+        self.assertIsNot(self.nc.compile_request(self.fname), tpl)
+
+
+    def test_large_template_sent_in_chunks(self):
+        tpl = self.nc.load_request(self.fname)
+        self.write('<rpc message-id="changed on disk"/>')
+        self.nc.rq_chunk_size = 100
+        self.nc.send_rq11_file(self.fname, tpl)
+        body, chunks = self.sent()
+        self.assertEqual(chunks, 11)
+        self.assertEqual(body, '<rpc message-id="%d-001-%s">%s</rpc>' % (self.nc.msgid, self.nc.VARS['${TIMESTAMP}'], 'x' * 1000))
+        self.assertEqual(self.nc.last_msgid, '%d-001-%s' % (self.nc.msgid, self.nc.VARS['${TIMESTAMP}']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 from argparse import ArgumentParser
-import ncclient.manager
+import nc_broker
 import xml.dom.minidom
 from ncclient.operations import TimeoutExpiredError
 import pprint
@@ -30,7 +30,7 @@ def main():
     password=args.password,
     device_params={'name':"csr"}
   )
-  m = ncclient.manager.connect(**nckwargs)  
+  m = nc_broker.connect(**nckwargs)
   try:
     print ('Here we are printing the RIB as XML\n')
     #c = m.get(filter=('subtree', xml_filter))
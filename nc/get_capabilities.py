@@ -1,37 +1,164 @@
 #!/usr/bin/env python
 
-from ncclient import manager
+import nc_broker
 from defaults import *
 import argparse
+import hashlib
+import os
+import sqlite3
 import sys
 import re
+import time
+try:
+    from urlparse import parse_qs
+except ImportError:
+    from urllib.parse import parse_qs
+
+
+# capabilities parsed once per device (rebuilt when capability set from hello changes), indexed for
+# fleet queries answered without device sessions - every run without --offline or --fleet contacts
+# the device and exchanges new hello (warm broker session would report capabilities it got when opened)
+CACHE = os.environ.get('NC_CAPABILITIES', os.path.expanduser('~/.nc_capabilities.db'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (device TEXT PRIMARY KEY, hash TEXT, updated REAL, count INTEGER);
+CREATE TABLE IF NOT EXISTS capabilities (device TEXT, uri TEXT, namespace TEXT, module TEXT, revision TEXT);
+CREATE TABLE IF NOT EXISTS module_refs (device TEXT, module TEXT, kind TEXT, name TEXT);
+CREATE INDEX IF NOT EXISTS capabilities_module ON capabilities (module, revision);
+CREATE INDEX IF NOT EXISTS capabilities_device ON capabilities (device, module);
+CREATE INDEX IF NOT EXISTS capabilities_uri ON capabilities (uri);
+CREATE INDEX IF NOT EXISTS module_refs_name ON module_refs (kind, name);
+CREATE INDEX IF NOT EXISTS module_refs_device ON module_refs (device, module);
+'''
 
 
 def get_capabilities(host, port, user, pwd):
-    with manager.connect(host=host, port=port, username=user, password=pwd,
-                         hostkey_verify=False, device_params={'name': 'csr'}) as m:
-        capabilities =  m.server_capabilities
+    with nc_broker.connect(host=host, port=port, username=user, password=pwd,
+                           hostkey_verify=False, device_params={'name': 'csr'}) as m:
+        # direct ncclient session (NC_BROKER=off) is new already
+        refresh = getattr(m, 'refresh_capabilities', None)
+        capabilities = list(refresh() if refresh is not None else m.server_capabilities)
 
     return capabilities
 
+def open_cache(path):
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA synchronous = NORMAL')
+    db.executescript(SCHEMA)
+    db.create_function('REGEXP', 2, lambda pattern, value: value is not None and re.search(pattern, value, re.IGNORECASE) is not None)
+    return db
+
+def capability_hash(capabilities):
+    return hashlib.sha1('\n'.join(sorted(capabilities)).encode('utf-8')).hexdigest()
+
+def parse_capability(uri):
+    """
+    Split capability URI into namespace, module, revision, features and deviations
+    (module is None for protocol capabilities like urn:ietf:params:netconf:base:1.1).
+    """
+    namespace, _, query = uri.partition('?')
+    params = parse_qs(query)
+    module = params.get('module', [None])[0]
+    revision = params.get('revision', [None])[0]
+    features = [f for value in params.get('features', []) for f in value.split(',') if f]
+    deviations = [d for value in params.get('deviations', []) for d in value.split(',') if d]
+    return namespace, module, revision, features, deviations
+
+def update_cache(db, device, capabilities):
+    """
+    Parse and index capabilities of device unless the capability set is the same as cached one.
+    """
+    digest = capability_hash(capabilities)
+    row = db.execute('SELECT hash FROM devices WHERE device = ?', (device,)).fetchone()
+    if row is not None and row[0] == digest:
+        return False
+    caps = []
+    refs = []
+    for uri in capabilities:
+        namespace, module, revision, features, deviations = parse_capability(uri)
+        caps.append((device, uri, namespace, module, revision))
+        refs.extend((device, module, 'feature', f) for f in features)
+        refs.extend((device, module, 'deviation', d) for d in deviations)
+    with db:
+        db.execute('DELETE FROM capabilities WHERE device = ?', (device,))
+        db.execute('DELETE FROM module_refs WHERE device = ?', (device,))
+        db.executemany('INSERT INTO capabilities VALUES (?, ?, ?, ?, ?)', caps)
+        db.executemany('INSERT INTO module_refs VALUES (?, ?, ?, ?)', refs)
+        db.execute('INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?)', (device, digest, time.time(), len(capabilities)))
+    return True
+
+def query(db, device=None, pattern='', module=None, revision=None, feature=None, deviation=None):
+    """
+    (device, capability) pairs from cache matching all given conditions, device None = all devices
+    """
+    sql = 'SELECT DISTINCT c.device, c.uri FROM capabilities c'
+    where = []
+    params = []
+    for kind, name in (('feature', feature), ('deviation', deviation)):
+        if name:
+            sql += (' JOIN module_refs %s ON %s.device = c.device AND %s.module = c.module'
+                    ' AND %s.kind = ? AND %s.name = ?' % ((kind[0],) * 5))
+            params.extend([kind, name])
+    for column, value in (('c.device', device), ('c.module', module), ('c.revision', revision)):
+        if value:
+            where.append('%s = ?' % column)
+            params.append(value)
+    if pattern:
+        # the same capabilities repeat on many devices, regexp is evaluated once per distinct one
+        where.append('c.uri IN (SELECT uri FROM (SELECT DISTINCT uri FROM capabilities) WHERE uri REGEXP ?)')
+        params.append(pattern)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return db.execute(sql + ' ORDER BY c.device, c.uri', params).fetchall()
+
 def print_capabilities(c, pattern):
     print "Search pattern:" + pattern
-    filtered_c = [x for x in c if re.search(pattern, x, re.IGNORECASE)]
-    for one in filtered_c:
+    for one in c:
       print one
- 
+
+def print_devices(rows):
+    devices = sorted(set(device for device, uri in rows))
+    for device, uri in rows:
+      print device, uri
+    print "%d device(s): %s" % (len(devices), ' '.join(devices))
+
 def main():
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(description="Search capabilities of device (new hello, cached for offline "
+                                     "and fleet queries) or of all cached devices.")
     parser.add_argument('--search', '-s', default='', help="Filter for list of capabilities")
     parser.add_argument('--host', '-H', default=HOST, help="remote host address")
     parser.add_argument('--port', '-P', default=PORT, help="port")
     parser.add_argument('--user', '-u', default=USER, help="username")
     parser.add_argument('--password', '-p', default=PASS, help="password")
+    parser.add_argument('--module', '-m', help="YANG module name")
+    parser.add_argument('--revision', '-r', help="YANG module revision")
+    parser.add_argument('--feature', help="module supports feature")
+    parser.add_argument('--deviation', help="module is deviated by deviation module")
+    parser.add_argument('--cache', default=CACHE, help="capability cache file")
+    parser.add_argument('--offline', action='store_true', help="use cached capabilities of host, no session")
+    parser.add_argument('--refresh', action='store_true', help="parse capabilities again even if unchanged")
+    parser.add_argument('--fleet', action='store_true', help="query cached capabilities of all devices, no session")
     args = parser.parse_args()
 
-    result = get_capabilities(args.host, args.port, args.user, args.password)
-    
-    print_capabilities(result, args.search)
+    db = open_cache(args.cache)
+    device = '%s:%s' % (args.host, args.port)
+    if not (args.offline or args.fleet):
+        if args.refresh:
+            with db:
+                db.execute('DELETE FROM devices WHERE device = ?', (device,))
+        update_cache(db, device, get_capabilities(args.host, args.port, args.user, args.password))
+    elif not args.fleet and db.execute('SELECT 1 FROM devices WHERE device = ?', (device,)).fetchone() is None:
+        print >>sys.stderr, "%s is not cached, run without --offline first" % device
+        return 1
+
+    result = query(db, None if args.fleet else device, args.search, args.module, args.revision,
+                   args.feature, args.deviation)
+
+    if args.fleet:
+        print_devices(result)
+    else:
+        print_capabilities([uri for device, uri in result], args.search)
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
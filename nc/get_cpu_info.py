@@ -1,7 +1,9 @@
-import ncclient.manager as manager
+import nc_broker
+import series
 import xml.dom.minidom
 from argparse import ArgumentParser
-import xmltodict
+import threading
+import time
 import pprint
 
 cpu_util = '''<filter>
@@ -19,6 +21,62 @@ cpu_process = '''<filter>
 </filter>'''
 
 
+def devices(spec, port):
+  """
+  host[:port] list from comma separated string or @file with one per line
+  """
+  if spec.startswith('@'):
+    with open(spec[1:]) as f:
+      hosts = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+  else:
+    hosts = spec.split(',')
+  result = []
+  for h in hosts:
+    host, _, p = h.partition(':')
+    result.append((host, int(p) if p else port))
+  return result
+
+def report(all_series, top):
+  for s in all_series:
+    cpu = s.cpu['five-seconds']
+    mem = ' '.join('%s %.1f%%' % (pool, ring.last()) for pool, ring in sorted(s.memory.items()))
+    procs = ', '.join('%s %.1f (%.1f)' % (name, rate, avg) for name, pid, rate, avg in s.top(top))
+    print ('%-20s cpu 5s %3.0f%% avg %5.1f%% 1m %3.0f%% 5m %3.0f%% | mem %s | top ms/s %s | samples %d errors %d missed %d'
+           % (s.name, cpu.last() or 0, cpu.average(), s.cpu['one-minute'].last() or 0, s.cpu['five-minutes'].last() or 0,
+              mem, procs, s.samples, s.errors, s.missed))
+    if s.last_error:
+      print ('%-20s last error: %s' % ('', s.last_error))
+      s.last_error = None
+
+def poll(args):
+  """
+  sample CPU, process run time and memory of devices every --poll seconds into fixed size series,
+  print them every --report seconds till --duration or Ctrl-C
+  """
+  stop = threading.Event()
+  all_series = []
+  threads = []
+  for host, port in devices(args.devices or args.host, args.port):
+    s = series.DeviceSeries('%s:%d' % (host, port), args.samples, args.window, args.slots)
+    kwargs = dict(host=host, port=port, username=args.username, password=args.password,
+                  hostkey_verify=False, device_params={'name':"csr"})
+    t = threading.Thread(target=series.poll, args=(s, lambda kwargs=kwargs: nc_broker.connect(**kwargs), args.poll, stop))
+    t.daemon = True
+    t.start()
+    all_series.append(s)
+    threads.append(t)
+  end = time.time() + args.duration if args.duration else None
+  try:
+    while end is None or time.time() < end:
+      time.sleep(min(args.report, end - time.time()) if end else args.report)
+      report(all_series, args.top)
+  except KeyboardInterrupt:
+    pass
+  stop.set()
+  for t in threads:
+    t.join(args.poll + 10)
+
+
 if __name__ == '__main__':
   parser = ArgumentParser(description='Select options.')
   # Input parameters
@@ -28,18 +86,38 @@ if __name__ == '__main__':
   parser.add_argument('-p', '--password', type=str, default='vagrant')
   parser.add_argument('--port', type=int, default=830,
   help="Specify this if you want a non-default port")
+  parser.add_argument('--poll', type=float,
+  help="Sample CPU, processes and memory every POLL seconds instead of one-shot output")
+  parser.add_argument('--devices', type=str,
+  help="Devices polled, comma separated host[:port] or @file with one per line (default --host)")
+  parser.add_argument('--samples', type=int, default=1440,
+  help="Samples kept per device and metric (ring buffer size)")
+  parser.add_argument('--window', type=int, default=12,
+  help="Moving average window in samples")
+  parser.add_argument('--slots', type=int, default=1024,
+  help="Max processes tracked per device")
+  parser.add_argument('--top', type=int, default=5,
+  help="Processes with highest run time rate reported")
+  parser.add_argument('--report', type=float, default=60,
+  help="Report interval in seconds")
+  parser.add_argument('--duration', type=float,
+  help="Stop polling after seconds (default till Ctrl-C)")
   args = parser.parse_args()
-  m = manager.connect(host=args.host,
-                      port=args.port,
-                      username=args.username,
-                      password=args.password,
-                      device_params={'name':"csr"})
+  if args.poll:
+    poll(args)
+    raise SystemExit
+  m = nc_broker.connect(host=args.host,
+                        port=args.port,
+                        username=args.username,
+                        password=args.password,
+                        device_params={'name':"csr"})
   # Pretty print the XML reply
   print ('Using NETCONF, you can present data as XML without any conversion')
   cpu_util = str( m.get( filter=cpu_util ) )
   xmlDom = xml.dom.minidom.parseString(cpu_util)
   print xmlDom.toprettyxml( indent = " " )
   print ('Or you can convert to Dictionary')
+  import xmltodict
   cpu_dict = xmltodict.parse( cpu_util )['rpc-reply']['data']
   print [(i,v) for i,v in cpu_dict['cpu-usage']['cpu-utilization'].iteritems()]
   print ('\nWith structured data you can filter or sort \nHere we are grabbing the processes with higher run-time')
@@ -48,3 +126,4 @@ if __name__ == '__main__':
   nonzero_process = [t for t in cpu_dict['cpu-usage']['process-cpu-usage']['process'] if int(t['total-run-time']) > 100]
   pp = pprint.PrettyPrinter(indent=2)
   pp.pprint(nonzero_process)
+  m.close_session()
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from ncclient import manager
+import nc_broker
 import sys
 import xml.dom.minidom
 
@@ -31,10 +31,10 @@ def main():
     """
     Main method that retrieves the interfaces from config via NETCONF.
     """
-    with manager.connect(host=HOST, port=PORT, username=USER,
-                         password=PASS, hostkey_verify=False,
-                         device_params={'name': 'default'},
-                         allow_agent=False, look_for_keys=False) as m:
+    with nc_broker.connect(host=HOST, port=PORT, username=USER,
+                           password=PASS, hostkey_verify=False,
+                           device_params={'name': 'default'},
+                           allow_agent=False, look_for_keys=False) as m:
         """
         Simple main method calling our function.
         """
@@ -1,5 +1,6 @@
 from argparse import ArgumentParser
-import ncclient.manager
+import nc_broker
+import rib
 import xml.dom.minidom
 from ncclient.operations import TimeoutExpiredError
 import pprint
@@ -18,6 +19,49 @@ route_filter = '''
     </routing-instance>
   </routing-state>
   '''
+# default rib of --family for --stream
+route_filters = {4: route_filter, 6: route_filter.replace('ipv4', 'ipv6').replace('v4ur', 'v6ur')}
+
+def print_rib(table, args):
+  counts = {}
+  for p in table.prot:
+    counts[p] = counts.get(p, 0) + 1
+  print ('%d routes, %d strings, %d bytes in columns, %d skipped' % (len(table), len(table.strings), table.nbytes(), table.skipped))
+  for p, cnt in sorted(counts.items(), key=lambda item: -item[1]):
+    print ('  %-20s %d' % (table.strings[p] or '-', cnt))
+  for i in range(min(args.show, len(table))):
+    print ('  %-20s %-16s %-20s %s' % table.route(i))
+  if args.lookup:
+    lookup(table, args)
+  # diff before save so the same file can be used to track changes between polls
+  if args.diff:
+    print_diff(rib.Rib.load(args.diff), table, args)
+  if args.save:
+    table.save(args.save)
+
+def lookup(table, args):
+  if args.lookup.startswith('@'):
+    with open(args.lookup[1:]) as f:
+      addresses = [line.strip() for line in f if line.strip()]
+  else:
+    addresses = args.lookup.split(',')
+  found = rib.PrefixTrie(table).lookup_many(addresses)
+  print ('%d of %d addresses reachable' % (sum(1 for i in found if i >= 0), len(addresses)))
+  for address, i in list(zip(addresses, found))[:args.show]:
+    if i < 0:
+      print ('  %-16s no route' % address)
+    else:
+      print ('  %-16s %-20s %-16s %-20s %s' % ((address,) + table.route(i)))
+
+def print_diff(old, new, args):
+  added, removed, changed = rib.diff(rib.PrefixTrie(old), rib.PrefixTrie(new))
+  print ('%d added, %d removed, %d changed since %s' % (len(added), len(removed), len(changed), args.diff))
+  for i in added[:args.show]:
+    print ('+ %-20s %-16s %-20s %s' % new.route(i))
+  for i in removed[:args.show]:
+    print ('- %-20s %-16s %-20s %s' % old.route(i))
+  for i, j in changed[:args.show]:
+    print ('~ %-20s %-16s %-20s -> %s %s' % (old.route(i)[:3] + new.route(j)[1:3]))
 
 def main():
   parser = ArgumentParser(description='Select options.')
@@ -28,7 +72,29 @@ def main():
   parser.add_argument('-p', '--password', type=str, default='vagrant')
   parser.add_argument('--port', type=int, default=830,
   help="Specify this if you want a non-default port")
+  parser.add_argument('--stream', action='store_true',
+  help="Extract routes into columns (rib.py) instead of pretty printing, for full tables")
+  parser.add_argument('--file', type=str,
+  help="Extract routes from routing-state reply stored in file (like nc.py response), no session")
+  parser.add_argument('--family', type=int, choices=[4, 6], default=4,
+  help="Address family of extracted routes, routes of the other one are counted as skipped")
+  parser.add_argument('--save', type=str,
+  help="Save extracted routes to file (see rib.Rib.load)")
+  parser.add_argument('--show', type=int, default=20,
+  help="Number of extracted routes printed")
+  parser.add_argument('--snapshot', type=str,
+  help="Use routes saved by --save instead of extracting them, no session")
+  parser.add_argument('--lookup', type=str,
+  help="Longest prefix match of comma separated addresses (or @file with one per line) in extracted routes")
+  parser.add_argument('--diff', type=str,
+  help="Print routes added, removed and with changed next hop since snapshot saved by --save (may be the same file)")
   args = parser.parse_args()
+  if args.snapshot:
+    print_rib(rib.Rib.load(args.snapshot), args)
+    return
+  if args.file:
+    print_rib(rib.extract(args.file, args.family), args)
+    return
   nckwargs = dict(
     host=args.host,
     port=args.port,
@@ -37,7 +103,11 @@ def main():
     password=args.password,
     device_params={'name':"csr"}
   )
-  m = ncclient.manager.connect(**nckwargs)  
+  m = nc_broker.connect(**nckwargs)
+  if args.stream:
+    print_rib(rib.extract_chunks(nc_broker.get_chunks(m, filter=('subtree', route_filters[args.family])), args.family), args)
+    m.close_session()
+    return
   try:
     print ('Here we are printing the RIB as XML\n')
     c = m.get(filter=('subtree', route_filter))
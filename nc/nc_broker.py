@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+"""
+Local NETCONF session broker - keeps authenticated ncclient sessions to devices warm (ssh keepalives,
+idle sessions are closed after --idle seconds, at most --max-sessions per device) and shares them between
+script runs. Scripts talk to it over unix socket, one JSON line per request and per reply.
+
+  python nc_broker.py [--socket path] [--max-sessions 2] [--idle 300] [--keepalive 30] [--timeout 60]
+
+Scripts call connect() instead of ncclient.manager.connect(). It returns a session with get, get_config
+and edit_config whose replies are ncclient replies and server_capabilities (list of URIs), close_session()
+only detaches from broker (device session stays warm for the next run). get_chunks() returns reply text
+of get in chunks without any element tree built by ncclient, for replies too big to be parsed at once. Broker is started on first use
+when it is not running, NC_BROKER=off in environment makes connect() open direct ncclient session instead.
+"""
+from __future__ import print_function
+from argparse import ArgumentParser
+import errno
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+SOCKET = os.environ.get('NC_BROKER_SOCKET', '/tmp/nc_broker-%d.sock' % os.getuid())
+# operations forwarded to device sessions
+OPS = ['get', 'get_config', 'edit_config']
+# raw reply text is sent to client in chunks of this many characters, one JSON line each
+CHUNK = 1 << 20
+
+
+class BrokerError(Exception):
+  pass
+
+
+def close_quietly(m):
+  try:
+    m.close_session()
+  except Exception:
+    pass
+
+
+def raw_reply(m, op, args, kwargs):
+  """
+  reply text of operation - ncclient doesn't parse replies of async rpcs
+  """
+  m.async_mode = True
+  try:
+    rpc = getattr(m, op)(*args, **kwargs)
+  finally:
+    m.async_mode = False
+  rpc.event.wait(m.timeout)
+  if not rpc.event.is_set():
+    from ncclient.operations import TimeoutExpiredError
+    raise TimeoutExpiredError('timed out waiting for %s reply' % op)
+  if rpc.error is not None:
+    raise rpc.error
+  return rpc.reply.xml
+
+
+def reply_error(xml):
+  """
+  rpc-error of reply text (only reply with rpc-error is parsed)
+  """
+  if 'rpc-error' not in xml:
+    return None
+  from ncclient.operations.retrieve import GetReply
+  rs = GetReply(xml)
+  rs.parse()
+  return rs.error
+
+
+class DevicePool(object):
+  """
+  warm sessions of one device (same connect arguments), at most max_sessions open at once
+  """
+
+  def __init__(self, kwargs, max_sessions, keepalive):
+    self.kwargs = kwargs
+    self.max_sessions = max_sessions
+    self.keepalive = keepalive
+    # (manager, last use), the most recently used session is reused first so extra ones age out
+    self.idle = []
+    self.open = 0
+    self.cond = threading.Condition()
+
+  def checkout(self, timeout, fresh=False):
+    """
+    :param fresh: open new session (new hello), idle ones are closed as they may be outdated
+    """
+    if fresh:
+      self.evict(-1)
+    deadline = time.time() + timeout
+    with self.cond:
+      while True:
+        while self.idle:
+          m, used = self.idle.pop()
+          if m.connected:
+            return m
+          self.open -= 1
+        if self.open < self.max_sessions:
+          self.open += 1
+          break
+        wait = deadline - time.time()
+        if wait <= 0:
+          raise BrokerError('%s: all %d sessions busy' % (self.kwargs.get('host'), self.max_sessions))
+        self.cond.wait(wait)
+    try:
+      return self.connect()
+    except Exception:
+      with self.cond:
+        self.open -= 1
+        self.cond.notify()
+      raise
+
+  def connect(self):
+    from ncclient import manager
+    from ncclient.operations.rpc import RaiseMode
+    m = manager.connect(**self.kwargs)
+    # errors are raised by client from the reply, like ncclient does
+    m.raise_mode = RaiseMode.NONE
+    transport = getattr(getattr(m, '_session', None), '_transport', None)
+    if transport is not None and self.keepalive:
+      transport.set_keepalive(self.keepalive)
+    return m
+
+  def checkin(self, m, broken=False):
+    with self.cond:
+      if broken or not m.connected:
+        self.open -= 1
+      else:
+        self.idle.append((m, time.time()))
+        m = None
+      self.cond.notify()
+    if m is not None:
+      close_quietly(m)
+
+  def evict(self, idle_timeout):
+    """
+    close sessions idle for more than idle_timeout seconds or disconnected by device
+    """
+    now = time.time()
+    with self.cond:
+      stale = [m for m, used in self.idle if now - used > idle_timeout or not m.connected]
+      self.idle = [(m, used) for m, used in self.idle if m not in stale]
+      self.open -= len(stale)
+      self.cond.notify_all()
+    for m in stale:
+      close_quietly(m)
+    return len(stale)
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    for line in self.rfile:
+      try:
+        rs = self.server.execute(json.loads(line))
+      except Exception as e:
+        rs = {'error': '%s: %s' % (e.__class__.__name__, e)}
+      raw = rs.pop('stream', None)
+      if raw is not None:
+        for pos in range(0, len(raw), CHUNK):
+          self.wfile.write((json.dumps({'chunk': raw[pos:pos+CHUNK]}) + '\n').encode('utf-8'))
+        rs = {'end': len(raw)}
+      self.wfile.write((json.dumps(rs) + '\n').encode('utf-8'))
+      self.wfile.flush()
+
+
+def normalise(kwargs):
+  """
+  connect arguments of the same device written differently by scripts ('830', 830 or no port) are one pool
+  """
+  kwargs = dict((k, v) for k, v in kwargs.items() if v is not None)
+  kwargs['port'] = int(kwargs.get('port', 830))
+  if 'host' in kwargs:
+    kwargs['host'] = kwargs['host'].strip().lower()
+  return kwargs
+
+
+class Broker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+  pool_class = DevicePool
+
+  def __init__(self, path, max_sessions=2, idle=300, keepalive=30, timeout=60):
+    self.max_sessions = max_sessions
+    self.idle = idle
+    self.keepalive = keepalive
+    self.timeout = timeout
+    self.pools = {}
+    self.lock = threading.Lock()
+    if os.path.exists(path):
+      if listening(path):
+        raise BrokerError('broker already running on %s' % path)
+      os.unlink(path)
+    # requests carry passwords, socket is accessible by owner only
+    umask = os.umask(0o077)
+    try:
+      socketserver.UnixStreamServer.__init__(self, path, Handler)
+    finally:
+      os.umask(umask)
+    self.path = path
+
+  def pool(self, kwargs):
+    kwargs = normalise(kwargs)
+    key = json.dumps(kwargs, sort_keys=True)
+    with self.lock:
+      if key not in self.pools:
+        self.pools[key] = self.pool_class(kwargs, self.max_sessions, self.keepalive)
+      return self.pools[key]
+
+  def execute(self, rq):
+    op = rq.get('op')
+    if op not in ('connect', 'capabilities', 'hello', 'get_raw') and op not in OPS:
+      return {'error': 'unsupported operation %s' % op}
+    # json has no tuples, ncclient expects ('subtree', filter)
+    args = [tuple(a) if isinstance(a, list) else a for a in rq.get('args', [])]
+    kwargs = dict((k, tuple(v) if isinstance(v, list) else v) for k, v in rq.get('kwargs', {}).items())
+    pool = self.pool(rq['connect'])
+    m = pool.checkout(self.timeout, fresh=op == 'hello')
+    broken = True
+    try:
+      if op == 'connect':
+        rs = {'session_id': m.session_id}
+      elif op in ('capabilities', 'hello'):
+        rs = {'capabilities': list(m.server_capabilities)}
+      elif op == 'get_raw':
+        raw = raw_reply(m, 'get', args, kwargs)
+        # rpc-error reply goes the usual way so client raises it like get does
+        rs = {'xml': raw} if reply_error(raw) is not None else {'stream': raw}
+      else:
+        rs = {'xml': getattr(m, op)(*args, **kwargs).xml}
+      broken = False
+    except Exception as e:
+      # session state is unknown after timeout or transport error, it is not reused
+      rs = {'timeout' if e.__class__.__name__ == 'TimeoutExpiredError' else 'error': '%s' % e}
+    finally:
+      pool.checkin(m, broken)
+    return rs
+
+  def housekeeping(self):
+    while True:
+      time.sleep(max(1, min(self.idle, self.keepalive or self.idle) / 2.0))
+      with self.lock:
+        pools = list(self.pools.values())
+      for pool in pools:
+        pool.evict(self.idle)
+
+
+class Session(object):
+  """
+  ncclient manager look-alike sending operations through broker
+  """
+
+  def __init__(self, path, kwargs):
+    self.kwargs = kwargs
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(path)
+    self.rfile = self.sock.makefile('rb')
+    # warm session is checked (or opened) now so connect errors come from connect() like with ncclient
+    self.session_id = self.call('connect')['session_id']
+    self.connected = True
+
+  def call(self, op, args=(), kwargs=None):
+    rq = {'op': op, 'connect': self.kwargs, 'args': list(args), 'kwargs': kwargs or {}}
+    self.sock.sendall((json.dumps(rq) + '\n').encode('utf-8'))
+    return self.receive()
+
+  def receive(self):
+    line = self.rfile.readline()
+    if not line:
+      raise BrokerError('broker closed connection')
+    rs = json.loads(line)
+    if 'timeout' in rs:
+      from ncclient.operations import TimeoutExpiredError
+      raise TimeoutExpiredError(rs['timeout'])
+    if 'error' in rs:
+      raise BrokerError(rs['error'])
+    return rs
+
+  def reply(self, op, args, kwargs, cls):
+    rs = cls(self.call(op, args, kwargs)['xml'])
+    rs.parse()
+    if rs.error is not None:
+      raise rs.error
+    return rs
+
+  @property
+  def server_capabilities(self):
+    """
+    capability URIs from hello of warm session (as it was when the session was opened)
+    """
+    return self.call('capabilities')['capabilities']
+
+  def refresh_capabilities(self):
+    """
+    capability URIs from new hello - broker replaces idle sessions of device by a new one
+    """
+    return self.call('hello')['capabilities']
+
+  def get(self, *args, **kwargs):
+    from ncclient.operations.retrieve import GetReply
+    return self.reply('get', args, kwargs, GetReply)
+
+  def get_config(self, *args, **kwargs):
+    from ncclient.operations.retrieve import GetReply
+    return self.reply('get_config', args, kwargs, GetReply)
+
+  def edit_config(self, *args, **kwargs):
+    from ncclient.operations.rpc import RPCReply
+    return self.reply('edit_config', args, kwargs, RPCReply)
+
+  def get_chunks(self, *args, **kwargs):
+    """
+    reply text of get in chunks as broker sends them, must be read till the end
+    """
+    rs = self.call('get_raw', args, kwargs)
+    while 'chunk' in rs:
+      yield rs['chunk']
+      rs = self.receive()
+    if 'xml' in rs:
+      from ncclient.operations.retrieve import GetReply
+      rs = GetReply(rs['xml'])
+      rs.parse()
+      raise rs.error
+
+  def close_session(self):
+    """
+    detach from broker, device session stays open for next run
+    """
+    if self.connected:
+      self.connected = False
+      self.rfile.close()
+      self.sock.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close_session()
+    return False
+
+
+def get_chunks(m, *args, **kwargs):
+  """
+  reply text of get in chunks, no element tree is built (but ncclient holds whole reply text) -
+  through broker or from direct ncclient session
+  """
+  if isinstance(m, Session):
+    return m.get_chunks(*args, **kwargs)
+  raw = raw_reply(m, 'get', args, kwargs)
+  error = reply_error(raw)
+  if error is not None:
+    raise error
+  return (raw[pos:pos+CHUNK] for pos in range(0, len(raw), CHUNK))
+
+
+def listening(path):
+  probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    probe.connect(path)
+    return True
+  except socket.error:
+    return False
+  finally:
+    probe.close()
+
+
+def start_broker(path, wait=10):
+  """
+  start broker in background (own session so it outlives the script) and wait till it listens
+  """
+  with open(os.devnull, 'r+') as devnull:
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '--socket', path],
+                     stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+  deadline = time.time() + wait
+  while time.time() < deadline and not listening(path):
+    time.sleep(0.05)
+
+
+def connect(**kwargs):
+  """
+  ncclient.manager.connect() replacement - session through broker (started when it isn't running),
+  direct ncclient session when NC_BROKER=off or broker can't be reached
+  """
+  if os.environ.get('NC_BROKER', 'on') != 'off':
+    for attempt in range(2):
+      try:
+        return Session(SOCKET, kwargs)
+      except socket.error as e:
+        if attempt or e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+          print('nc_broker unavailable - %s, connecting directly' % e, file=sys.stderr)
+          break
+        start_broker(SOCKET)
+  from ncclient import manager
+  return manager.connect(**kwargs)
+
+
+def main():
+  parser = ArgumentParser(description='Keep NETCONF sessions warm for nc/ scripts.')
+  parser.add_argument('--socket', type=str, default=SOCKET, help="Unix socket path")
+  parser.add_argument('--max-sessions', type=int, default=2, help="Max sessions per device")
+  parser.add_argument('--idle', type=float, default=300, help="Close sessions idle for more seconds")
+  parser.add_argument('--keepalive', type=int, default=30, help="SSH keepalive interval in seconds (0 = off)")
+  parser.add_argument('--timeout', type=float, default=60, help="Max seconds to wait for free session")
+  args = parser.parse_args()
+  try:
+    broker = Broker(args.socket, args.max_sessions, args.idle, args.keepalive, args.timeout)
+  except BrokerError as e:
+    print(e, file=sys.stderr)
+    return 1
+  thread = threading.Thread(target=broker.housekeeping)
+  thread.daemon = True
+  thread.start()
+  try:
+    broker.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    os.unlink(args.socket)
+    for pool in broker.pools.values():
+      pool.evict(-1)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
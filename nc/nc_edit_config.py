@@ -1,5 +1,5 @@
 from argparse import ArgumentParser
-import ncclient.manager
+import nc_broker
 import xml.dom.minidom
 from ncclient.operations import TimeoutExpiredError
 import pprint
@@ -26,7 +26,7 @@ def main():
     password=args.password,
     device_params={'name':"csr"}
   )
-  m = ncclient.manager.connect(**nckwargs)
+  m = nc_broker.connect(**nckwargs)
   try:
     with open(xml_file) as f:
       xml_edit = f.read()
@@ -0,0 +1,361 @@
+"""
+Streaming RIB extraction - ietf-routing routing-state reply is parsed incrementally by expat (no element
+tree, every route goes straight to columns) into:
+
+  addr   array('I')  prefix address, 1 word per IPv4 route or 4 words per IPv6 route (network byte order value)
+  plen   array('B')  prefix length
+  hop    array('I')  next hop address  \
+  intfc  array('I')  outgoing interface > index into interned strings (0 = none)
+  prot   array('I')  source protocol   /
+
+so a million routes take ~17 MB and no per-route objects are kept. Columns are plain buffers, e.g.
+numpy.frombuffer(rib.plen, numpy.uint8) works without copying.
+
+  rib = extract(open('rs-get-routes.xml'))
+  for i in range(len(rib)): prefix, hop, intfc, prot = rib.route(i)
+
+PrefixTrie indexes Rib for longest prefix match, diff() compares two indexed snapshots:
+
+  trie = PrefixTrie(rib)
+  routes = trie.lookup_many(['10.1.2.3', '192.0.2.7'])
+  added, removed, changed = diff(PrefixTrie(Rib.load('previous.cols')), trie)
+"""
+from array import array
+import json
+import socket
+import struct
+from xml.parsers import expat
+
+# element names as reported by expat with '}' namespace separator
+NS = 'urn:ietf:params:xml:ns:yang:ietf-routing'
+ROUTE_E = NS + '}route'
+DEST = NS + '}destination-prefix'
+HOP_ADDR = NS + '}next-hop-address'
+INTFC = NS + '}outgoing-interface'
+PROT = NS + '}source-protocol'
+
+MAGIC = 'RIBCOLS1'
+
+
+class Rib(object):
+  """
+  routes of one address family as columns with interned next hop, interface and protocol strings
+  """
+
+  COLUMNS = ('addr', 'plen', 'hop', 'intfc', 'prot')
+
+  def __init__(self, family=4):
+    self.family = family
+    self.words = 1 if family == 4 else 4
+    self.addr = array('I')
+    self.plen = array('B')
+    self.hop = array('I')
+    self.intfc = array('I')
+    self.prot = array('I')
+    self.strings = ['']
+    self.index = {'': 0}
+    # routes of other address family or with invalid prefix
+    self.skipped = 0
+
+  def __len__(self):
+    return len(self.plen)
+
+  def intern(self, value):
+    if not value:
+      return 0
+    idx = self.index.get(value)
+    if idx is None:
+      idx = self.index[value] = len(self.strings)
+      self.strings.append(value)
+    return idx
+
+  def append(self, prefix, hop='', intfc='', prot=''):
+    addr, _, plen = prefix.partition('/')
+    try:
+      words = struct.unpack('!%dI' % self.words, socket.inet_pton(socket.AF_INET if self.family == 4 else socket.AF_INET6, addr))
+      length = int(plen) if plen else 32 * self.words
+      if not 0 <= length <= 32 * self.words:
+        raise ValueError('prefix length %d' % length)
+    except (socket.error, ValueError):
+      self.skipped += 1
+      return
+    self.addr.extend(words)
+    self.plen.append(length)
+    self.hop.append(self.intern(hop))
+    self.intfc.append(self.intern(intfc))
+    self.prot.append(self.intern(prot))
+
+  def prefix(self, i):
+    n = self.words
+    packed = struct.pack('!%dI' % n, *self.addr[i*n:(i+1)*n])
+    return '%s/%d' % (socket.inet_ntop(socket.AF_INET if self.family == 4 else socket.AF_INET6, packed), self.plen[i])
+
+  def route(self, i):
+    s = self.strings
+    return self.prefix(i), s[self.hop[i]], s[self.intfc[i]], s[self.prot[i]]
+
+  def nbytes(self):
+    return sum(len(c) * c.itemsize for c in (self.addr, self.plen, self.hop, self.intfc, self.prot))
+
+  def save(self, path):
+    """
+    header line (json) followed by raw columns
+    """
+    with open(path, 'wb') as f:
+      header = dict(magic=MAGIC, family=self.family, count=len(self), strings=self.strings,
+                    typecodes=[getattr(self, c).typecode for c in self.COLUMNS])
+      f.write((json.dumps(header) + '\n').encode('utf-8'))
+      for c in self.COLUMNS:
+        getattr(self, c).tofile(f)
+
+  @classmethod
+  def load(cls, path):
+    with open(path, 'rb') as f:
+      header = json.loads(f.readline().decode('utf-8'))
+      if header.get('magic') != MAGIC:
+        raise ValueError('%s is not saved Rib' % path)
+      rib = cls(header['family'])
+      rib.strings = header['strings']
+      rib.index = dict((s, i) for i, s in enumerate(rib.strings))
+      count = header['count']
+      for c in cls.COLUMNS:
+        getattr(rib, c).fromfile(f, count * rib.words if c == 'addr' else count)
+    return rib
+
+
+class RouteParser(object):
+  """
+  expat handlers collecting destination, first next hop address and interface and protocol of each route,
+  no element objects are created at all
+  """
+
+  FIELDS = {DEST: 'dest', HOP_ADDR: 'hop', INTFC: 'intfc', PROT: 'prot'}
+
+  def __init__(self, rib):
+    self.rib = rib
+    self.parser = expat.ParserCreate(namespace_separator='}')
+    self.parser.buffer_text = True
+    if hasattr(self.parser, 'returns_unicode'):
+      # python 2, byte strings are enough for addresses and names and much cheaper
+      self.parser.returns_unicode = False
+    self.parser.StartElementHandler = self.start
+    self.parser.EndElementHandler = self.end
+    self.parser.CharacterDataHandler = self.data
+    self.route = None
+    self.field = None
+
+  def start(self, name, attrs):
+    if name == ROUTE_E:
+      self.route = {}
+    elif self.route is not None:
+      field = self.FIELDS.get(name)
+      # the first next hop only
+      if field is not None and field not in self.route:
+        self.field = field
+        self.route[field] = ''
+
+  def data(self, text):
+    if self.field is not None:
+      self.route[self.field] += text
+
+  def end(self, name):
+    self.field = None
+    if name == ROUTE_E:
+      route = self.route
+      self.route = None
+      dest = route.get('dest', '').strip()
+      if dest:
+        self.rib.append(dest, route.get('hop', '').strip(), route.get('intfc', '').strip(), route.get('prot', '').strip())
+
+
+def extract(source, family=4):
+  """
+  parse routing-state reply incrementally into Rib
+  :param source: file name or file object (reply string can be passed to extract_string)
+  :param family: 4 or 6, routes of other family are counted in Rib.skipped
+  """
+  rib = Rib(family)
+  parser = RouteParser(rib).parser
+  if isinstance(source, str) or not hasattr(source, 'read'):
+    with open(source, 'rb') as f:
+      parser.ParseFile(f)
+  else:
+    parser.ParseFile(source)
+  return rib
+
+
+def extract_chunks(chunks, family=4):
+  """
+  parse reply received as text chunks (nc_broker.get_chunks) without joining them
+  """
+  rib = Rib(family)
+  parser = RouteParser(rib).parser
+  for chunk in chunks:
+    parser.Parse(chunk.encode('utf-8') if not isinstance(chunk, bytes) else chunk, False)
+  parser.Parse(b'', True)
+  return rib
+
+
+def extract_string(xml, family=4):
+  rib = Rib(family)
+  RouteParser(rib).parser.Parse(xml.encode('utf-8') if not isinstance(xml, bytes) else xml, True)
+  return rib
+
+
+class PrefixTrie(object):
+  """
+  path compressed binary (Patricia) trie over routes of Rib for longest prefix match and snapshot diff
+
+  Nodes are columns too - bit length, route at node (-1 = none), a route below the node whose first
+  bits are the node key (so keys are not stored) and both children (-1 = none), ~17 bytes per node
+  and at most 2 nodes per route. Node 0 is the root (/0). Routes are inserted in prefix order so every
+  one is attached to the path of the previous one instead of being looked up from the root.
+  """
+
+  def __init__(self, rib):
+    self.rib = rib
+    self.width = 32 * rib.words
+    if rib.words == 1:
+      self.keys = rib.addr
+    else:
+      a = rib.addr
+      self.keys = [(a[n] << 96) | (a[n+1] << 64) | (a[n+2] << 32) | a[n+3] for n in range(0, len(a), 4)]
+    self.nlen = array('B', [0])
+    self.nroute = array('i', [-1])
+    self.nref = array('i', [-1])
+    self.child = [array('i', [-1]), array('i', [-1])]
+    # routes with the same prefix as already indexed one (the first one is kept)
+    self.duplicates = 0
+    self.build()
+
+  def node(self, length, ref, route):
+    self.nlen.append(length)
+    self.nref.append(ref)
+    self.nroute.append(route)
+    self.child[0].append(-1)
+    self.child[1].append(-1)
+    return len(self.nlen) - 1
+
+  def sort_key(self, i):
+    """
+    prefix order - address bits (host bits cleared), shorter prefix first
+    """
+    shift = self.width - self.rib.plen[i]
+    return (self.keys[i] >> shift << shift << 8 | self.rib.plen[i]) if shift < self.width else 0
+
+  def build(self):
+    width, keys, plen = self.width, self.keys, self.rib.plen
+    nlen, nroute, nref, child = self.nlen, self.nroute, self.nref, self.child
+    # path from root to the last inserted node
+    path = [0]
+    for i in sorted(range(len(plen)), key=self.sort_key):
+      key, length = keys[i], plen[i]
+      while True:
+        n = path[-1]
+        ancestor = nlen[n]
+        if ancestor <= length and not (ancestor and (key ^ keys[nref[n]]) >> (width - ancestor)):
+          break
+        path.pop()
+      if ancestor == length:
+        if nroute[n] < 0:
+          nroute[n] = i
+          if nref[n] < 0: nref[n] = i
+        else:
+          self.duplicates += 1
+        continue
+      side = child[(key >> (width - 1 - ancestor)) & 1]
+      c = side[n]
+      if c < 0:
+        side[n] = self.node(length, i, i)
+        path.append(side[n])
+        continue
+      # in prefix order existing child is the subtree just left, the route can't be above it,
+      # so they branch where they differ
+      differ = (key ^ keys[nref[c]]) >> (width - min(nlen[c], length))
+      common = min(nlen[c], length) - differ.bit_length()
+      branch = side[n] = self.node(common, i, -1)
+      child[(keys[nref[c]] >> (width - 1 - common)) & 1][branch] = c
+      leaf = child[(key >> (width - 1 - common)) & 1][branch] = self.node(length, i, i)
+      path.extend((branch, leaf))
+    return
+
+  def address_key(self, address):
+    if self.rib.words == 1:
+      return struct.unpack('!I', socket.inet_aton(address))[0]
+    value = 0
+    for word in struct.unpack('!4I', socket.inet_pton(socket.AF_INET6, address)):
+      value = (value << 32) | word
+    return value
+
+  def match(self, key):
+    """
+    longest prefix match of integer address
+    :return: route index or -1
+    """
+    width, keys = self.width, self.keys
+    nlen, nroute, nref, child = self.nlen, self.nroute, self.nref, self.child
+    best = -1
+    n = 0
+    while n >= 0:
+      length = nlen[n]
+      if length and (key ^ keys[nref[n]]) >> (width - length):
+        break
+      if nroute[n] >= 0:
+        best = nroute[n]
+      if length == width:
+        break
+      n = child[(key >> (width - 1 - length)) & 1][n]
+    return best
+
+  def lookup(self, address):
+    return self.match(self.address_key(address))
+
+  def lookup_many(self, addresses):
+    """
+    longest prefix match of many addresses
+    :param addresses: address strings
+    :return: array of route indexes (-1 = no route)
+    """
+    match, address_key = self.match, self.address_key
+    return array('i', (match(address_key(a)) for a in addresses))
+
+  def walk(self):
+    """
+    route indexes in prefix order
+    """
+    nroute, child = self.nroute, self.child
+    stack = [0]
+    while stack:
+      n = stack.pop()
+      if nroute[n] >= 0:
+        yield nroute[n]
+      for c in (child[1][n], child[0][n]):
+        if c >= 0:
+          stack.append(c)
+
+
+def diff(old, new):
+  """
+  changes between two snapshots indexed by PrefixTrie, both tries are walked in prefix order at once
+  :return: (added routes of new, removed routes of old, [(old route, new route)] with changed next hop or interface)
+  """
+  added, removed, changed = [], [], []
+  olds, news = old.rib.strings, new.rib.strings
+  walk_old, walk_new = old.walk(), new.walk()
+  i = next(walk_old, None)
+  j = next(walk_new, None)
+  while i is not None or j is not None:
+    ki = old.sort_key(i) if i is not None else None
+    kj = new.sort_key(j) if j is not None else None
+    if j is None or (i is not None and ki < kj):
+      removed.append(i)
+      i = next(walk_old, None)
+    elif i is None or kj < ki:
+      added.append(j)
+      j = next(walk_new, None)
+    else:
+      if (olds[old.rib.hop[i]], olds[old.rib.intfc[i]]) != (news[new.rib.hop[j]], news[new.rib.intfc[j]]):
+        changed.append((i, j))
+      i = next(walk_old, None)
+      j = next(walk_new, None)
+  return added, removed, changed
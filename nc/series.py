@@ -0,0 +1,297 @@
+"""
+Fixed size time series of device CPU and memory samples (Cisco-IOS-XE-process-cpu-oper and
+Cisco-IOS-XE-memory-oper), so devices can be polled for weeks in constant memory and CPU:
+
+  Ring          last size samples in preallocated array('d') with running sum of the last window ones
+                (moving average is O(1) per sample)
+  DeviceSeries  time, CPU utilization and memory pool rings of one device and per process run time rate
+                columns - processes get fixed slots (reused when process disappears), rate and its
+                exponential moving average are updated in place, top N is heapq over slots
+  poll()        samples one device every interval seconds, reply is parsed by expat straight to numbers
+
+  series = DeviceSeries('rtr1', size=1440, window=12)
+  poll(series, lambda: nc_broker.connect(host='rtr1', ...), 60, threading.Event())
+"""
+from array import array
+import heapq
+import time
+from xml.parsers import expat
+
+CPU_NS = 'http://cisco.com/ns/yang/Cisco-IOS-XE-process-cpu-oper'
+MEM_NS = 'http://cisco.com/ns/yang/Cisco-IOS-XE-memory-oper'
+
+SAMPLE_FILTER = '''<filter>
+<cpu-usage xmlns="%s">
+<cpu-utilization>
+<five-seconds/>
+<one-minute/>
+<five-minutes/>
+<cpu-usage-processes>
+<cpu-usage-process>
+<pid/>
+<name/>
+<total-run-time/>
+</cpu-usage-process>
+</cpu-usage-processes>
+</cpu-utilization>
+</cpu-usage>
+<memory-statistics xmlns="%s">
+<memory-statistic>
+<name/>
+<total-memory/>
+<used-memory/>
+</memory-statistic>
+</memory-statistics>
+</filter>''' % (CPU_NS, MEM_NS)
+
+
+class Ring(object):
+  """
+  last size samples, moving average of the last window ones
+  """
+
+  def __init__(self, size, window=1):
+    self.size = size
+    self.window = max(1, min(window, size))
+    self.values = array('d', [0.0]) * size
+    # samples appended ever, the last one is at (count - 1) % size
+    self.count = 0
+    self.wsum = 0.0
+
+  def __len__(self):
+    return min(self.count, self.size)
+
+  def append(self, value):
+    if self.count >= self.window:
+      self.wsum -= self.values[(self.count - self.window) % self.size]
+    self.values[self.count % self.size] = value
+    self.count += 1
+    if self.count % self.window == 0:
+      # running sum is recomputed once per window so rounding errors don't add up over weeks
+      self.wsum = sum(self.tail(self.window))
+    else:
+      self.wsum += value
+
+  def last(self, back=0):
+    """
+    sample appended back samples before the last one (None if not available)
+    """
+    if back >= len(self):
+      return None
+    return self.values[(self.count - 1 - back) % self.size]
+
+  def tail(self, n):
+    """
+    last n samples, the oldest first
+    """
+    n = min(n, len(self))
+    start = (self.count - n) % self.size
+    if start + n <= self.size:
+      return self.values[start:start+n]
+    return self.values[start:] + self.values[:start + n - self.size]
+
+  def average(self):
+    n = min(self.count, self.window)
+    return self.wsum / n if n else 0.0
+
+
+class DeviceSeries(object):
+  """
+  samples of one device
+  """
+
+  CPU = ('five-seconds', 'one-minute', 'five-minutes')
+
+  def __init__(self, name, size=1440, window=12, slots=1024, pools=16):
+    self.name = name
+    self.size = size
+    self.window = window
+    self.time = Ring(size, window)
+    self.cpu = dict((field, Ring(size, window)) for field in self.CPU)
+    # memory pool name -> Ring of used %, at most pools of them
+    self.memory = {}
+    self.pools = pools
+    # (pid, name) -> slot, processes not reported in the last sample free their slots
+    self.slot = {}
+    self.free = list(range(slots - 1, -1, -1))
+    self.names = [None] * slots
+    self.pids = array('l', [0]) * slots
+    # total-run-time (ms) in the last sample, ms of CPU per second since previous sample and its moving average
+    self.runtime = array('d', [0.0]) * slots
+    self.rate = array('d', [0.0]) * slots
+    self.average = array('d', [0.0]) * slots
+    self.seen = array('l', [0]) * slots
+    self.alpha = 2.0 / (window + 1)
+    self.samples = 0
+    # processes or pools not tracked for lack of slots
+    self.dropped = 0
+    self.errors = 0
+    self.last_error = None
+    self.missed = 0
+
+  def record(self, timestamp, cpu, memory, processes):
+    """
+    add parsed sample
+    :param timestamp:
+    :param cpu: {cpu field: %}
+    :param memory: {pool: (total, used)}
+    :param processes: [(pid, name, total run time)]
+    """
+    previous = self.time.last()
+    elapsed = timestamp - previous if previous is not None else 0.0
+    self.samples += 1
+    self.time.append(timestamp)
+    for field, ring in self.cpu.items():
+      ring.append(cpu.get(field, 0.0))
+    for pool, (total, used) in memory.items():
+      ring = self.memory.get(pool)
+      if ring is None:
+        if len(self.memory) >= self.pools:
+          self.dropped += 1
+          continue
+        ring = self.memory[pool] = Ring(self.size, self.window)
+      ring.append(100.0 * used / total if total else 0.0)
+    self.update_processes(processes, elapsed)
+
+  def update_processes(self, processes, elapsed):
+    slot, runtime, rate, average, seen = self.slot, self.runtime, self.rate, self.average, self.seen
+    alpha, sample = self.alpha, self.samples
+    new = []
+    for pid, name, value in processes:
+      s = slot.get((pid, name))
+      if s is None:
+        new.append((pid, name, value))
+        continue
+      if elapsed > 0:
+        # counter restarts (process restarted with the same pid) are not negative rates
+        rate[s] = max(0.0, value - runtime[s]) / elapsed
+        average[s] += alpha * (rate[s] - average[s])
+      runtime[s] = value
+      seen[s] = sample
+    # slots of processes gone are freed before new processes get theirs
+    if len(slot) + len(new) > len(processes):
+      for key, s in list(slot.items()):
+        if seen[s] != sample:
+          del slot[key]
+          self.names[s] = None
+          self.free.append(s)
+    for pid, name, value in new:
+      if not self.free:
+        self.dropped += 1
+        continue
+      s = slot[(pid, name)] = self.free.pop()
+      self.names[s] = name
+      self.pids[s] = pid
+      rate[s] = average[s] = 0.0
+      runtime[s] = value
+      seen[s] = sample
+
+  def top(self, n, smoothed=True):
+    """
+    processes with the highest CPU run time rate
+    :param smoothed: order by moving average instead of the last rate
+    :return: [(name, pid, rate, average)]
+    """
+    key = (self.average if smoothed else self.rate).__getitem__
+    return [(self.names[s], self.pids[s], self.rate[s], self.average[s])
+            for s in heapq.nlargest(n, self.slot.values(), key=key)]
+
+
+class SampleParser(object):
+  """
+  expat handlers collecting CPU utilization, processes and memory pools from get reply
+  """
+
+  LEAVES = set(DeviceSeries.CPU + ('pid', 'name', 'total-run-time', 'total-memory', 'used-memory'))
+
+  def __init__(self):
+    self.parser = expat.ParserCreate(namespace_separator='}')
+    self.parser.buffer_text = True
+    self.parser.StartElementHandler = self.start
+    self.parser.EndElementHandler = self.end
+    self.parser.CharacterDataHandler = self.data
+    self.cpu = {}
+    self.memory = {}
+    self.processes = []
+    self.entry = None
+    self.field = None
+    self.text = ''
+
+  def start(self, name, attrs):
+    local = name.rpartition('}')[2]
+    if local in ('cpu-usage-process', 'memory-statistic'):
+      self.entry = {}
+    elif local in self.LEAVES:
+      self.field = local
+      self.text = ''
+
+  def data(self, text):
+    if self.field is not None:
+      self.text += text
+
+  def end(self, name):
+    local = name.rpartition('}')[2]
+    if local == self.field:
+      if self.entry is not None:
+        self.entry[local] = self.text.strip()
+      elif local in DeviceSeries.CPU:
+        self.cpu[local] = float(self.text)
+      self.field = None
+    elif local == 'cpu-usage-process':
+      e = self.entry
+      self.processes.append((int(e.get('pid', 0)), e.get('name', ''), float(e.get('total-run-time', 0))))
+      self.entry = None
+    elif local == 'memory-statistic':
+      e = self.entry
+      self.memory[e.get('name', '')] = (float(e.get('total-memory', 0)), float(e.get('used-memory', 0)))
+      self.entry = None
+
+
+def parse_sample(xml):
+  """
+  :return: (cpu, memory, processes) as expected by DeviceSeries.record
+  """
+  p = SampleParser()
+  p.parser.Parse(xml.encode('utf-8') if not isinstance(xml, bytes) else xml, True)
+  return p.cpu, p.memory, p.processes
+
+
+def poll(series, connect, interval, stop):
+  """
+  sample device every interval seconds till stop is set, errors are counted and session is opened again
+  :param series: DeviceSeries
+  :param connect: callable returning session (nc_broker.connect or ncclient manager)
+  :param interval:
+  :param stop: threading.Event
+  """
+  m = None
+  due = time.time()
+  while not stop.is_set():
+    try:
+      if m is None:
+        m = connect()
+      xml = m.get(filter=SAMPLE_FILTER).xml
+      series.record(time.time(), *parse_sample(xml))
+    except Exception as e:
+      series.errors += 1
+      series.last_error = '%s: %s' % (e.__class__.__name__, e)
+      close_quietly(m)
+      m = None
+    due += interval
+    now = time.time()
+    if due < now:
+      # slow device or reply, samples stay on the interval grid
+      skipped = int((now - due) / interval) + 1
+      series.missed += skipped
+      due += skipped * interval
+    stop.wait(due - now)
+  close_quietly(m)
+
+
+def close_quietly(m):
+  if m is None:
+    return
+  try:
+    m.close_session()
+  except Exception:
+    pass
@@ -0,0 +1,74 @@
+"""
+Tests of get_capabilities.py - capability parsing, cache rebuild on changed set and fleet queries
+
+  python -m unittest test_get_capabilities
+"""
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+if sys.version_info[0] == 2:
+  try:
+    import defaults
+  except ImportError:
+    # defaults.py holds address and credentials of the lab device, it is not in the repository
+    defaults = types.ModuleType('defaults')
+    defaults.HOST, defaults.PORT, defaults.USER, defaults.PASS = '127.0.0.1', 830, 'admin', 'admin'
+    sys.modules['defaults'] = defaults
+  import get_capabilities
+
+BASE = 'urn:ietf:params:netconf:base:1.1'
+IP = ('urn:ietf:params:xml:ns:yang:ietf-ip?module=ietf-ip&revision=2014-06-16'
+      '&features=ipv4-non-contiguous-netmasks,ipv6-privacy-autoconf&deviations=cisco-xe-ietf-ip-deviation')
+IF_OLD = 'urn:ietf:params:xml:ns:yang:ietf-interfaces?module=ietf-interfaces&revision=2014-05-08'
+IF_NEW = 'urn:ietf:params:xml:ns:yang:ietf-interfaces?module=ietf-interfaces&revision=2018-02-20&features=arbitrary-names'
+
+
+@unittest.skipIf(sys.version_info[0] != 2, 'get_capabilities.py is python 2.x')
+class CapabilityCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.db = get_capabilities.open_cache(os.path.join(self.tmp, 'capabilities.db'))
+
+  def tearDown(self):
+    self.db.close()
+    shutil.rmtree(self.tmp)
+
+  def count(self, table, device):
+    return self.db.execute('SELECT COUNT(*) FROM %s WHERE device = ?' % table, (device,)).fetchone()[0]
+
+  def test_parse_capability(self):
+    self.assertEqual(get_capabilities.parse_capability(IP),
+                     ('urn:ietf:params:xml:ns:yang:ietf-ip', 'ietf-ip', '2014-06-16',
+                      ['ipv4-non-contiguous-netmasks', 'ipv6-privacy-autoconf'], ['cisco-xe-ietf-ip-deviation']))
+    self.assertEqual(get_capabilities.parse_capability(BASE), (BASE, None, None, [], []))
+
+  def test_unchanged_set_not_rebuilt(self):
+    self.assertTrue(get_capabilities.update_cache(self.db, 'r1:830', [BASE, IP, IF_OLD]))
+    self.assertEqual((self.count('capabilities', 'r1:830'), self.count('module_refs', 'r1:830')), (3, 3))
+    # the same set in other order has the same hash
+    self.assertFalse(get_capabilities.update_cache(self.db, 'r1:830', [IF_OLD, IP, BASE]))
+    self.assertTrue(get_capabilities.update_cache(self.db, 'r1:830', [BASE, IF_NEW]))
+    self.assertEqual((self.count('capabilities', 'r1:830'), self.count('module_refs', 'r1:830')), (2, 1))
+    self.assertEqual(self.db.execute('SELECT count FROM devices WHERE device = ?', ('r1:830',)).fetchone()[0], 2)
+
+  def test_fleet_query(self):
+    get_capabilities.update_cache(self.db, 'r1:830', [BASE, IP, IF_OLD])
+    get_capabilities.update_cache(self.db, 'r2:830', [BASE, IF_NEW])
+    get_capabilities.update_cache(self.db, 'r3:830', [BASE, IP, IF_NEW])
+    query = get_capabilities.query
+    self.assertEqual(query(self.db, module='ietf-interfaces', revision='2018-02-20'),
+                     [('r2:830', IF_NEW), ('r3:830', IF_NEW)])
+    self.assertEqual(query(self.db, feature='arbitrary-names'), [('r2:830', IF_NEW), ('r3:830', IF_NEW)])
+    self.assertEqual(query(self.db, module='ietf-ip', deviation='cisco-xe-ietf-ip-deviation'),
+                     [('r1:830', IP), ('r3:830', IP)])
+    self.assertEqual(query(self.db, 'r1:830', 'INTERFACES'), [('r1:830', IF_OLD)])
+    self.assertEqual(query(self.db, 'r2:830', feature='ipv6-privacy-autoconf'), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,151 @@
+"""
+Tests of nc_broker.py - session cap, idle eviction, broken sessions and chunked replies with a fake manager
+
+  python -m unittest test_nc_broker
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import nc_broker
+
+REPLY = '<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1"><data>%s</data></rpc-reply>'
+
+
+class Reply(object):
+
+  def __init__(self, xml):
+    self.xml = xml
+
+
+class Rpc(object):
+  """
+  reply of async rpc as ncclient has it once received
+  """
+
+  def __init__(self, xml):
+    self.event = threading.Event()
+    self.event.set()
+    self.error = None
+    self.reply = Reply(xml)
+
+
+class Manager(object):
+  """
+  ncclient manager look-alike, get fails while self.fail is set
+  """
+  count = 0
+
+  def __init__(self, data='<x/>'):
+    Manager.count += 1
+    self.session_id = Manager.count
+    self.server_capabilities = ['urn:ietf:params:netconf:base:1.1']
+    self.connected = True
+    self.closed = False
+    self.async_mode = False
+    self.timeout = 1
+    self.data = data
+    self.fail = False
+
+  def get(self, *args, **kwargs):
+    if self.fail:
+      raise IOError('transport closed')
+    xml = REPLY % self.data
+    return Rpc(xml) if self.async_mode else Reply(xml)
+
+  def close_session(self):
+    self.connected = False
+    self.closed = True
+
+
+class Pool(nc_broker.DevicePool):
+
+  def connect(self):
+    return Manager(self.kwargs.get('data', '<x/>'))
+
+
+class DevicePoolTest(unittest.TestCase):
+
+  def test_cap_blocks_then_times_out(self):
+    pool = Pool({'host': 'r1'}, 1, 0)
+    m = pool.checkout(1)
+    start = time.time()
+    self.assertRaises(nc_broker.BrokerError, pool.checkout, 0.2)
+    self.assertGreaterEqual(time.time() - start, 0.2)
+    # waiter gets the session back as soon as it is checked in
+    threading.Timer(0.1, pool.checkin, (m,)).start()
+    self.assertIs(pool.checkout(5), m)
+    self.assertEqual(pool.open, 1)
+
+  def test_idle_sessions_evicted(self):
+    pool = Pool({'host': 'r1'}, 2, 0)
+    old, new = pool.checkout(1), pool.checkout(1)
+    pool.checkin(old)
+    pool.checkin(new)
+    pool.idle[0] = (old, time.time() - 100)
+    self.assertEqual(pool.evict(10), 1)
+    self.assertTrue(old.closed)
+    self.assertEqual((pool.open, [m for m, used in pool.idle]), (1, [new]))
+
+  def test_disconnected_session_not_reused(self):
+    pool = Pool({'host': 'r1'}, 1, 0)
+    m = pool.checkout(1)
+    pool.checkin(m)
+    m.connected = False
+    self.assertIsNot(pool.checkout(1), m)
+    self.assertEqual(pool.open, 1)
+
+
+class BrokerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp, 'broker.sock')
+    self.broker = nc_broker.Broker(self.path, max_sessions=1, timeout=1)
+    self.broker.pool_class = Pool
+    self.thread = threading.Thread(target=self.broker.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def tearDown(self):
+    self.broker.shutdown()
+    self.broker.server_close()
+    shutil.rmtree(self.tmp)
+
+  def test_pool_key_normalised(self):
+    pool = self.broker.pool({'host': 'R1', 'port': '830'})
+    self.assertIs(self.broker.pool({'host': 'r1'}), pool)
+    self.assertIs(self.broker.pool({'host': 'r1', 'port': 830, 'username': None}), pool)
+    self.assertIsNot(self.broker.pool({'host': 'r1', 'port': 2022}), pool)
+
+  def test_broken_session_not_reused(self):
+    pool = self.broker.pool({'host': 'r1'})
+    rq = {'op': 'get', 'connect': {'host': 'r1'}}
+    first = self.broker.execute(rq)
+    m = pool.idle[-1][0]
+    m.fail = True
+    self.assertEqual(self.broker.execute(rq), {'error': 'transport closed'})
+    self.assertTrue(m.closed)
+    self.assertEqual((pool.open, pool.idle), (0, []))
+    self.assertEqual(self.broker.execute(rq), first)
+    self.assertIsNot(pool.idle[-1][0], m)
+
+  def test_get_raw_chunks_reassemble(self):
+    data = ''.join('<route><n>%d</n></route>' % i for i in range(200))
+    chunk, nc_broker.CHUNK = nc_broker.CHUNK, 100
+    try:
+      with nc_broker.Session(self.path, {'host': 'r1', 'data': data}) as session:
+        chunks = list(nc_broker.get_chunks(session))
+        # session is usable again after the stream was read till the end
+        self.assertEqual(session.server_capabilities, ['urn:ietf:params:netconf:base:1.1'])
+    finally:
+      nc_broker.CHUNK = chunk
+    self.assertEqual(''.join(chunks), REPLY % data)
+    self.assertEqual(len(chunks), (len(REPLY % data) + 99) // 100)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,153 @@
+"""
+Tests of rib.py - extraction, longest prefix match against brute force and snapshot diff
+
+  python -m unittest test_rib
+"""
+import os
+import random
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+
+import rib
+
+REPLY = '''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1"><data>
+<routing-state xmlns="urn:ietf:params:xml:ns:yang:ietf-routing"><routing-instance><ribs><rib><routes>
+%s
+</routes></rib></ribs></routing-instance></routing-state></data></rpc-reply>'''
+
+ROUTE = '''<route><destination-prefix>%s</destination-prefix><source-protocol>%s</source-protocol>
+<next-hop><next-hop-address>%s</next-hop-address><outgoing-interface>%s</outgoing-interface></next-hop></route>'''
+
+
+def reply(routes):
+  return REPLY % '\n'.join(ROUTE % route for route in routes)
+
+
+def ip4(value):
+  return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def brute_force(table, key):
+  """
+  longest prefix match by checking every route, the first of equal prefixes wins
+  """
+  best = -1
+  for i in range(len(table)):
+    plen = table.plen[i]
+    if (plen == 0 or (key ^ table.addr[i]) >> (32 - plen) == 0) and (best < 0 or plen > table.plen[best]):
+      best = i
+  return best
+
+
+class ExtractTest(unittest.TestCase):
+
+  def test_columns(self):
+    table = rib.extract_string(reply([('10.0.0.0/8', 'static', '192.0.2.1', 'Gi0/0'),
+                                      ('2001:db8::/32', 'static', '2001:db8::1', 'Gi0/1'),
+                                      ('10.1.0.0/16', 'ospf', '192.0.2.2', 'Gi0/0')]))
+    self.assertEqual(len(table), 2)
+    self.assertEqual(table.skipped, 1)
+    self.assertEqual(table.route(1), ('10.1.0.0/16', '192.0.2.2', 'Gi0/0', 'ospf'))
+    # interface string is interned once
+    self.assertEqual(table.intfc[0], table.intfc[1])
+
+  def test_invalid_prefix_length_skipped(self):
+    table = rib.Rib()
+    for prefix in ('10.0.0.0/33', '10.0.0.0/-1', '10.0.0.0/x', '10.0.0.0/', '10.0.0.0/0', '10.0.0.1'):
+      table.append(prefix)
+    self.assertEqual(table.skipped, 3)
+    self.assertEqual([table.prefix(i) for i in range(len(table))], ['10.0.0.0/32', '10.0.0.0/0', '10.0.0.1/32'])
+    table = rib.Rib(6)
+    table.append('2001:db8::/129')
+    table.append('2001:db8::/128')
+    self.assertEqual((len(table), table.skipped), (1, 1))
+
+  def test_ipv6_family(self):
+    xml = reply([('10.0.0.0/8', 'static', '192.0.2.1', 'Gi0/0'), ('2001:db8::/32', 'static', '2001:db8::1', 'Gi0/1')])
+    table = rib.extract_chunks([xml], 6)
+    self.assertEqual((len(table), table.skipped), (1, 1))
+    self.assertEqual(table.route(0), ('2001:db8::/32', '2001:db8::1', 'Gi0/1', 'static'))
+
+  def test_chunks_split_anywhere(self):
+    xml = reply([('10.%d.0.0/16' % i, 'bgp', '192.0.2.%d' % i, 'Gi0/%d' % i) for i in range(50)])
+    table = rib.extract_chunks(xml[n:n+7] for n in range(0, len(xml), 7))
+    self.assertEqual([table.route(i) for i in range(len(table))],
+                     [('10.%d.0.0/16' % i, '192.0.2.%d' % i, 'Gi0/%d' % i, 'bgp') for i in range(50)])
+
+  def test_save_load(self):
+    table = rib.extract_string(reply([('10.0.0.0/8', 'static', '192.0.2.1', 'Gi0/0')]))
+    tmp = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmp, 'rib.cols')
+      table.save(path)
+      loaded = rib.Rib.load(path)
+    finally:
+      shutil.rmtree(tmp)
+    self.assertEqual(loaded.route(0), table.route(0))
+
+
+class PrefixTrieTest(unittest.TestCase):
+
+  def random_rib(self, seed, count):
+    rnd = random.Random(seed)
+    table = rib.Rib()
+    # few short prefixes and many nested ones in a narrow range so there are branches at every level
+    for _ in range(count):
+      plen = rnd.choice([0, 8, 12, 16, 20, 24, 24, 28, 30, 32])
+      table.append('%s/%d' % (ip4(0x0a000000 | rnd.getrandbits(20) << rnd.choice([0, 4, 8])), plen),
+                   '192.0.2.%d' % rnd.randint(1, 4), 'Gi0/%d' % rnd.randint(0, 3))
+    return table, rnd
+
+  def test_lookup_matches_brute_force(self):
+    for seed in range(5):
+      table, rnd = self.random_rib(seed, 300)
+      trie = rib.PrefixTrie(table)
+      keys = [table.addr[rnd.randrange(len(table))] ^ rnd.randrange(1 << rnd.choice([0, 4, 12, 24]))
+              for _ in range(500)]
+      self.assertEqual(list(trie.lookup_many(ip4(key) for key in keys)), [brute_force(table, key) for key in keys])
+
+  def test_no_route(self):
+    table = rib.Rib()
+    table.append('10.0.0.0/8')
+    trie = rib.PrefixTrie(table)
+    self.assertEqual(trie.lookup('11.0.0.1'), -1)
+    self.assertEqual(trie.lookup('10.255.0.1'), 0)
+
+  def test_walk_in_prefix_order_without_duplicates(self):
+    table, _ = self.random_rib(7, 300)
+    trie = rib.PrefixTrie(table)
+    routes = list(trie.walk())
+    self.assertEqual(len(routes) + trie.duplicates, len(table))
+    self.assertEqual(routes, sorted(routes, key=trie.sort_key))
+
+  def test_ipv6(self):
+    table = rib.Rib(6)
+    for prefix in ('::/0', '2001:db8::/32', '2001:db8:1::/48', '2001:db8:1:2::/64'):
+      table.append(prefix)
+    trie = rib.PrefixTrie(table)
+    self.assertEqual(trie.lookup('2001:db8:1:2::5'), 3)
+    self.assertEqual(trie.lookup('2001:db8:1:3::5'), 2)
+    self.assertEqual(trie.lookup('2001:db9::1'), 0)
+
+
+class DiffTest(unittest.TestCase):
+
+  def test_added_removed_changed(self):
+    old, new = rib.Rib(), rib.Rib()
+    old.append('10.0.0.0/8', '192.0.2.1', 'Gi0/0')
+    old.append('10.1.0.0/16', '192.0.2.1', 'Gi0/0')
+    old.append('10.2.0.0/16', '192.0.2.1', 'Gi0/0')
+    new.append('10.2.0.0/16', '192.0.2.9', 'Gi0/0')
+    new.append('10.0.0.0/8', '192.0.2.1', 'Gi0/0')
+    new.append('10.3.0.0/16', '192.0.2.1', 'Gi0/0')
+    added, removed, changed = rib.diff(rib.PrefixTrie(old), rib.PrefixTrie(new))
+    self.assertEqual([new.prefix(j) for j in added], ['10.3.0.0/16'])
+    self.assertEqual([old.prefix(i) for i in removed], ['10.1.0.0/16'])
+    self.assertEqual([(old.prefix(i), new.route(j)[1]) for i, j in changed], [('10.2.0.0/16', '192.0.2.9')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+"""
+Tests of series.py - ring buffers, process slots and sample parsing
+
+  python -m unittest test_series
+"""
+import threading
+import unittest
+
+import series
+
+SAMPLE = '''<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1"><data>
+<cpu-usage xmlns="%s"><cpu-utilization>
+<five-seconds>7</five-seconds><one-minute>5</one-minute><five-minutes>3</five-minutes>
+<cpu-usage-processes>
+<cpu-usage-process><pid>1</pid><name>init</name><total-run-time>1000</total-run-time></cpu-usage-process>
+<cpu-usage-process><pid>42</pid><name>bgp</name><total-run-time>250000</total-run-time></cpu-usage-process>
+</cpu-usage-processes>
+</cpu-utilization></cpu-usage>
+<memory-statistics xmlns="%s">
+<memory-statistic><name>Processor</name><total-memory>1000</total-memory><used-memory>250</used-memory></memory-statistic>
+</memory-statistics>
+</data></rpc-reply>''' % (series.CPU_NS, series.MEM_NS)
+
+
+class RingTest(unittest.TestCase):
+
+  def test_wrap_around(self):
+    ring = series.Ring(5, 3)
+    values = [float(v) for v in range(1, 13)]
+    for n, value in enumerate(values, 1):
+      ring.append(value)
+      self.assertEqual(len(ring), min(n, 5))
+      self.assertEqual(list(ring.tail(5)), values[max(0, n - 5):n])
+      self.assertAlmostEqual(ring.average(), sum(values[max(0, n - 3):n]) / min(n, 3))
+    self.assertEqual(ring.last(), 12.0)
+    self.assertEqual(ring.last(4), 8.0)
+    self.assertIsNone(ring.last(5))
+
+  def test_window_larger_than_size(self):
+    ring = series.Ring(2, 10)
+    for value in (1.0, 2.0, 3.0):
+      ring.append(value)
+    self.assertEqual(ring.window, 2)
+    self.assertAlmostEqual(ring.average(), 2.5)
+
+
+class DeviceSeriesTest(unittest.TestCase):
+
+  def test_rates(self):
+    s = series.DeviceSeries('r1', size=10, window=2, slots=4)
+    s.record(100.0, {'five-seconds': 1.0}, {'Processor': (1000.0, 500.0)}, [(1, 'init', 1000.0)])
+    s.record(110.0, {'five-seconds': 2.0}, {'Processor': (1000.0, 600.0)}, [(1, 'init', 3000.0)])
+    self.assertEqual(s.top(1, smoothed=False), [('init', 1, 200.0, s.average[s.slot[(1, 'init')]])])
+    self.assertAlmostEqual(s.cpu['five-seconds'].average(), 1.5)
+    self.assertAlmostEqual(s.memory['Processor'].last(), 60.0)
+    # restarted counter is no negative rate
+    s.record(120.0, {}, {}, [(1, 'init', 10.0)])
+    self.assertEqual(s.top(1, smoothed=False)[0][2], 0.0)
+
+  def test_slots_of_gone_processes_reused(self):
+    s = series.DeviceSeries('r1', slots=2)
+    s.record(1.0, {}, {}, [(1, 'a', 0.0), (2, 'b', 0.0)])
+    s.record(2.0, {}, {}, [(3, 'c', 0.0), (4, 'd', 0.0)])
+    self.assertEqual(sorted(s.slot), [(3, 'c'), (4, 'd')])
+    self.assertEqual(s.dropped, 0)
+    s.record(3.0, {}, {}, [(3, 'c', 0.0), (4, 'd', 0.0), (5, 'e', 0.0)])
+    self.assertEqual(s.dropped, 1)
+
+  def test_pools_limited(self):
+    s = series.DeviceSeries('r1', pools=1)
+    s.record(1.0, {}, {'a': (10.0, 1.0), 'b': (10.0, 2.0)}, [])
+    self.assertEqual(len(s.memory), 1)
+    self.assertEqual(s.dropped, 1)
+
+
+class SampleTest(unittest.TestCase):
+
+  def test_parse_sample(self):
+    cpu, memory, processes = series.parse_sample(SAMPLE)
+    self.assertEqual(cpu, {'five-seconds': 7.0, 'one-minute': 5.0, 'five-minutes': 3.0})
+    self.assertEqual(memory, {'Processor': (1000.0, 250.0)})
+    self.assertEqual(processes, [(1, 'init', 1000.0), (42, 'bgp', 250000.0)])
+
+  def test_poll_reconnects_after_error(self):
+    stop = threading.Event()
+    sessions = []
+
+    class Reply(object):
+      xml = SAMPLE
+
+    class Session(object):
+      def __init__(self):
+        self.gets = 0
+        self.closed = False
+        sessions.append(self)
+
+      def get(self, filter):
+        self.gets += 1
+        if len(sessions) == 1 and self.gets == 2:
+          raise IOError('session dropped')
+        if len(sessions) == 2 and self.gets == 2:
+          stop.set()
+        return Reply()
+
+      def close_session(self):
+        self.closed = True
+
+    s = series.DeviceSeries('r1')
+    series.poll(s, Session, 0.01, stop)
+    self.assertEqual(len(sessions), 2)
+    self.assertTrue(all(session.closed for session in sessions))
+    self.assertEqual((s.samples, s.errors), (3, 1))
+    self.assertTrue(s.last_error.endswith(': session dropped'))
+
+
+if __name__ == '__main__':
+  unittest.main()